@@ -8,13 +8,22 @@ academic_data_converter.py
 使用方法:
 python academic_data_converter.py --input data/academic-joint-angles.json --output data/academic_training.json
 
+# 大量生成時は JSONL を省略し、配列から直接データセットを作る
+python academic_data_converter.py --input data/academic-joint-angles.json --batched --scale 10000 --no-jsonl --format npy --npz data/academic
+
+# build_dataset.py --features hip と同じ腰中心の特徴で書き出す（keypoints は正規化座標なので width/height は 1）
+python academic_data_converter.py --input data/academic-joint-angles.json --batched --no-jsonl --features hip
+
+# 生成・書き出しの所要時間とメモリを Chrome のトレース形式で書き出す（profiling.py）
+python academic_data_converter.py --input data/academic-joint-angles.json --batched --scale 1000 --no-jsonl --profile trace.json
+
 出力形式: 既存システムと互換性のあるJSONL
 [
   {
     "keypoints": [...],  # 関節角度から逆算したkeypoints
     "labels": {"balance": 0.9, "shootForm": 0.95, ...},
     "academic_source": "okubo_hubbard_2015",
-    "metadata": {...}
+    "metadata": {...}   # joint_angles など行ごとの値のみ。引用情報は --sources のサイドテーブルへ
   }
 ]
 """
@@ -23,9 +32,48 @@ import argparse
 import json
 import numpy as np
 import math
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, List, Any, Tuple
 
+import profiling
+from build_cache import BuildCache, cache_key, json_digest
+from dataset_io import DatasetWriter, FORMATS, QUANTIZE_MODES, save_arrays
+from pose_features import FEATURE_SETS, extract_features, feature_dim, feature_spec
+
+LABEL_KEYS = ["balance", "knee", "spine", "stance", "shootForm", "defense", "dribble", "stability"]
+
+# 合成keypointsの基本姿勢（正規化座標）
+BASE_POSE = {
+    'nose': {'x': 0.5, 'y': 0.1, 'score': 0.9},
+    'left_eye': {'x': 0.48, 'y': 0.08, 'score': 0.9},
+    'right_eye': {'x': 0.52, 'y': 0.08, 'score': 0.9},
+    'left_ear': {'x': 0.46, 'y': 0.09, 'score': 0.9},
+    'right_ear': {'x': 0.54, 'y': 0.09, 'score': 0.9},
+    'left_shoulder': {'x': 0.4, 'y': 0.25, 'score': 0.95},
+    'right_shoulder': {'x': 0.6, 'y': 0.25, 'score': 0.95},
+    'left_elbow': {'x': 0.35, 'y': 0.4, 'score': 0.9},
+    'right_elbow': {'x': 0.65, 'y': 0.4, 'score': 0.9},
+    'left_wrist': {'x': 0.3, 'y': 0.55, 'score': 0.9},
+    'right_wrist': {'x': 0.7, 'y': 0.55, 'score': 0.9},
+    'left_hip': {'x': 0.45, 'y': 0.65, 'score': 0.9},
+    'right_hip': {'x': 0.55, 'y': 0.65, 'score': 0.9},
+    'left_knee': {'x': 0.43, 'y': 0.8, 'score': 0.9},
+    'right_knee': {'x': 0.57, 'y': 0.8, 'score': 0.9},
+    'left_ankle': {'x': 0.41, 'y': 0.95, 'score': 0.9},
+    'right_ankle': {'x': 0.59, 'y': 0.95, 'score': 0.9},
+    'mouth': {'x': 0.5, 'y': 0.12, 'score': 0.8}
+}
+
+# MediaPipe Pose形式の17点の並び
+KEYPOINT_ORDER = [
+    'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
+    'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
+    'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
+    'left_knee', 'right_knee', 'left_ankle', 'right_ankle'
+]
+KP = {name: i for i, name in enumerate(KEYPOINT_ORDER)}
+
 
 class AcademicDataConverter:
     def __init__(self):
@@ -67,40 +115,14 @@ class AcademicDataConverter:
         """
         keypoints = []
         
-        # 基本の身体構造（正規化座標）
-        base_pose = {
-            'nose': {'x': 0.5, 'y': 0.1, 'score': 0.9},
-            'left_eye': {'x': 0.48, 'y': 0.08, 'score': 0.9},
-            'right_eye': {'x': 0.52, 'y': 0.08, 'score': 0.9},
-            'left_ear': {'x': 0.46, 'y': 0.09, 'score': 0.9},
-            'right_ear': {'x': 0.54, 'y': 0.09, 'score': 0.9},
-            'left_shoulder': {'x': 0.4, 'y': 0.25, 'score': 0.95},
-            'right_shoulder': {'x': 0.6, 'y': 0.25, 'score': 0.95},
-            'left_elbow': {'x': 0.35, 'y': 0.4, 'score': 0.9},
-            'right_elbow': {'x': 0.65, 'y': 0.4, 'score': 0.9},
-            'left_wrist': {'x': 0.3, 'y': 0.55, 'score': 0.9},
-            'right_wrist': {'x': 0.7, 'y': 0.55, 'score': 0.9},
-            'left_hip': {'x': 0.45, 'y': 0.65, 'score': 0.9},
-            'right_hip': {'x': 0.55, 'y': 0.65, 'score': 0.9},
-            'left_knee': {'x': 0.43, 'y': 0.8, 'score': 0.9},
-            'right_knee': {'x': 0.57, 'y': 0.8, 'score': 0.9},
-            'left_ankle': {'x': 0.41, 'y': 0.95, 'score': 0.9},
-            'right_ankle': {'x': 0.59, 'y': 0.95, 'score': 0.9},
-            'mouth': {'x': 0.5, 'y': 0.12, 'score': 0.8}
-        }
+        # 基本の身体構造（正規化座標）。adjust_pose_by_angles が値を書き換えるので毎回コピーする
+        base_pose = {name: dict(kp) for name, kp in BASE_POSE.items()}
 
         # 関節角度に基づいてkeypointsを調整
         adjusted_pose = self.adjust_pose_by_angles(base_pose, joint_angles, study_metadata)
         
         # MediaPipe Pose形式の17点に変換
-        keypoint_order = [
-            'nose', 'left_eye', 'right_eye', 'left_ear', 'right_ear',
-            'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
-            'left_wrist', 'right_wrist', 'left_hip', 'right_hip',
-            'left_knee', 'right_knee', 'left_ankle', 'right_ankle'
-        ]
-        
-        for joint_name in keypoint_order:
+        for joint_name in KEYPOINT_ORDER:
             if joint_name in adjusted_pose:
                 keypoints.append(adjusted_pose[joint_name])
             else:
@@ -165,8 +187,10 @@ class AcademicDataConverter:
 
         return adjusted
 
-    def calculate_labels_from_study(self, study_name: str, joint_angles: Dict, metadata: Dict) -> Dict[str, float]:
-        """研究データから学習用ラベルを算出"""
+    def calculate_labels_from_study(self, study_name: str, joint_angles: Dict, metadata: Dict,
+                                    rng=None) -> Dict[str, float]:
+        """研究データから学習用ラベルを算出（rng 未指定時はグローバルな np.random を使う）"""
+        rng = rng if rng is not None else np.random
         labels = {
             'balance': 0.5,
             'knee': 0.5,
@@ -197,17 +221,17 @@ class AcademicDataConverter:
                 base_score = 0.8
                 # 経験者は分散が小さい → 高い一貫性
                 labels.update({
-                    'shootForm': base_score + np.random.normal(0, 0.1),
-                    'balance': base_score + np.random.normal(0, 0.08),
-                    'stability': base_score + np.random.normal(0, 0.05)
+                    'shootForm': base_score + rng.normal(0, 0.1),
+                    'balance': base_score + rng.normal(0, 0.08),
+                    'stability': base_score + rng.normal(0, 0.05)
                 })
             else:  # beginner
                 base_score = 0.4
                 # 初心者は分散が大きい → 低い一貫性
                 labels.update({
-                    'shootForm': base_score + np.random.normal(0, 0.2),
-                    'balance': base_score + np.random.normal(0, 0.15),
-                    'stability': base_score + np.random.normal(0, 0.25)
+                    'shootForm': base_score + rng.normal(0, 0.2),
+                    'balance': base_score + rng.normal(0, 0.15),
+                    'stability': base_score + rng.normal(0, 0.25)
                 })
 
         elif study_name == 'anmatsuya_2011':
@@ -215,26 +239,26 @@ class AcademicDataConverter:
             if 'skill_level' in metadata and metadata['skill_level'] == 'expert':
                 # 熟練者: 角度変動が小さい
                 labels.update({
-                    'shootForm': 0.85 + np.random.normal(0, 0.05),
-                    'balance': 0.8 + np.random.normal(0, 0.06),
-                    'stability': 0.88 + np.random.normal(0, 0.04),
-                    'stance': 0.9 + np.random.normal(0, 0.03)  # 下肢安定性
+                    'shootForm': 0.85 + rng.normal(0, 0.05),
+                    'balance': 0.8 + rng.normal(0, 0.06),
+                    'stability': 0.88 + rng.normal(0, 0.04),
+                    'stance': 0.9 + rng.normal(0, 0.03)  # 下肢安定性
                 })
             else:  # novice
                 labels.update({
-                    'shootForm': 0.45 + np.random.normal(0, 0.15),
-                    'balance': 0.4 + np.random.normal(0, 0.18),
-                    'stability': 0.35 + np.random.normal(0, 0.2),
-                    'stance': 0.5 + np.random.normal(0, 0.12)
+                    'shootForm': 0.45 + rng.normal(0, 0.15),
+                    'balance': 0.4 + rng.normal(0, 0.18),
+                    'stability': 0.35 + rng.normal(0, 0.2),
+                    'stance': 0.5 + rng.normal(0, 0.12)
                 })
 
         elif study_name == 'tokyo_university_throwing':
             # 東京大学データ: 関節協調性
             coordination_score = 0.75  # 時系列協調の品質
             labels.update({
-                'shootForm': coordination_score + np.random.normal(0, 0.08),
-                'balance': coordination_score + np.random.normal(0, 0.1),
-                'stability': coordination_score + np.random.normal(0, 0.06)
+                'shootForm': coordination_score + rng.normal(0, 0.08),
+                'balance': coordination_score + rng.normal(0, 0.1),
+                'stability': coordination_score + rng.normal(0, 0.06)
             })
 
         # ラベル値を0-1に正規化
@@ -256,26 +280,28 @@ class AcademicDataConverter:
         score = max(0.0, 1.0 - (deviation / (max_val - min_val)))
         return score
 
-    def generate_training_samples(self, academic_data: Dict) -> List[Dict]:
-        """学術データから学習用サンプルを生成"""
+    def generate_training_samples(self, academic_data: Dict, seed: int = None) -> List[Dict]:
+        """学術データから学習用サンプルを生成（seed 指定時は研究・スキルレベルごとに独立した乱数列を使う）"""
         samples = []
+        rngs = self.spawn_group_rngs(academic_data, seed) if seed is not None else {}
 
         for study_id, study_data in academic_data['studies'].items():
             print(f"📊 {study_id} からサンプル生成中...")
             
             if study_id == 'okubo_hubbard_2015':
+                rng = rngs.get((study_id, None), np.random)
                 # 最適範囲の中央値とばらつきでサンプル生成
                 for i in range(20):  # 20サンプル生成
                     joint_angles = {
-                        'shoulder': np.random.uniform(25, 35),
-                        'elbow': np.random.uniform(90, 110),
-                        'wrist': np.random.uniform(40, 60)
+                        'shoulder': rng.uniform(25, 35),
+                        'elbow': rng.uniform(90, 110),
+                        'wrist': rng.uniform(40, 60)
                     }
                     
                     keypoints = self.generate_synthetic_keypoints(
                         joint_angles, {'study': study_id}
                     )
-                    labels = self.calculate_labels_from_study(study_id, joint_angles, {'study': study_id})
+                    labels = self.calculate_labels_from_study(study_id, joint_angles, {'study': study_id}, rng)
                     
                     sample = {
                         'keypoints': keypoints,
@@ -295,6 +321,7 @@ class AcademicDataConverter:
                 skill_levels = ['experienced', 'beginners']
                 
                 for skill_level in skill_levels:
+                    rng = rngs.get((study_id, skill_level), np.random)
                     skill_data = study_data['joint_angles']
                     sample_count = 25 if skill_level == 'experienced' else 30
                     
@@ -306,13 +333,13 @@ class AcademicDataConverter:
                             if skill_level in stats:
                                 mean = stats[skill_level]['mean']
                                 std = stats[skill_level]['std']
-                                joint_angles[joint] = np.random.normal(mean, std)
+                                joint_angles[joint] = rng.normal(mean, std)
                         
                         keypoints = self.generate_synthetic_keypoints(
                             joint_angles, {'study': study_id, 'skill_level': skill_level}
                         )
                         labels = self.calculate_labels_from_study(
-                            study_id, joint_angles, {'skill_level': skill_level}
+                            study_id, joint_angles, {'skill_level': skill_level}, rng
                         )
                         
                         sample = {
@@ -331,6 +358,7 @@ class AcademicDataConverter:
             elif study_id == 'anmatsuya_2011':
                 # エキスパートと初心者のサンプル
                 for skill_level in ['experts', 'novices']:
+                    rng = rngs.get((study_id, skill_level), np.random)
                     sample_count = 15
                     
                     for i in range(sample_count):
@@ -339,22 +367,22 @@ class AcademicDataConverter:
                         # 研究で報告されている平均値の周辺でサンプリング
                         if skill_level == 'experts':
                             joint_angles = {
-                                'right_elbow': 88 + np.random.normal(0, 2),  # 変動小
-                                'left_shoulder': 114 + np.random.normal(0, 3),
-                                'knee_angle': np.random.uniform(92, 95)
+                                'right_elbow': 88 + rng.normal(0, 2),  # 変動小
+                                'left_shoulder': 114 + rng.normal(0, 3),
+                                'knee_angle': rng.uniform(92, 95)
                             }
                         else:  # novices
                             joint_angles = {
-                                'right_elbow': 91 + np.random.normal(0, 8),  # 変動大
-                                'left_shoulder': 83 + np.random.normal(0, 12),
-                                'knee_angle': np.random.uniform(108, 115)
+                                'right_elbow': 91 + rng.normal(0, 8),  # 変動大
+                                'left_shoulder': 83 + rng.normal(0, 12),
+                                'knee_angle': rng.uniform(108, 115)
                             }
                         
                         keypoints = self.generate_synthetic_keypoints(
                             joint_angles, {'study': study_id, 'skill_level': skill_level}
                         )
                         labels = self.calculate_labels_from_study(
-                            study_id, joint_angles, {'skill_level': skill_level}
+                            study_id, joint_angles, {'skill_level': skill_level}, rng
                         )
                         
                         sample = {
@@ -373,20 +401,354 @@ class AcademicDataConverter:
         print(f"✅ 総計 {len(samples)} サンプルを生成しました")
         return samples
 
-    def save_training_data(self, samples: List[Dict], output_path: str):
-        """学習データをJSONL形式で保存"""
+    # ---- バッチ生成（generate_training_samples の numpy 版） ----
+
+    def sample_groups(self, academic_data: Dict, scale: int = 1) -> List[Tuple[str, Any, int]]:
+        """生成単位 (study_id, skill_level, サンプル数) を generate_training_samples と同じ順で返す"""
+        groups = []
+        for study_id in academic_data['studies']:
+            if study_id == 'okubo_hubbard_2015':
+                groups.append((study_id, None, 20 * scale))
+            elif study_id == 'kinki_imaizumi_2024':
+                groups.append((study_id, 'experienced', 25 * scale))
+                groups.append((study_id, 'beginners', 30 * scale))
+            elif study_id == 'anmatsuya_2011':
+                groups.append((study_id, 'experts', 15 * scale))
+                groups.append((study_id, 'novices', 15 * scale))
+        return groups
+
+    def sample_joint_angles_batch(self, study_id: str, study_data: Dict, skill_level: Any,
+                                  n: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        """1 グループ分の関節角度をまとめてサンプリング（関節名 -> (n,) 配列）"""
+        if study_id == 'okubo_hubbard_2015':
+            return {
+                'shoulder': rng.uniform(25, 35, n),
+                'elbow': rng.uniform(90, 110, n),
+                'wrist': rng.uniform(40, 60, n)
+            }
+        if study_id == 'kinki_imaizumi_2024':
+            angles = {}
+            for joint, stats in study_data['joint_angles'].items():
+                if skill_level in stats:
+                    angles[joint] = rng.normal(stats[skill_level]['mean'], stats[skill_level]['std'], n)
+            return angles
+        if study_id == 'anmatsuya_2011':
+            if skill_level == 'experts':
+                return {
+                    'right_elbow': 88 + rng.normal(0, 2, n),
+                    'left_shoulder': 114 + rng.normal(0, 3, n),
+                    'knee_angle': rng.uniform(92, 95, n)
+                }
+            return {
+                'right_elbow': 91 + rng.normal(0, 8, n),
+                'left_shoulder': 83 + rng.normal(0, 12, n),
+                'knee_angle': rng.uniform(108, 115, n)
+            }
+        return {}
+
+    def adjust_pose_batch(self, joint_angles: Dict[str, np.ndarray], n: int) -> np.ndarray:
+        """adjust_pose_by_angles を角度配列に対して一括適用し、(n, 17, 3) の keypoints を返す"""
+        base = np.array([[BASE_POSE[name]['x'], BASE_POSE[name]['y'], BASE_POSE[name]['score']]
+                         for name in KEYPOINT_ORDER])
+        pose = np.repeat(base[None], n, axis=0)
+
+        # 肘角度 → 手首位置（肩による肘の移動より前の肘位置を使う点もスカラー版と同じ）
+        if 'elbow' in joint_angles or 'left_elbow' in joint_angles or 'right_elbow' in joint_angles:
+            rad = np.radians(joint_angles.get('left_elbow', joint_angles.get('elbow', 90)))
+            pose[:, KP['left_wrist'], 0] = pose[:, KP['left_elbow'], 0] - 0.1 * np.cos(rad)
+            pose[:, KP['left_wrist'], 1] = pose[:, KP['left_elbow'], 1] + 0.1 * np.sin(rad)
+            rad = np.radians(joint_angles.get('right_elbow', joint_angles.get('elbow', 90)))
+            pose[:, KP['right_wrist'], 0] = pose[:, KP['right_elbow'], 0] + 0.1 * np.cos(rad)
+            pose[:, KP['right_wrist'], 1] = pose[:, KP['right_elbow'], 1] + 0.1 * np.sin(rad)
+
+        # 肩角度 → 左肘位置
+        if 'shoulder' in joint_angles or 'left_shoulder' in joint_angles:
+            rad = np.radians(joint_angles.get('left_shoulder', joint_angles.get('shoulder', 30)))
+            pose[:, KP['left_elbow'], 0] = pose[:, KP['left_shoulder'], 0] - 0.08 * np.cos(rad)
+            pose[:, KP['left_elbow'], 1] = pose[:, KP['left_shoulder'], 1] + 0.12 * np.sin(rad)
+
+        # 膝角度 → 深く曲げているサンプルだけ膝を下げる
+        if 'knee_angle' in joint_angles or 'thigh_leg_angle' in joint_angles:
+            knee = np.broadcast_to(joint_angles.get('knee_angle', joint_angles.get('thigh_leg_angle', 90)), (n,))
+            deep = knee < 100
+            pose[deep, KP['left_knee'], 1] += 0.05
+            pose[deep, KP['right_knee'], 1] += 0.05
+
+        return pose
+
+    def evaluate_range_batch(self, values: np.ndarray, min_val: float, max_val: float) -> np.ndarray:
+        """evaluate_range の配列版"""
+        deviation = np.where(values < min_val, min_val - values, values - max_val)
+        score = np.maximum(0.0, 1.0 - deviation / (max_val - min_val))
+        return np.where((values >= min_val) & (values <= max_val), 1.0, score)
+
+    def calculate_labels_batch(self, study_name: str, joint_angles: Dict[str, np.ndarray], skill_level: Any,
+                               n: int, rng: np.random.Generator) -> np.ndarray:
+        """calculate_labels_from_study の配列版。LABEL_KEYS 順の (n, 8) を返す"""
+        labels = {key: np.full(n, 0.5) for key in LABEL_KEYS}
+
+        if study_name == 'okubo_hubbard_2015':
+            shoulder_score = self.evaluate_range_batch(joint_angles.get('shoulder', np.full(n, 30.0)), 25, 35)
+            elbow_score = self.evaluate_range_batch(joint_angles.get('elbow', np.full(n, 90.0)), 90, 110)
+            wrist_score = self.evaluate_range_batch(joint_angles.get('wrist', np.full(n, 50.0)), 40, 60)
+            overall_score = (shoulder_score + elbow_score + wrist_score) / 3
+            labels.update({
+                'shootForm': overall_score,
+                'balance': overall_score * 0.9,
+                'stability': overall_score * 0.95
+            })
+
+        elif study_name == 'kinki_imaizumi_2024':
+            if skill_level == 'experienced':
+                base_score = 0.8
+                labels.update({
+                    'shootForm': base_score + rng.normal(0, 0.1, n),
+                    'balance': base_score + rng.normal(0, 0.08, n),
+                    'stability': base_score + rng.normal(0, 0.05, n)
+                })
+            else:
+                base_score = 0.4
+                labels.update({
+                    'shootForm': base_score + rng.normal(0, 0.2, n),
+                    'balance': base_score + rng.normal(0, 0.15, n),
+                    'stability': base_score + rng.normal(0, 0.25, n)
+                })
+
+        elif study_name == 'anmatsuya_2011':
+            # スカラー版と同じ判定（generate_training_samples は 'experts' を渡すので novice 側になる）
+            if skill_level == 'expert':
+                labels.update({
+                    'shootForm': 0.85 + rng.normal(0, 0.05, n),
+                    'balance': 0.8 + rng.normal(0, 0.06, n),
+                    'stability': 0.88 + rng.normal(0, 0.04, n),
+                    'stance': 0.9 + rng.normal(0, 0.03, n)
+                })
+            else:
+                labels.update({
+                    'shootForm': 0.45 + rng.normal(0, 0.15, n),
+                    'balance': 0.4 + rng.normal(0, 0.18, n),
+                    'stability': 0.35 + rng.normal(0, 0.2, n),
+                    'stance': 0.5 + rng.normal(0, 0.12, n)
+                })
+
+        elif study_name == 'tokyo_university_throwing':
+            coordination_score = 0.75
+            labels.update({
+                'shootForm': coordination_score + rng.normal(0, 0.08, n),
+                'balance': coordination_score + rng.normal(0, 0.1, n),
+                'stability': coordination_score + rng.normal(0, 0.06, n)
+            })
+
+        return np.clip(np.stack([labels[key] for key in LABEL_KEYS], axis=1), 0.0, 1.0)
+
+    def generate_group_batch(self, study_id: str, study_data: Dict, skill_level: Any,
+                             n: int, rng: np.random.Generator) -> Dict[str, Any]:
+        """1 グループ (study, skill_level) 分のサンプルを配列でまとめて生成"""
+        joint_angles = self.sample_joint_angles_batch(study_id, study_data, skill_level, n, rng)
+        return {
+            'study_id': study_id,
+            'skill_level': skill_level,
+            'academic_source': f"{study_id}_{skill_level}" if skill_level else study_id,
+            'keypoints': self.adjust_pose_batch(joint_angles, n),
+            'labels': self.calculate_labels_batch(study_id, joint_angles, skill_level, n, rng),
+            'joint_angles': joint_angles
+        }
+
+    def spawn_group_rngs(self, academic_data: Dict, seed: int = None) -> Dict[Tuple[str, Any], np.random.Generator]:
+        """
+        (study_id, skill_level) ごとに SeedSequence.spawn で独立した乱数列を作る。
+        グループの並び（sample_groups の順）だけで決まるので、生成順や並列数に依存しない。
+        """
+        groups = self.sample_groups(academic_data)
+        children = np.random.SeedSequence(seed).spawn(len(groups))
+        return {(study_id, skill_level): np.random.default_rng(child)
+                for (study_id, skill_level, _), child in zip(groups, children)}
+
+    def generate_training_batches(self, academic_data: Dict, seed: int = None, scale: int = 1,
+                                  workers: int = 1, cache_dir: str = None) -> List[Dict[str, Any]]:
+        """
+        学術データから学習用サンプルをグループ単位の配列として生成（generate_training_samples のバッチ版）。
+        各グループは keypoints (n, 17, 3) と labels (n, 8) を持ち、scale 倍の件数を一度に生成する。
+        グループごとに独立した乱数列を使い、workers > 1 ならプロセスプールで並列に生成する。
+        結果はワーカー数によらずビット単位で同一になる。
+        cache_dir と seed を指定すると、研究データ・件数・seed が変わっていないグループはキャッシュから読む。
+        """
+        seq = np.random.SeedSequence(seed)
+        if seed is None:
+            print(f"🎲 seed 未指定のため自動生成しました（再現するには --seed {seq.entropy}）")
+            if cache_dir:
+                print("⚠️ seed 未指定のためキャッシュは使いません")
+                cache_dir = None
+        cache = BuildCache(cache_dir) if cache_dir else None
+        groups = self.sample_groups(academic_data, scale)
+        tasks = [(study_id, academic_data['studies'][study_id], skill_level, n, child)
+                 for (study_id, skill_level, n), child in zip(groups, seq.spawn(len(groups)))]
+
+        batches = [None] * len(tasks)
+        keys = [None] * len(tasks)
+        for i, (study_id, study_data, skill_level, n, _) in enumerate(tasks):
+            if cache:
+                keys[i] = self.group_cache_key(study_id, study_data, skill_level, n, seed, i)
+                batches[i] = self.load_group_batch(cache, keys[i])
+            if batches[i] is not None:
+                print(f"📦 {study_id} はキャッシュを使用 ({skill_level or 'all'}: {n}件)")
+            else:
+                print(f"📊 {study_id} からサンプル生成中... ({skill_level or 'all'}: {n}件)")
+
+        todo = [i for i, batch in enumerate(batches) if batch is None]
+        if workers > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                generated = list(pool.map(_generate_group, [tasks[i] for i in todo]))
+        else:
+            generated = [_generate_group(tasks[i]) for i in todo]
+        for i, batch in zip(todo, generated):
+            batches[i] = self.store_group_batch(cache, keys[i], batch) if cache else batch
+
+        total = sum(len(b['labels']) for b in batches)
+        print(f"✅ 総計 {total} サンプルを生成しました")
+        return batches
+
+    def group_cache_key(self, study_id: str, study_data: Dict, skill_level: Any, n: int,
+                        seed: int, index: int) -> str:
+        """グループのキャッシュキー（研究データの内容 + 件数 + seed と乱数列の番号 + 出力スキーマ）"""
+        return cache_key(kind='academic_group', study_id=study_id, study=json_digest(study_data),
+                         skill_level=skill_level, n=n, seed=seed, spawn_index=index,
+                         label_keys=LABEL_KEYS, keypoint_order=KEYPOINT_ORDER, base_pose=BASE_POSE)
+
+    def store_group_batch(self, cache: BuildCache, key: str, batch: Dict[str, Any]) -> Dict[str, Any]:
+        """生成したグループをキャッシュに保存する"""
+        tmp = cache.begin(key)
+        angles = {f'angle_{name}': v for name, v in batch['joint_angles'].items()}
+        save_arrays(tmp, 'npy', meta={'study_id': batch['study_id'], 'skill_level': batch['skill_level'],
+                                      'academic_source': batch['academic_source'],
+                                      'joint_angles': list(batch['joint_angles'])},
+                    keypoints=batch['keypoints'], labels=batch['labels'], **angles)
+        cache.commit(key, tmp)
+        return batch
+
+    def load_group_batch(self, cache: BuildCache, key: str):
+        """キャッシュ済みのグループを memmap で読み込む（なければ None）"""
+        ds = cache.load(key)
+        if ds is None:
+            return None
+        return {
+            'study_id': ds.meta['study_id'],
+            'skill_level': ds.meta['skill_level'],
+            'academic_source': ds.meta['academic_source'],
+            'keypoints': ds['keypoints'],
+            'labels': ds['labels'],
+            'joint_angles': {name: ds[f'angle_{name}'] for name in ds.meta['joint_angles']}
+        }
+
+    def iter_batch_samples(self, batches: List[Dict[str, Any]]):
+        """
+        バッチ生成の結果を 1 件ずつ JSONL 用の dict サンプルとして返す。
+        引用情報などの研究ごとに共通なメタデータは行に入れず、サイドテーブル（build_source_table）に置く。
+        """
+        for batch in batches:
+            for i in range(len(batch['labels'])):
+                metadata = {}
+                if batch['skill_level']:
+                    metadata['skill_level'] = batch['skill_level']
+                metadata['joint_angles'] = {k: float(v[i]) for k, v in batch['joint_angles'].items()}
+                metadata['generated'] = True
+                yield {
+                    'keypoints': [{'x': float(x), 'y': float(y), 'score': float(sc)}
+                                  for x, y, sc in batch['keypoints'][i]],
+                    'labels': {k: float(v) for k, v in zip(LABEL_KEYS, batch['labels'][i])},
+                    'academic_source': batch['academic_source'],
+                    'metadata': metadata
+                }
+
+    def save_training_data(self, samples, output_path: str):
+        """学習データをJSONL形式で保存（citation/methodology はサイドテーブルに移すので行からは除く）"""
         output_file = Path(output_path)
         output_file.parent.mkdir(parents=True, exist_ok=True)
-        
+
+        count = 0
         with open(output_file, 'w', encoding='utf-8') as f:
             for sample in samples:
+                metadata = sample.get('metadata')
+                if metadata and ('citation' in metadata or 'methodology' in metadata):
+                    sample = dict(sample)
+                    sample['metadata'] = {k: v for k, v in metadata.items()
+                                          if k not in ('citation', 'methodology')}
                 f.write(json.dumps(sample, ensure_ascii=False) + '\n')
-        
-        print(f"📁 学習データを保存しました: {output_path}")
-        print(f"📊 サンプル数: {len(samples)}")
+                count += 1
 
-    def create_academic_npz(self, jsonl_path: str, npz_path: str):
-        """JSONLからnpz形式に変換（既存build_dataset.pyとの互換性）"""
+        print(f"📁 学習データを保存しました: {output_path}")
+        print(f"📊 サンプル数: {count}")
+
+    def build_source_table(self, academic_data: Dict, source_names: List[str]) -> List[Dict[str, Any]]:
+        """academic_source のインデックス → 研究ID・引用情報のサイドテーブルを作る"""
+        table = []
+        for name in source_names:
+            # academic_source は study_id または f"{study_id}_{skill_level}"
+            study_id = next((sid for sid in academic_data['studies']
+                             if name == sid or name.startswith(sid + '_')), name)
+            study_data = academic_data['studies'].get(study_id, {})
+            table.append({
+                'academic_source': name,
+                'study_id': study_id,
+                'skill_level': name[len(study_id) + 1:] or None,
+                'citation': study_data.get('citation'),
+                'methodology': study_data.get('methodology')
+            })
+        return table
+
+    def save_source_table(self, table: List[Dict[str, Any]], path: str):
+        """サイドテーブルを JSON で保存（データセットの source 配列はこのリストのインデックス）"""
+        out = Path(path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps({'label_keys': LABEL_KEYS, 'sources': table}, ensure_ascii=False, indent=2),
+                       encoding='utf-8')
+        print(f"📚 研究サイドテーブルを保存しました: {path}")
+
+    def samples_to_arrays(self, samples: List[Dict],
+                          features: str = 'raw') -> Tuple[np.ndarray, np.ndarray, List[str], np.ndarray]:
+        """dict サンプルをファイルを経由せずに (X, y, source_names, source) に変換"""
+        kps = np.array([[(kp['x'], kp['y'], kp['score']) for kp in s['keypoints']] for s in samples],
+                       dtype=np.float64).reshape(len(samples), len(KEYPOINT_ORDER), 3)
+        X = extract_features(kps, features=features)
+        y = np.array([[s['labels'].get(key, 0.0) for key in LABEL_KEYS] for s in samples],
+                     dtype=np.float32).reshape(len(samples), len(LABEL_KEYS))
+        source_names = list(dict.fromkeys(s['academic_source'] for s in samples))
+        index = {name: i for i, name in enumerate(source_names)}
+        source = np.array([index[s['academic_source']] for s in samples], dtype=np.int16)
+        return X, y, source_names, source
+
+    def iter_batch_arrays(self, batches: List[Dict[str, Any]], source_names: List[str], features: str = 'raw'):
+        """バッチを (X: n x feature_dim, y: n x 8, source: n) の float32 チャンクとして返す"""
+        index = {name: i for i, name in enumerate(source_names)}
+        for batch in batches:
+            n = len(batch['labels'])
+            yield (extract_features(batch['keypoints'], features=features),
+                   batch['labels'].astype(np.float32),
+                   np.full(n, index[batch['academic_source']], dtype=np.int16))
+
+    def write_academic_dataset(self, chunks, out_path: str, fmt: str, source_names: List[str],
+                               features: str = 'raw', quantize: str = None):
+        """(X, y, source) チャンクを JSONL を経由せずにデータセットとして書き出す"""
+        writer = DatasetWriter(out_path, fmt,
+                               arrays={'X': (feature_dim(features),), 'y': (len(LABEL_KEYS),),
+                                       'source': ((), np.int16)},
+                               meta={'label_keys': LABEL_KEYS, 'sources': source_names,
+                                     'feature_spec': feature_spec(features)},
+                               quantize=quantize)
+        try:
+            for X, y, source in chunks:
+                writer.write(X=X, y=y, source=source)
+        finally:
+            writer.close()
+        print(f"💾 {fmt.upper()}データセットを作成しました: {out_path}")
+        print(f"📊 Shape: X=({writer.rows}, {feature_dim(features)}), y=({writer.rows}, {len(LABEL_KEYS)})")
+        if quantize:
+            q = writer.meta['quantization']
+            print(f"🗜️ {quantize} で量子化: 最大誤差 " + ', '.join(f"{k} {v:.2e}" for k, v in q['max_error'].items()))
+        return writer.rows
+
+    def create_academic_npz(self, jsonl_path: str, npz_path: str, fmt: str = 'npz'):
+        """JSONLからnpz形式に変換（既存build_dataset.pyとの互換性、fmt='npy' で mmap 用ディレクトリ形式）"""
         samples = []
         with open(jsonl_path, 'r', encoding='utf-8') as f:
             for line in f:
@@ -395,8 +757,6 @@ class AcademicDataConverter:
         X = []
         y = []
         
-        label_keys = ["balance", "knee", "spine", "stance", "shootForm", "defense", "dribble", "stability"]
-        
         for sample in samples:
             # keypoints を flat vector に変換
             kp_vector = []
@@ -404,7 +764,7 @@ class AcademicDataConverter:
                 kp_vector.extend([kp['x'], kp['y'], kp['score']])
             
             # ラベルを配列に変換
-            label_vector = [sample['labels'].get(key, 0.0) for key in label_keys]
+            label_vector = [sample['labels'].get(key, 0.0) for key in LABEL_KEYS]
             
             X.append(kp_vector)
             y.append(label_vector)
@@ -412,39 +772,92 @@ class AcademicDataConverter:
         X = np.array(X, dtype=np.float32)
         y = np.array(y, dtype=np.float32)
         
-        np.savez_compressed(npz_path, X=X, y=y)
-        print(f"💾 NPZファイルを作成しました: {npz_path}")
+        save_arrays(npz_path, fmt, meta={'label_keys': LABEL_KEYS, 'feature_spec': feature_spec('raw')}, X=X, y=y)
+        print(f"💾 {fmt.upper()}データセットを作成しました: {npz_path}")
         print(f"📊 Shape: X={X.shape}, y={y.shape}")
 
 
+def _generate_group(task) -> Dict[str, Any]:
+    # プロセスプール用: 1 グループ分を自分専用の乱数列で生成する
+    study_id, study_data, skill_level, n, seed_seq = task
+    rng = np.random.default_rng(seed_seq)
+    return AcademicDataConverter().generate_group_batch(study_id, study_data, skill_level, n, rng)
+
+
 def main():
     parser = argparse.ArgumentParser(description='学術論文データを学習用データセットに変換')
     parser.add_argument('--input', required=True, help='academic-joint-angles.json のパス')
     parser.add_argument('--output', default='data/academic_training.jsonl', help='出力JSONLファイル')
-    parser.add_argument('--npz', default='data/academic_training.npz', help='出力NPZファイル')
+    parser.add_argument('--no-jsonl', action='store_true', help='JSONL を書き出さずにデータセットだけ作る')
+    parser.add_argument('--npz', default='data/academic_training.npz', help='出力NPZファイル（--format npy の場合はディレクトリ）')
+    parser.add_argument('--format', dest='fmt', choices=FORMATS, default='npz', help='データセット形式 (npz / npy)')
+    parser.add_argument('--sources', default='data/academic_sources.json', help='研究ID → 引用情報のサイドテーブル')
+    parser.add_argument('--batched', action='store_true', help='numpy のバッチ生成でサンプルを作る')
+    parser.add_argument('--scale', type=int, default=1, help='--batched 時に各研究のサンプル数を何倍にするか')
+    parser.add_argument('--seed', type=int, help='乱数シード（研究・スキルレベルごとに独立した乱数列を派生）')
+    parser.add_argument('--workers', type=int, default=1, help='--batched 時にグループを並列生成するプロセス数')
+    parser.add_argument('--cache-dir', help='--batched --seed 時に生成済みグループを再利用するキャッシュ')
+    parser.add_argument('--quantize', choices=QUANTIZE_MODES,
+                        help='X / y を小さい型で保存 (float16 / uint16 固定小数点 [-2, 2])。スコアは uint8')
+    parser.add_argument('--features', choices=FEATURE_SETS, default='raw',
+                        help='データセットの特徴 (raw / hip: ブラウザと同じ腰中心 / hip_angles: hip + 関節角度)')
+    parser.add_argument('--profile', metavar='TRACE_JSON',
+                        help='ステージごとの時間・行数・メモリを Chrome のトレース形式で書き出す')
     
     args = parser.parse_args()
+    if args.workers < 1:
+        parser.error('--workers は 1 以上にしてください')
+    if not args.batched:
+        # 1 件ずつの生成はこれらを使わないので、黙って無視せずにエラーにする
+        ignored = [flag for flag, used in (('--workers', args.workers != 1), ('--scale', args.scale != 1),
+                                           ('--cache-dir', args.cache_dir)) if used]
+        if ignored:
+            parser.error(f"{' / '.join(ignored)} は --batched と一緒に指定してください")
+    profiling.start(args.profile)
     
     converter = AcademicDataConverter()
     
     print("🔬 学術論文データ変換開始...")
     
     # 1. 学術データ読み込み
-    academic_data = converter.load_academic_data(args.input)
-    
-    # 2. 学習用サンプル生成
-    samples = converter.generate_training_samples(academic_data)
+    with profiling.stage('load_academic_data'):
+        academic_data = converter.load_academic_data(args.input)
     
-    # 3. JSONL保存
-    converter.save_training_data(samples, args.output)
+    # 2. 学習用サンプル生成 + 3. JSONL保存（任意）
+    if args.batched:
+        with profiling.stage('generate', workers=args.workers):
+            batches = converter.generate_training_batches(academic_data, seed=args.seed, scale=args.scale,
+                                                          workers=args.workers, cache_dir=args.cache_dir)
+        profiling.count('rows_generated', sum(len(b['labels']) for b in batches))
+        if not args.no_jsonl:
+            with profiling.stage('save_jsonl'):
+                converter.save_training_data(converter.iter_batch_samples(batches), args.output)
+        source_names = list(dict.fromkeys(b['academic_source'] for b in batches))
+        # 特徴の計算はチャンクを取り出すたびに走るので、書き出しとは別のイベントにする
+        chunks = profiling.timed_iter('extract_features',
+                                      converter.iter_batch_arrays(batches, source_names, args.features))
+    else:
+        with profiling.stage('generate'):
+            samples = converter.generate_training_samples(academic_data, seed=args.seed)
+        profiling.count('rows_generated', len(samples))
+        if not args.no_jsonl:
+            with profiling.stage('save_jsonl'):
+                converter.save_training_data(samples, args.output)
+        with profiling.stage('extract_features'):
+            X, y, source_names, source = converter.samples_to_arrays(samples, args.features)
+        chunks = [(X, y, source)]
     
-    # 4. NPZ変換
-    converter.create_academic_npz(args.output, args.npz)
+    # 4. データセット書き出し（メモリ上の配列から直接）+ 研究サイドテーブル
+    with profiling.stage('write_dataset', format=args.fmt):
+        total = converter.write_academic_dataset(chunks, args.npz, args.fmt, source_names, args.features,
+                                                 args.quantize)
+    converter.save_source_table(converter.build_source_table(academic_data, source_names), args.sources)
     
+    outputs = [args.npz, args.sources] if args.no_jsonl else [args.output, args.npz, args.sources]
     print("🎉 変換完了!")
     print(f"📚 参照論文数: {academic_data['metadata']['total_studies']}")
-    print(f"📊 生成サンプル数: {len(samples)}")
-    print(f"📁 出力ファイル: {args.output}, {args.npz}")
+    print(f"📊 生成サンプル数: {total}")
+    print(f"📁 出力ファイル: {', '.join(outputs)}")
 
 
 if __name__ == '__main__':
@@ -281,6 +281,42 @@ async function createMoveNetDetectorSafe(modelType) {
 
 // --- AI 評価モデル（オンデバイス TFJS） ---
 let aiModel = null;
+// 学習側（pose_features.py）の FEATURE_SPEC_VERSION と合わせる
+const AI_FEATURE_SPEC_VERSION = 1;
+let aiFeatureSpec = null;
+
+// モデルと同じ場所の feature_spec.json を読み、前処理が学習時と一致するか確認する
+async function loadAIFeatureSpec(modelUrl) {
+  const url = modelUrl.replace(/model\.json$/, "feature_spec.json");
+  try {
+    const resp = await fetch(url, { method: "GET" });
+    if (!resp.ok) return null;
+    const spec = await resp.json();
+    if (spec.version !== AI_FEATURE_SPEC_VERSION) {
+      console.warn(
+        "AIモデルの特徴バージョンが一致しません:",
+        spec.version,
+        "(期待値:",
+        AI_FEATURE_SPEC_VERSION + ")"
+      );
+    } else if (spec.window) {
+      console.warn(
+        "AIモデルは",
+        spec.window,
+        "フレームの窓で学習されています（ブラウザは 1 フレームずつ推論します）"
+      );
+    } else if (spec.features === "raw") {
+      console.warn(
+        "AIモデルは raw 特徴で学習されています（ブラウザは腰中心の特徴で推論します）"
+      );
+    }
+    return spec;
+  } catch (err) {
+    console.log("feature_spec.json 読み込みエラー:", url, err.message);
+    return null;
+  }
+}
+
 async function loadAIPoseModel() {
   if (aiModel) return aiModel;
 
@@ -302,6 +338,7 @@ async function loadAIPoseModel() {
       try {
         // try load as graph model first
         aiModel = await tf.loadGraphModel(c);
+        aiFeatureSpec = await loadAIFeatureSpec(c);
         console.log("AIモデル読み込み成功 (graph):", c);
         return aiModel;
       } catch (e) {
@@ -311,6 +348,7 @@ async function loadAIPoseModel() {
         );
         try {
           aiModel = await tf.loadLayersModel(c);
+          aiFeatureSpec = await loadAIFeatureSpec(c);
           console.log("AIモデル読み込み成功 (layers):", c);
           return aiModel;
         } catch (e2) {
@@ -347,6 +385,14 @@ function preprocessPoseToVector(keypoints) {
     vec.push((kp.y - hipCenterY) / h);
     vec.push(kp.score || 0);
   }
+
+  // hip_angles で学習したモデルは関節角度（0..1 に正規化）も入力に使う
+  const angles = (aiFeatureSpec && aiFeatureSpec.angles) || [];
+  const angleScale = (aiFeatureSpec && aiFeatureSpec.angle_scale) || 180;
+  for (const [, a, b, c] of angles) {
+    const p = (i) => keypoints[i] || { x: 0, y: 0 };
+    vec.push(calculateAngle(p(a), p(b), p(c)) / angleScale);
+  }
   return vec;
 }
 
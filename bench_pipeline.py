@@ -0,0 +1,261 @@
+"""
+bench_pipeline.py
+
+Python データパイプライン（build_dataset.py / academic_data_converter.py / train_model.py）のベンチマーク。
+build_dataset.py 冒頭のフォーマットに従った合成エクスポートを指定サイズで生成し、各ステージの
+処理時間とメモリピークを計測して JSON で書き出します。ベースライン JSON と比較して遅くなった
+ステージを検出することもできます。
+
+計測ステージ:
+ - load_json_items           : エクスポートの読み込み
+ - kp_to_vector              : kp_to_vector/normalize_xy（1 サンプルずつの参照実装）
+ - items_to_arrays           : バッチ版の変換
+ - decode_json               : load_json_items + items_to_keypoints（--decoder json）
+ - decode_schema             : SchemaDecoder での読み込み（--decoder schema）。結果が decode_json と
+                               一致しなければ（build_dataset.check_decoder）ベンチマークを失敗にする
+ - savez_compressed          : np.savez_compressed での書き出し
+ - generate_training_samples : AcademicDataConverter のサンプル生成（1 件ずつ）
+ - generate_training_batches : 同じくバッチ生成
+ - create_academic_npz       : JSONL → npz 変換
+ - train_fit                 : train_model.build_model の短い学習（TensorFlow がある場合のみ）
+
+使い方:
+ python bench_pipeline.py --rows 200000 --out bench/current.json
+ python bench_pipeline.py --rows 200000 --out bench/after.json --baseline bench/current.json --tolerance 0.15
+
+ # ステージごとの区間（計測の繰り返しを含む）と RSS を Chrome のトレース形式で書き出す（profiling.py）
+ python bench_pipeline.py --rows 200000 --profile trace.json
+
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from pathlib import Path
+
+import build_dataset
+import profiling
+from academic_data_converter import AcademicDataConverter
+from profiling import peak_rss_mb
+
+ACADEMIC_JSON = Path(__file__).with_name('academic-joint-angles.json')
+
+
+def generate_export(path, rows, seed=0, missing_rate=0.02, width=640, height=480):
+    """build_dataset.py の入力フォーマットに沿った合成 JSONL を書き出す"""
+    rng = np.random.default_rng(seed)
+    with open(path, 'w', encoding='utf-8') as f:
+        for start in range(0, rows, 10000):
+            n = min(10000, rows - start)
+            xy = rng.uniform(0, 1, (n, build_dataset.EXPECTED_KP, 2)) * (width, height)
+            score = rng.uniform(0, 1, (n, build_dataset.EXPECTED_KP))
+            labels = rng.uniform(0, 1, (n, len(build_dataset.LABEL_KEYS)))
+            missing = rng.random(n) < missing_rate
+            for i in range(n):
+                item = {
+                    'keypoints': [{'x': round(float(x), 2), 'y': round(float(y), 2), 'score': round(float(s), 4)}
+                                  for (x, y), s in zip(xy[i], score[i])],
+                    'labels': {} if missing[i] else {k: round(float(v), 4)
+                                                     for k, v in zip(build_dataset.LABEL_KEYS, labels[i])}
+                }
+                f.write(json.dumps(item) + '\n')
+    return path
+
+
+def measure(fn, repeat=3):
+    """fn を repeat 回実行して最小時間を、別にもう 1 回 tracemalloc 下で実行してメモリピークを測る"""
+    times = []
+    result = None
+    # 各ステージの進捗表示は計測結果の表示と混ざるので捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            gc.collect()
+            t0 = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - t0)
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return result, {
+        'seconds': min(times),
+        'seconds_all': times,
+        'peak_alloc_mb': peak / (1 << 20),
+        'max_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_benchmarks(rows, workdir, repeat=3, scale=1000, train_rows=20000, train_epochs=1, stages=None):
+    workdir = Path(workdir)
+    with profiling.stage('generate_export', rows=rows):
+        export = generate_export(workdir / 'export.jsonl', rows)
+    results = {}
+
+    def want(name):
+        return stages is None or name in stages
+
+    def record(name, fn, n):
+        with profiling.stage(name, rows=n, repeat=repeat):
+            _, stats = measure(fn, repeat)
+        stats['rows'] = n
+        stats['rows_per_sec'] = n / stats['seconds'] if stats['seconds'] else None
+        results[name] = stats
+        print(f"  {name:28s} {stats['seconds']:9.3f}s  {stats['rows_per_sec'] or 0:12.0f} rows/s  "
+              f"peak {stats['peak_alloc_mb']:8.1f} MB")
+        return stats
+
+    items = build_dataset.load_json_items(export)
+    if want('load_json_items'):
+        record('load_json_items', lambda: build_dataset.load_json_items(export), rows)
+
+    def reference():
+        X = []
+        for it in items:
+            kps = it.get('keypoints')
+            if kps and it.get('labels'):
+                X.append(build_dataset.normalize_xy(build_dataset.kp_to_vector(kps), 640, 480))
+        return np.array(X, dtype=np.float32)
+
+    if want('kp_to_vector'):
+        record('kp_to_vector', reference, rows)
+    if want('items_to_arrays'):
+        record('items_to_arrays', lambda: build_dataset.items_to_arrays(items, 640, 480), rows)
+
+    if want('decode_json'):
+        record('decode_json', lambda: build_dataset.load_keypoints(export, 'json'), rows)
+    if want('decode_schema'):
+        mismatch = build_dataset.check_decoder(export, 'schema')
+        if mismatch:
+            raise SystemExit(f'decode_schema does not match decode_json: {mismatch}')
+        record('decode_schema', lambda: build_dataset.load_keypoints(export, 'schema'), rows)
+
+    X, Y, _ = build_dataset.items_to_arrays(items, 640, 480)
+    del items
+    if want('savez_compressed'):
+        record('savez_compressed', lambda: np.savez_compressed(workdir / 'train.npz', X=X, y=Y), len(X))
+
+    converter = AcademicDataConverter()
+    academic_data = converter.load_academic_data(ACADEMIC_JSON)
+    n_academic = sum(n for *_, n in converter.sample_groups(academic_data))
+    if want('generate_training_samples'):
+        record('generate_training_samples',
+               lambda: converter.generate_training_samples(academic_data, seed=0), n_academic)
+    if want('generate_training_batches'):
+        record('generate_training_batches',
+               lambda: converter.generate_training_batches(academic_data, seed=0, scale=scale),
+               n_academic * scale)
+    if want('create_academic_npz'):
+        jsonl = workdir / 'academic.jsonl'
+        with contextlib.redirect_stdout(io.StringIO()):
+            samples = converter.generate_training_samples(academic_data, seed=0)
+            converter.save_training_data(samples, jsonl)
+        record('create_academic_npz',
+               lambda: converter.create_academic_npz(jsonl, workdir / 'academic.npz'), len(samples))
+
+    if want('train_fit'):
+        try:
+            import train_model
+        except ImportError as e:
+            print('  train_fit skipped:', e)
+        else:
+            Xt, Yt = X[:train_rows], Y[:train_rows]
+
+            def fit():
+                model = train_model.build_model(Xt.shape[1], Yt.shape[1])
+                model.fit(Xt, Yt, epochs=train_epochs, batch_size=32, verbose=0)
+
+            record('train_fit', fit, len(Xt) * train_epochs)
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """
+    ベースラインよりスループット（rows/s）が落ちたステージを返す。
+    行数が違う実行同士でも比べられるよう、時間ではなく rows/s の比で判定する。
+    """
+    regressions = []
+    print(f"  {'stage':28s} {'baseline':>12s} {'current':>12s} {'slowdown':>9s}")
+    for name, stats in current['stages'].items():
+        base = baseline.get('stages', {}).get(name)
+        if not base or not base.get('rows_per_sec') or not stats.get('rows_per_sec'):
+            continue
+        slowdown = base['rows_per_sec'] / stats['rows_per_sec']
+        flag = slowdown > 1 + tolerance
+        if flag:
+            regressions.append({'stage': name, 'baseline_rows_per_sec': base['rows_per_sec'],
+                                'current_rows_per_sec': stats['rows_per_sec'], 'slowdown': slowdown})
+        print(f"  {name:28s} {base['rows_per_sec']:12.0f} {stats['rows_per_sec']:12.0f} {slowdown:9.2f}"
+              + ('  REGRESSION' if flag else ''))
+    return regressions
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--rows', type=int, default=100000, help='rows in the synthetic export')
+    p.add_argument('--repeat', type=int, default=3, help='timed runs per stage (the minimum is reported)')
+    p.add_argument('--scale', type=int, default=1000, help='scale for generate_training_batches')
+    p.add_argument('--train-rows', type=int, default=20000)
+    p.add_argument('--train-epochs', type=int, default=1)
+    p.add_argument('--stages', nargs='+', help='only run these stages')
+    p.add_argument('--workdir', help='keep generated files here instead of a temp dir')
+    p.add_argument('--out', help='write results JSON here')
+    p.add_argument('--baseline', help='results JSON to compare against')
+    p.add_argument('--tolerance', type=float, default=0.2, help='allowed throughput drop (e.g. 0.2 = 20%%) before flagging')
+    p.add_argument('--profile', metavar='TRACE_JSON',
+                   help='write stage timings and RSS as a Chrome trace (open in chrome://tracing)')
+    args = p.parse_args()
+
+    profiling.start(args.profile)
+
+    print(f'Benchmarking with {args.rows} rows')
+    if args.workdir:
+        Path(args.workdir).mkdir(parents=True, exist_ok=True)
+        stages = run_benchmarks(args.rows, args.workdir, args.repeat, args.scale,
+                                args.train_rows, args.train_epochs, args.stages)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            stages = run_benchmarks(args.rows, tmp, args.repeat, args.scale,
+                                    args.train_rows, args.train_epochs, args.stages)
+
+    result = {
+        'meta': {
+            'rows': args.rows,
+            'repeat': args.repeat,
+            'scale': args.scale,
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'stages': stages,
+    }
+    regressions = None
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text(encoding='utf-8'))
+        regressions = compare(result, baseline, args.tolerance)
+        result['comparison'] = {'baseline': args.baseline, 'tolerance': args.tolerance,
+                                'regressions': regressions}
+
+    if args.out:
+        out = Path(args.out)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        out.write_text(json.dumps(result, indent=2), encoding='utf-8')
+        print('Wrote', out)
+
+    if regressions:
+        print(f'{len(regressions)} stage(s) slower than baseline by more than {args.tolerance:.0%}')
+        sys.exit(1)
+    if regressions is not None:
+        print('No regressions against', args.baseline)
+
+
+if __name__ == '__main__':
+    main()
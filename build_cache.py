@@ -0,0 +1,99 @@
+"""
+build_cache.py
+
+データセット構築用のコンテンツアドレス型キャッシュ。
+入力ファイルの内容ハッシュと変換オプション（--width/--height, seed, LABEL_KEYS, EXPECTED_KP など）
+からキーを作り、変換済みの配列を npy ディレクトリ（dataset_io の形式）として保存します。
+再ビルド時は新規・変更されたシャードだけを変換し、残りはキャッシュから memmap で読んでマージします。
+
+キャッシュの構成:
+ <root>/<key の先頭2文字>/<key>/  X.npy, y.npy, ..., meta.json
+
+使い方:
+ cache = BuildCache('.build-cache')
+ key = cache_key(kind='build_dataset', input=file_digest(path), width=640, height=480)
+ ds = cache.load(key)
+ if ds is None:
+     tmp = cache.begin(key)
+     ... DatasetWriter(tmp, 'npy', ...) で書き出す ...
+     ds = cache.commit(key, tmp)
+
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from dataset_io import META_FILE, open_dataset
+
+# キャッシュ内容の互換性が変わったら上げる
+CACHE_VERSION = 1
+
+
+def file_digest(path, bufsize=1 << 20):
+    """ファイル内容の sha256（16進）"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(bufsize), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def dataset_digest(path):
+    """データセット（npz ファイル、または npy ディレクトリの全ファイル）の内容の sha256"""
+    path = Path(path)
+    if not path.is_dir():
+        return file_digest(path)
+    return json_digest({f.name: file_digest(f) for f in sorted(path.iterdir()) if f.is_file()})
+
+
+def json_digest(obj):
+    """JSON 化できる値の sha256（キー順は正規化する）"""
+    data = json.dumps(obj, sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def cache_key(**parts):
+    """入力ハッシュと変換オプションからキャッシュキーを作る"""
+    return json_digest({'cache_version': CACHE_VERSION, **parts})
+
+
+class BuildCache:
+    """変換済み配列を key ごとの npy ディレクトリとして保存するキャッシュ"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def entry(self, key):
+        return self.root / key[:2] / key
+
+    def load(self, key):
+        """キャッシュ済みなら open_dataset の結果を、なければ None を返す"""
+        path = self.entry(key)
+        if not (path / META_FILE).exists():
+            return None
+        return open_dataset(path)
+
+    def begin(self, key):
+        """書き込み用の一時ディレクトリを返す（commit でキャッシュに登録される）"""
+        parent = self.entry(key).parent
+        parent.mkdir(parents=True, exist_ok=True)
+        return Path(tempfile.mkdtemp(prefix=f'.{key[:8]}-', dir=parent))
+
+    def commit(self, key, tmp):
+        """一時ディレクトリをアトミックにキャッシュエントリへ移す"""
+        path = self.entry(key)
+        try:
+            os.replace(tmp, path)
+        except OSError:
+            # 別プロセスが先に同じキーを書き終えていた場合はそちらを使う
+            if not (path / META_FILE).exists():
+                raise
+            shutil.rmtree(tmp, ignore_errors=True)
+        return open_dataset(path)
+
+    def abort(self, tmp):
+        shutil.rmtree(tmp, ignore_errors=True)
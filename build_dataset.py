@@ -12,16 +12,78 @@ build_dataset.py
 ]
 
 出力: train.npz (X: N x 51, y: N x 8)
+      --quality-filter で data-collection-system.js の filterHighQualityData と同じ品質ゲートをかける
+      （平均 score >= 0.3、keypoints 5..16 の score > 0.3。--sequence ではセッション単位で 20 フレーム以上も）
+      --sequence の場合は行をセッションごとに連続に並べ替え、per-row の session 番号を足す
+      （dataset_io の Dataset.windows で固定長の窓をコピーなしで取り出せる）
+      --dedup で腰中心の座標を格子に丸めたキーが同じ行（ほぼ同じフレーム）を捨てる（dedup.py）。
+      --dedup weight なら代表行に行数を重み w として付ける（train_model.py が sample_weight に使う）
+      --quantize float16 / uint16 で X / y を小さい型で保存（誤差の上限は dataset_io.py 冒頭、train_model.py が読むときに復元）
+      --features hip / hip_angles でブラウザと同じ腰中心の特徴にする（pose_features.py、hip_angles は N x 57）
+      --format npy の場合は X.npy / y.npy / meta.json を置いたディレクトリ（mmap で読める非圧縮形式）
 
 使い方:
  python build_dataset.py --in exported.json --out data/train.npz
 
+ # analysis.js の preprocessPoseToVector と同じ特徴（腰中心 + 動画サイズで正規化）で作る
+ python build_dataset.py --in exported.json --out data/train.npz --width 640 --height 480 --features hip
+
+ # 大きなエクスポートはストリーミングモードで（メモリ使用量はチャンクサイズで頭打ち）
+ python build_dataset.py --in exported.jsonl --out data/train.npz --stream --chunk-size 65536
+
+ # セッションごとのエクスポートをまとめて並列変換（ディレクトリ / glob も可、入力順にマージ）
+ python build_dataset.py --in "exports/*.jsonl" --out data/train.npz --workers 8
+
+ # 時系列モデル用: "session"（1 ショット / セッションの ID）でフレームをまとめ、"frame" 順に並べる
+ # （session がない行は入力ファイルごとに 1 セッション）
+ python build_dataset.py --in exports/ --out data/seq --format npy --sequence --frame-key frame
+
+ # 低品質フレームを書き出さない（理由ごとの除外件数を表示、しきい値は --min-confidence など）
+ python build_dataset.py --in exports/ --out data/train.npz --quality-filter
+
+ # ほぼ同じフレームを間引く（座標 0.005 刻み、残した行に重み w）
+ python build_dataset.py --in exports/ --out data/train --format npy --width 640 --height 480 --dedup weight
+
+ # どこに時間とメモリを使っているかを Chrome のトレース形式で書き出す（profiling.py、chrome://tracing で開く）
+ python build_dataset.py --in exports/ --out data/train.npz --stream --profile trace.json
+
+ # エクスポート形式専用のデコーダ（JSONL から keypoints / labels を dict を作らずに配列へ。orjson があれば
+ # 形式から外れた行の解析に使う）。--check-decoder で標準の json と同じ配列になることを先に確かめられる
+ python build_dataset.py --in "exports/*.jsonl" --out data/train.npz --decoder schema --check-decoder
+ python build_dataset.py --in "exports/*.jsonl" --out data/train.npz --decoder schema
+
+ # 量子化して保存（座標 uint16 固定小数点 [-2, 2]、スコア・ラベル uint8。float32 の 4 割程度のサイズ）
+ python build_dataset.py --in exports/ --out data/train --format npy --width 640 --height 480 --features hip --quantize uint16
+
+ # 変換済みシャードをキャッシュして、追加・変更されたエクスポートだけを変換する
+ python build_dataset.py --in exports/ --out data/train.npz --cache-dir .build-cache
+
 """
 import argparse
+import glob
+import itertools
 import json
+import operator
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 from pathlib import Path
 
+from build_cache import BuildCache, cache_key, file_digest
+from dataset_io import DatasetWriter, FORMATS, QUANTIZE_MODES, open_dataset, read_meta, save_arrays
+from dedup import DEDUP_MODES, Deduplicator
+from pose_features import FEATURE_SETS, extract_features, feature_dim, feature_spec
+import profiling
+
+try:
+    import orjson
+except ImportError:
+    # 任意の依存。なければ標準の json で読む
+    orjson = None
+
 EXPECTED_KP = 17
 LABEL_KEYS = ["balance","knee","spine","stance","shootForm","defense","dribble","stability"]
 
@@ -52,53 +114,925 @@ def normalize_xy(vec, width=None, height=None):
     return vec
 
 
-def load_json_items(path):
+_KP_FIELDS = operator.itemgetter('x', 'y', 'score')
+_KP_PAD = (0.0, 0.0, 0.0)
+
+
+def _kp_rows(kps):
+    # 1 サンプル分の keypoints を (x, y, score) タプル 17 個にそろえる
+    kps = kps[:EXPECTED_KP]
+    try:
+        rows = list(map(_KP_FIELDS, kps))
+    except (KeyError, TypeError):
+        # キー欠損があるサンプルだけ kp_to_vector と同じく 0 で補う
+        rows = [(kp.get('x',0), kp.get('y',0), kp.get('score',0)) for kp in kps]
+    if len(rows) < EXPECTED_KP:
+        rows.extend([_KP_PAD] * (EXPECTED_KP - len(rows)))
+    return rows
+
+
+def kps_to_array(kps_batch, dtype=np.float32):
+    """
+    keypoints リストのバッチを (N, 17, 3) 配列に一括変換する（kp_to_vector のバッチ版）。
+    要素ごとの float() を避け、数値変換は numpy にまとめて任せる。
+    """
+    n = len(kps_batch)
+    chain = itertools.chain.from_iterable
+    if all(len(kps) == EXPECTED_KP for kps in kps_batch):
+        # よくあるケース（全サンプル 17 点・キー完備）はチャンク全体を一度に平坦化する
+        try:
+            flat = np.fromiter(chain(map(_KP_FIELDS, chain(kps_batch))), dtype=dtype, count=n * EXPECTED_KP * 3)
+            return flat.reshape(n, EXPECTED_KP, 3)
+        except (KeyError, TypeError, ValueError):
+            pass
+    arr = np.array([_kp_rows(kps) for kps in kps_batch], dtype=dtype)
+    return arr.reshape(n, EXPECTED_KP, 3)
+
+
+def labels_to_array(labels_batch, dtype=np.float32):
+    """labels dict のバッチを LABEL_KEYS 順の (N, 8) 配列に変換する"""
+    arr = np.array([[labels.get(k,0) for k in LABEL_KEYS] for labels in labels_batch], dtype=dtype)
+    return arr.reshape(len(labels_batch), len(LABEL_KEYS))
+
+
+class QualityFilter:
+    """
+    data-collection-system.js の filterHighQualityData と同じ品質ゲートを、(N, 17, 3) の配列に
+    ブールマスクとしてまとめてかける。除外理由ごとの件数を counts に数える（1 行が複数の理由に数えられることもある）。
+     - low_confidence    : 17 点の score の平均 < min_confidence
+     - missing_keypoints : required_keypoints のどれかの score <= min_keypoint_score
+     - short_session     : （--sequence のみ）セッションのフレーム数 < min_frames
+    --sequence ではブラウザと同じくセッション単位で判定し（平均は全フレームの全 keypoints、
+    必須 keypoints は全フレームで満たすこと）、不合格のセッションを丸ごと落とす。
+    """
+
+    REASONS = ('low_confidence', 'missing_keypoints', 'short_session')
+
+    def __init__(self, min_confidence=0.3, min_keypoint_score=0.3, required_keypoints=tuple(range(5, 17)),
+                 min_frames=20):
+        self.min_confidence = float(min_confidence)
+        self.min_keypoint_score = float(min_keypoint_score)
+        self.required_keypoints = [int(i) for i in required_keypoints]
+        self.min_frames = int(min_frames)
+        self.counts = dict.fromkeys(('checked', 'rejected') + self.REASONS, 0)
+
+    def config(self):
+        return {'min_confidence': self.min_confidence, 'min_keypoint_score': self.min_keypoint_score,
+                'required_keypoints': self.required_keypoints, 'min_frames': self.min_frames}
+
+    def frame_stats(self, kps):
+        """フレームごとの (score の合計, 必須 keypoints がそろっているか)"""
+        scores = kps[..., 2]
+        required = (scores[:, self.required_keypoints] > self.min_keypoint_score).all(axis=1)
+        return scores.sum(axis=1), required
+
+    def mask(self, kps):
+        """フレーム単位のゲート。通すフレームが True のマスクを返す"""
+        score_sum, required = self.frame_stats(kps)
+        confident = score_sum / EXPECTED_KP >= self.min_confidence
+        keep = confident & required
+        self.counts['checked'] += len(keep)
+        self.counts['rejected'] += int(np.count_nonzero(~keep))
+        self.counts['low_confidence'] += int(np.count_nonzero(~confident))
+        self.counts['missing_keypoints'] += int(np.count_nonzero(~required))
+        return keep
+
+    def session_mask(self, session, score_sum, required, n_sessions):
+        """
+        セッション単位のゲート。フレームごとの session 番号と frame_stats の値から、
+        通すセッションが True の (n_sessions,) マスクを返す。counts はフレーム数で数える
+        """
+        frames = np.bincount(session, minlength=n_sessions)
+        total = np.bincount(session, weights=score_sum, minlength=n_sessions)
+        missing = np.bincount(session, weights=~required, minlength=n_sessions)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            confident = total / (frames * EXPECTED_KP) >= self.min_confidence
+        complete = missing == 0
+        long_enough = frames >= self.min_frames
+        keep = confident & complete & long_enough
+        self.counts['checked'] += int(frames.sum())
+        self.counts['rejected'] += int(frames[~keep].sum())
+        self.counts['low_confidence'] += int(frames[~confident].sum())
+        self.counts['missing_keypoints'] += int(frames[~complete].sum())
+        self.counts['short_session'] += int(frames[~long_enough].sum())
+        return keep
+
+    def merge(self, counts):
+        for k, v in counts.items():
+            self.counts[k] += v
+
+    def summary(self):
+        c = self.counts
+        reasons = ', '.join(f'{k} {c[k]}' for k in self.REASONS if c[k])
+        return f"rejected {c['rejected']} of {c['checked']} frames" + (f' ({reasons})' if reasons else '')
+
+
+def items_to_keypoints(items):
+    """
+    items のチャンクを (keypoints: N x 17 x 3 float64, y: N x 8 float32, skipped) に変換する。
+    keypoints / labels のない行は skipped に数えて除く。
+    """
+    kps_batch = []
+    labels_batch = []
+    skipped = 0
+    for it in items:
+        kps = it.get('keypoints')
+        labels = it.get('labels')
+        if not kps or not labels:
+            skipped += 1
+            continue
+        kps_batch.append(kps)
+        labels_batch.append(labels)
+    return kps_to_array(kps_batch, dtype=np.float64), labels_to_array(labels_batch), skipped
+
+
+def items_to_arrays(items, width=None, height=None, features='raw', quality=None):
+    """
+    items のチャンクを (X: N x feature_dim float32, y: N x 8 float32, skipped) に変換する。
+    features='raw' は kp_to_vector/normalize_xy と同じ結果になるよう、正規化は float64 で行ってから float32 に落とす。
+    quality（QualityFilter）を渡すと、ゲートを通らなかった行も除く（件数は quality.counts に数える）。
+    """
+    kps, Y, skipped = items_to_keypoints(items)
+    X, Y = keypoints_to_arrays(kps, Y, width, height, features, quality)
+    return X, Y, skipped
+
+
+def keypoints_to_arrays(kps, Y, width=None, height=None, features='raw', quality=None):
+    """
+    (keypoints: N x 17 x 3, y: N x 8) を (X: N x feature_dim float32, y) にする。
+    quality（QualityFilter）を渡すと、ゲートを通らなかった行を除く（件数は quality.counts に数える）。
+    """
+    if quality is not None:
+        keep = quality.mask(kps)
+        kps, Y = kps[keep], Y[keep]
+    return extract_features(kps, width, height, features), Y
+
+
+def items_to_features(items, width=None, height=None, features='raw'):
+    """
+    推論用: labels の有無にかかわらず keypoints のある items を (X: N x feature_dim float32, index) に変換する。
+    index は各行が items の何番目から来たか（フレーム番号の対応付け用）。
+    """
+    index = [i for i, it in enumerate(items) if it.get('keypoints')]
+    kps_batch = [items[i]['keypoints'] for i in index]
+    X = extract_features(kps_to_array(kps_batch, dtype=np.float64), width, height, features)
+    return X, np.array(index, dtype=np.int64)
+
+
+def json_loads(text):
+    """
+    orjson があればそちらで、なければ標準の json で読む。
+    orjson は json.dumps が既定で書く NaN / Infinity などを受け付けないので、読めなければ json で読み直す
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(text)
+
+
+def load_json_items(path, loads=json.loads):
     txt = Path(path).read_text(encoding='utf-8')
     txt = txt.strip()
     if txt.startswith('['):
-        return json.loads(txt)
+        return loads(txt)
     else:
         # JSONL: one JSON per line
         items = []
         for line in txt.splitlines():
             line = line.strip()
             if not line: continue
-            items.append(json.loads(line))
+            items.append(loads(line))
         return items
 
 
+def _iter_json_array(f, bufsize=1 << 20):
+    # '[' の直後から要素を 1 件ずつ raw_decode する（ファイル全体は読まない）
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    while True:
+        # 区切り文字と空白を読み飛ばす
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf = f.read(bufsize)
+            pos = 0
+            eof = not buf
+        if pos >= len(buf) or buf[pos] == ']':
+            return
+        try:
+            obj, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = f.read(bufsize)
+            eof = not more
+            buf = buf[pos:] + more
+            pos = 0
+            continue
+        if end == len(buf) and not eof:
+            # 数値などが読み込み境界で切れている可能性があるので続きを読んでから再試行
+            more = f.read(bufsize)
+            if more:
+                buf = buf[pos:] + more
+                pos = 0
+                continue
+            eof = True
+        yield obj
+        pos = end
+
+
+def _read_head(f):
+    # 先頭の空白を飛ばして最初の 1 文字を読む（形式の判定用）
+    head = f.read(1)
+    while head and head.isspace():
+        head = f.read(1)
+    return head
+
+
+def is_json_array(path):
+    """JSON 配列のファイルなら True（JSONL なら False）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return _read_head(f) == '['
+
+
+def iter_json_items(path):
+    """JSON 配列 / JSONL を 1 件ずつ返すジェネレータ（load_json_items のストリーミング版）"""
+    with open(path, 'r', encoding='utf-8') as f:
+        # 先頭の空白を飛ばして形式を判定
+        head = _read_head(f)
+        if head == '[':
+            yield from _iter_json_array(f)
+            return
+        # JSONL: 判定で読んだ 1 文字を最初の行に戻す
+        lines = f
+        if head:
+            lines = itertools.chain([head + f.readline()], f)
+        for line in lines:
+            line = line.strip()
+            if not line: continue
+            yield json.loads(line)
+
+
+def iter_json_lines(path):
+    """JSONL の空でない行を、前後の空白を除いた bytes のまま 1 行ずつ返す（SchemaDecoder 用）"""
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
+
+
+# ---- スキーマ専用の高速デコーダ（--decoder schema） ----
+
+DECODERS = ('json', 'schema')
+
+# 行は bytes のまま扱う（bytes.translate は 256 要素の表引きなので str より速い）
+_KEYPOINTS_RE = re.compile(rb'"keypoints"\s*:\s*\[([^\]]*)\]')
+_LABELS_RE = re.compile(rb'"labels"\s*:\s*\{([^{}]*)\}')
+# JSON の文字列（エスケープを含む）。括弧の深さを数える前に消す
+_STRING_RE = re.compile(rb'"(?:[^"\\]|\\.)*"')
+# 数値に使われる文字と空白。消すと keypoints / labels の「骨格」（キーと区切り）だけが残る
+_NUMERIC_CHARS = b'0123456789+-.eE \t'
+_KP_SKELETONS = [b','.join([b'{"x":,"y":,"score":}'.translate(None, _NUMERIC_CHARS)] * n)
+                 for n in range(EXPECTED_KP + 1)]
+_LABEL_SKELETON = b','.join(f'"{k}":'.encode() for k in LABEL_KEYS).translate(None, _NUMERIC_CHARS)
+# 骨格を確かめた keypoints の数値以外を空白にする（"score" は先に消す）
+_KP_PUNCT = bytes.maketrans(b'{}:,"xy', b'       ')
+_KP_PAD_TEXT = b' 0 0 0'
+
+
+def _parse_numbers(texts, count):
+    # 空白区切りの数値をまとめて 1 回で解析する。数が合わない・解析できない文字があれば None
+    try:
+        values = np.fromstring(b' '.join(texts), sep=' ')
+    except ValueError:
+        return None
+    return values if values.size == count else None
+
+
+class SchemaDecoder:
+    """
+    冒頭のエクスポート形式の JSONL を、行ごとの dict（keypoint ごとの {"x","y","score"}）を作らずに
+    (keypoints: N x 17 x 3 float64, y: N x 8 float32) へ直接変換する（items_to_keypoints と同じ結果）。
+
+    速い経路: 行から "keypoints" の配列と "labels" のオブジェクトを正規表現で切り出し、数値の文字を消した
+    骨格が {"x":,"y":,"score":} の並び（17 点以下）と LABEL_KEYS 順のラベルに一致し、どちらも最上位のキー
+    （入れ子のオブジェクトの中ではない）なら、キーと区切りを空白に置き換えてチャンク全体の数値を
+    np.fromstring 1 回で読む。
+    それ以外の行（キーの順番が違う・name などの余分なフィールド・18 点以上・欠けたラベル・入れ子の中の
+    keypoints / labels など）は
+    orjson（あれば）か json で 1 行ずつ読む。チャンクの数値が読めなければチャンクごと json で読み直す。
+    counts に速い経路で読んだ行数（fast）と 1 行ずつ読んだ行数（fallback）を数える。
+    """
+
+    _SKIP = object()
+
+    def __init__(self):
+        self.counts = {'fast': 0, 'fallback': 0}
+
+    def _split(self, line):
+        # 速い経路に乗る行なら (keypoints の数値, labels の数値) の文字列、空の行なら _SKIP、それ以外は None
+        if line.count(b'"keypoints"') != 1 or line.count(b'"labels"') != 1:
+            return None
+        kp = _KEYPOINTS_RE.search(line)
+        lb = _LABELS_RE.search(line)
+        if kp is None or lb is None:
+            return None
+        seg, lseg = kp.group(1), lb.group(1)
+        if not seg.strip() or not lseg.strip():
+            # keypoints / labels が空の行は items_to_keypoints と同じく除く
+            return self._SKIP
+        n = seg.count(b'{')
+        if n > EXPECTED_KP or seg.translate(None, _NUMERIC_CHARS) != _KP_SKELETONS[n]:
+            return None
+        if lseg.translate(None, _NUMERIC_CHARS) != _LABEL_SKELETON:
+            return None
+        if not self._top_level(line, kp.span(), lb.span()):
+            return None
+        text = seg.replace(b'"score"', b' ').translate(_KP_PUNCT)
+        if n < EXPECTED_KP:
+            text += _KP_PAD_TEXT * (EXPECTED_KP - n)
+        return text, b' '.join([v.partition(b':')[2] for v in lseg.split(b',')])
+
+    @staticmethod
+    def _top_level(line, *spans):
+        # 一致した keypoints / labels が最上位のキーか。骨格を確かめた一致の部分を \0 に置き換え、
+        # 残りの文字列を消してから、それぞれの位置の括弧の深さを数える（{"meta": {"keypoints": ...}} を除く）
+        (a, b), (c, d) = sorted(spans)
+        if b > c:
+            return False
+        rest = _STRING_RE.sub(b'""', line[:a] + b'\0' + line[b:c] + b'\0' + line[d:])
+        for pos in (rest.find(b'\0'), rest.rfind(b'\0')):
+            head = rest[:pos]
+            if head.count(b'{') - head.count(b'}') != 1 or head.count(b'[') != head.count(b']'):
+                return False
+        return True
+
+    def decode(self, lines):
+        """JSONL の行（bytes）のチャンクを (keypoints, y, skipped) に変換する"""
+        kp_text, label_text, fallback, fast = [], [], [], []
+        skipped = 0
+        for line in lines:
+            parts = self._split(line)
+            if parts is self._SKIP:
+                skipped += 1
+            elif parts is not None:
+                kp_text.append(parts[0])
+                label_text.append(parts[1])
+                fast.append(True)
+            else:
+                it = json_loads(line)
+                kps, labels = it.get('keypoints'), it.get('labels')
+                if not kps or not labels:
+                    skipped += 1
+                    continue
+                fallback.append((kps, labels))
+                fast.append(False)
+        values = _parse_numbers(kp_text, len(kp_text) * EXPECTED_KP * 3)
+        label_values = _parse_numbers(label_text, len(label_text) * len(LABEL_KEYS))
+        if values is None or label_values is None:
+            self.counts['fallback'] += len(lines)
+            return items_to_keypoints([json_loads(line) for line in lines])
+        fast = np.array(fast, dtype=bool)
+        kps = np.empty((len(fast), EXPECTED_KP, 3), dtype=np.float64)
+        Y = np.empty((len(fast), len(LABEL_KEYS)), dtype=np.float32)
+        kps[fast] = values.reshape(-1, EXPECTED_KP, 3)
+        Y[fast] = label_values.reshape(-1, len(LABEL_KEYS))
+        if fallback:
+            kps[~fast] = kps_to_array([k for k, _ in fallback], dtype=np.float64)
+            Y[~fast] = labels_to_array([labels for _, labels in fallback])
+        self.counts['fast'] += len(kp_text)
+        self.counts['fallback'] += len(lines) - len(kp_text)
+        return kps, Y, skipped
+
+
+def iter_keypoint_chunks(path, chunk_size=65536, decoder='json'):
+    """
+    path を chunk_size 件ずつ (keypoints: N x 17 x 3 float64, y: N x 8 float32, 件数, skipped) にして返す。
+    decoder='json' は iter_json_items + items_to_keypoints、'schema' は JSONL を SchemaDecoder で読む
+    （JSON 配列のファイルは 'json' と同じく 1 件ずつ解析する）。
+    """
+    if decoder not in DECODERS:
+        raise ValueError(f'unknown decoder: {decoder} (expected one of {DECODERS})')
+    if decoder == 'schema' and not is_json_array(path):
+        schema = SchemaDecoder()
+        for lines in iter_chunks(iter_json_lines(path), chunk_size):
+            fast = schema.counts['fast']
+            kps, Y, skipped = schema.decode(lines)
+            profiling.count('rows_fast_decoded', schema.counts['fast'] - fast)
+            yield kps, Y, len(lines), skipped
+        return
+    for items in iter_chunks(iter_json_items(path), chunk_size):
+        kps, Y, skipped = items_to_keypoints(items)
+        yield kps, Y, len(items), skipped
+
+
+def _concat_chunks(chunks):
+    # iter_keypoint_chunks の結果を 1 つにまとめる
+    chunks = list(chunks)
+    if not chunks:
+        kps, Y, _ = items_to_keypoints([])
+        return kps, Y, 0, 0
+    kps, Y, rows, skipped = zip(*chunks)
+    return np.concatenate(kps), np.concatenate(Y), sum(rows), sum(skipped)
+
+
+def load_keypoints(path, decoder='json'):
+    """
+    ファイル全体を (keypoints, y, 件数, skipped) に変換する（iter_keypoint_chunks の一括版）。
+    'schema' では JSON 配列のファイルも orjson（あれば）で一度に読む
+    """
+    if decoder == 'schema' and not is_json_array(path):
+        return _concat_chunks(iter_keypoint_chunks(path, decoder=decoder))
+    items = load_json_items(path, json_loads if decoder == 'schema' else json.loads)
+    kps, Y, skipped = items_to_keypoints(items)
+    return kps, Y, len(items), skipped
+
+
+def check_decoder(path, decoder='schema', chunk_size=65536):
+    """
+    decoder の結果を load_json_items（標準の json）+ items_to_keypoints と比べる。
+    一致すれば None、違えばその説明を返す
+    """
+    ref_kps, ref_Y, ref_skipped = items_to_keypoints(load_json_items(path))
+    kps, Y, _, skipped = _concat_chunks(iter_keypoint_chunks(path, chunk_size, decoder))
+    if skipped != ref_skipped or kps.shape != ref_kps.shape:
+        return (f'{len(kps)} rows / {skipped} skipped, '
+                f'expected {len(ref_kps)} rows / {ref_skipped} skipped')
+    for name, got, ref in (('keypoints', kps, ref_kps), ('labels', Y, ref_Y)):
+        if got.dtype != ref.dtype or not np.array_equal(got, ref, equal_nan=True):
+            bad = np.flatnonzero(~((got == ref) | (np.isnan(got) & np.isnan(ref))).reshape(len(got), -1).all(axis=1))
+            return f'{name} differ in {len(bad)} rows (first row {bad[0] if len(bad) else "-"}, dtype {got.dtype})'
+    return None
+
+
+class ChunkBuffer:
+    """固定サイズの float32 バッファに行を詰め、満杯になったら writer に流す"""
+
+    def __init__(self, writer, chunk_size=65536, x_dim=EXPECTED_KP * 3):
+        self.writer = writer
+        self.X = np.empty((chunk_size, x_dim), dtype=np.float32)
+        self.Y = np.empty((chunk_size, len(LABEL_KEYS)), dtype=np.float32)
+        self.n = 0
+
+    def extend(self, X, Y):
+        # 任意の行数のバッチを受け取り、チャンク単位に詰め直す
+        i = 0
+        while i < len(X):
+            take = min(len(self.X) - self.n, len(X) - i)
+            self.X[self.n:self.n + take] = X[i:i + take]
+            self.Y[self.n:self.n + take] = Y[i:i + take]
+            self.n += take
+            i += take
+            if self.n == len(self.X):
+                self.flush()
+
+    def flush(self):
+        if self.n:
+            self.writer.write(X=self.X[:self.n], y=self.Y[:self.n])
+            self.n = 0
+
+
+def iter_chunks(iterable, size):
+    """iterable を size 件ずつのリストに区切る"""
+    it = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(it, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def dataset_meta(width=None, height=None, features='raw'):
+    """データセットの meta（ラベル順と特徴の定義）"""
+    return {'label_keys': LABEL_KEYS, 'feature_spec': feature_spec(features, width, height)}
+
+
+def default_coord_range(features='raw', width=None, height=None):
+    """
+    uint16 量子化の座標範囲。動画サイズで割った座標（hip は腰中心なので負にもなる）は [-2, 2] に収まる。
+    raw で --width/--height がないピクセル座標は範囲を決められないので None（--quantize-range で指定する）
+    """
+    if features == 'raw' and not (width and height):
+        return None
+    return (-2.0, 2.0)
+
+
+def open_writer(out, fmt='npz', width=None, height=None, features='raw', sequence=False,
+                quantize=None, coord_range=None):
+    """X/y 用の DatasetWriter を作る（sequence=True なら per-row の session 番号も、quantize で量子化）"""
+    arrays = {'X': (feature_dim(features),), 'y': (len(LABEL_KEYS),)}
+    if sequence:
+        arrays['session'] = ((), np.int32)
+    return DatasetWriter(out, fmt, arrays=arrays, meta=dataset_meta(width, height, features),
+                         quantize=quantize, coord_range=coord_range or (-2.0, 2.0))
+
+
+def finish_dedup(writer, dedup):
+    """重複排除の設定と件数を meta に残し、weight モードなら重み w を足す（writer.close() の前に呼ぶ）"""
+    if dedup is None:
+        return
+    writer.meta['dedup'] = dict(dedup.config(), counts=dedup.counts)
+    if dedup.mode == 'weight':
+        writer.add_array('w', dedup.weights())
+
+
+def build_streaming(path, out, width=None, height=None, chunk_size=65536, fmt='npz', features='raw',
+                    quantize=None, coord_range=None, quality=None, dedup=None, decoder='json'):
+    """
+    ストリーミングでデータセットを作成する。戻り値は (書き出し行数, skipped)
+    quality / dedup で間引かれて小さくなったチャンクは ChunkBuffer が chunk_size 行にまとめ直してから書く。
+    decoder は iter_keypoint_chunks に渡す（'schema' で JSONL を SchemaDecoder で読む）。
+    """
+    writer = open_writer(out, fmt, width, height, features, quantize=quantize, coord_range=coord_range)
+    buf = ChunkBuffer(writer, chunk_size, feature_dim(features))
+    skipped = 0
+    profiling.count('bytes_read', os.path.getsize(path))
+    try:
+        chunks = iter_keypoint_chunks(path, chunk_size, decoder)
+        for kps, Y, rows, n_skip in profiling.timed_iter('parse_json', chunks):
+            with profiling.stage('to_arrays', rows=rows):
+                X, Y = keypoints_to_arrays(kps, Y, width, height, features, quality)
+            skipped += n_skip
+            profiling.count('rows_parsed', rows)
+            profiling.count('rows_skipped', n_skip)
+            if dedup is not None:
+                with profiling.stage('dedup'):
+                    keep = dedup.filter(X)
+                X, Y = X[keep], Y[keep]
+            with profiling.stage('write'):
+                buf.extend(X, Y)
+        buf.flush()
+        if quality is not None:
+            writer.meta['quality'] = dict(quality.config(), counts=quality.counts)
+        finish_dedup(writer, dedup)
+    finally:
+        writer.close()
+    return writer.rows, skipped
+
+
+def build_sequences(paths, out, width=None, height=None, chunk_size=65536, fmt='npz', features='raw',
+                    session_key='session', frame_key=None, quantize=None, coord_range=None, quality=None):
+    """
+    全入力のフレームをセッションごとに連続した配列として書き出す（--sequence）。
+    1 回目の走査で到着順のまま一時 npy に書き、session（と frame_key）の安定ソート順で
+    memmap から読み直して書き出す。セッションの並びは最初に現れた順、同じ frame 値は入力順のまま。
+    quality があれば 1 回目にフレームごとの score 合計と必須 keypoints の有無も残し、
+    QualityFilter.session_mask で不合格のセッションを並べ替えの段階で除く。
+    戻り値は (書き出し行数, skipped, セッション名のリスト)
+    """
+    tmp_dir = Path(tempfile.mkdtemp(prefix='.sequence-', dir=Path(out).parent))
+    arrival = DatasetWriter(tmp_dir, 'npy', arrays={'X': (feature_dim(features),), 'y': (len(LABEL_KEYS),),
+                                                    'session': ((), np.int32), 'frame': ((), np.float64),
+                                                    'score_sum': ((), np.float64), 'required': ((), np.bool_)})
+    codes = {}
+    skipped = 0
+    try:
+        for path in paths:
+            profiling.count('bytes_read', os.path.getsize(path))
+            for items in profiling.timed_iter('parse_json', iter_chunks(iter_json_items(path), chunk_size)):
+                kept = [it for it in items if it.get('keypoints') and it.get('labels')]
+                skipped += len(items) - len(kept)
+                profiling.count('rows_parsed', len(items))
+                profiling.count('rows_skipped', len(items) - len(kept))
+                kps, Y, _ = items_to_keypoints(kept)
+                if quality is not None:
+                    score_sum, required = quality.frame_stats(kps)
+                else:
+                    score_sum, required = np.zeros(len(kps)), np.ones(len(kps), dtype=bool)
+                session = [codes.setdefault(str(it.get(session_key, path)), len(codes)) for it in kept]
+                frame = [it.get(frame_key, np.nan) if frame_key else 0 for it in kept]
+                arrival.write(X=extract_features(kps, width, height, features), y=Y,
+                              session=np.array(session, dtype=np.int32), frame=np.array(frame, dtype=np.float64),
+                              score_sum=score_sum, required=required)
+        arrival.close()
+        tmp = open_dataset(tmp_dir)
+        session = np.asarray(tmp['session'])
+        # lexsort / kind='stable' なので同じキーの中では入力順が保たれる
+        with profiling.stage('sort_sessions', rows=len(session)):
+            order = np.lexsort((tmp['frame'], session)) if frame_key else np.argsort(session, kind='stable')
+        writer = open_writer(out, fmt, width, height, features, sequence=True,
+                             quantize=quantize, coord_range=coord_range)
+        writer.meta.update({'sessions': list(codes), 'session_key': session_key, 'frame_key': frame_key})
+        if quality is not None:
+            keep = quality.session_mask(session, tmp['score_sum'], tmp['required'], len(codes))
+            order = order[keep[session[order]]]
+            writer.meta['quality'] = dict(quality.config(), counts=quality.counts)
+        try:
+            for start in range(0, len(order), chunk_size):
+                idx = order[start:start + chunk_size]
+                with profiling.stage('write'):
+                    writer.write(X=tmp.X[idx], y=tmp.y[idx], session=session[idx])
+        finally:
+            writer.close()
+        del tmp
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return writer.rows, skipped, list(codes)
+
+
+def resolve_inputs(patterns):
+    """
+    --in に渡されたファイル / ディレクトリ / glob を入力シャードの一覧に展開する。
+    各パターン内はパス名順にソートし、重複は除く（マージ順を決定的にするため）。
+    """
+    shards = []
+    seen = set()
+    for pattern in patterns:
+        p = Path(pattern)
+        if p.is_dir():
+            found = sorted(q for q in p.iterdir() if q.is_file() and q.suffix in ('.json', '.jsonl'))
+        elif p.exists():
+            found = [p]
+        else:
+            found = sorted(Path(q) for q in glob.glob(pattern, recursive=True) if Path(q).is_file())
+        if not found:
+            raise FileNotFoundError(f'no input matched: {pattern}')
+        for q in found:
+            key = q.resolve()
+            if key not in seen:
+                seen.add(key)
+                shards.append(q)
+    return shards
+
+
+def shard_cache_key(path, width=None, height=None, features='raw', quality=None):
+    """シャードのキャッシュキー（入力内容 + 特徴の定義 + 品質ゲートの設定 + 出力スキーマ）"""
+    return cache_key(kind='build_dataset', input=file_digest(path), features=feature_spec(features, width, height),
+                     quality=quality, label_keys=LABEL_KEYS, expected_kp=EXPECTED_KP)
+
+
+def build_shard(task):
+    """
+    1 シャードを解析して X/y を npy ディレクトリに書き出す（プロセスプール用のワーカー関数）。
+    cache_root があれば内容ハッシュで引き、ヒットすれば変換せずにキャッシュのエントリを返す。
+    quality は QualityFilter.config() の dict（None なら品質ゲートなし）。
+    decoder はどれでも同じ配列になるのでキャッシュキーには入れない。
+    戻り値は (入力パス, 行数, skipped, 出力ディレクトリ, キャッシュヒットしたか, 品質ゲートの除外件数)
+    """
+    index, path, tmp_dir, width, height, features, chunk_size, cache_root, quality, decoder = task
+    cache = BuildCache(cache_root) if cache_root else None
+    if cache:
+        key = shard_cache_key(path, width, height, features, quality)
+        ds = cache.load(key)
+        if ds is not None:
+            return str(path), len(ds), ds.meta.get('skipped', 0), str(ds.path), True, ds.meta.get('quality_counts')
+        out = cache.begin(key)
+    else:
+        out = Path(tmp_dir) / f'{index:05d}'
+    gate = QualityFilter(**quality) if quality else None
+    writer = open_writer(out, 'npy', width, height, features)
+    skipped = 0
+    try:
+        for kps, Y, _, n_skip in iter_keypoint_chunks(path, chunk_size, decoder):
+            X, Y = keypoints_to_arrays(kps, Y, width, height, features, gate)
+            skipped += n_skip
+            writer.write(X=X, y=Y)
+        writer.meta.update({'source': str(path), 'skipped': skipped,
+                            'quality_counts': gate.counts if gate else None})
+        writer.close()
+    except BaseException:
+        if cache:
+            cache.abort(out)
+        raise
+    if cache:
+        out = cache.commit(key, out).path
+    return str(path), writer.rows, skipped, str(out), False, writer.meta['quality_counts']
+
+
+def build_sharded(paths, out, width=None, height=None, chunk_size=65536, workers=1, fmt='npz',
+                  cache_dir=None, features='raw', quantize=None, coord_range=None, quality=None, dedup=None,
+                  decoder='json'):
+    """
+    複数シャードをプロセスプールで並列に変換し、入力順に 1 つのデータセットへマージする。
+    cache_dir を指定すると変換済みシャードを再利用し、新規・変更分だけを変換する。
+    シャード（とキャッシュ）は float32 のまま持ち、quantize はマージ後の出力にだけかける。
+    quality の品質ゲートは各ワーカーでかけ、除外件数は quality.counts に合算する。
+    dedup はシャードをまたいで効くようにマージの段階でかける（キャッシュには重複排除前のシャードが残る）。
+    戻り値は (書き出し行数, skipped 合計, シャードごとの (パス, 行数, skipped, キャッシュヒット) のリスト)
+    """
+    writer = open_writer(out, fmt, width, height, features, quantize=quantize, coord_range=coord_range)
+    tmp_dir = tempfile.mkdtemp(prefix='.shards-', dir=Path(out).parent)
+    config = quality.config() if quality is not None else None
+    tasks = [(i, str(p), tmp_dir, width, height, features, chunk_size, cache_dir, config, decoder)
+             for i, p in enumerate(paths)]
+    per_shard = []
+    skipped = 0
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        results = pool.map(build_shard, tasks) if pool else map(build_shard, tasks)
+        # map は入力順に結果を返すので、ワーカー数によらずマージ順は一定
+        # （wait_shard はワーカーの変換待ち、workers=1 なら変換そのものの時間）
+        for path, rows, n_skip, shard_dir, cached, counts in profiling.timed_iter('wait_shard', results):
+            profiling.count('bytes_read', os.path.getsize(path))
+            profiling.count('rows_parsed', rows + n_skip)
+            profiling.count('rows_skipped', n_skip)
+            profiling.count('shards_cached', int(cached))
+            shard = open_dataset(shard_dir)
+            for start in range(0, rows, chunk_size):
+                X, Y = shard.X[start:start + chunk_size], shard.y[start:start + chunk_size]
+                if dedup is not None:
+                    with profiling.stage('dedup'):
+                        keep = dedup.filter(X)
+                    X, Y = X[keep], Y[keep]
+                with profiling.stage('merge', shard=str(path)):
+                    writer.write(X=X, y=Y)
+            del shard
+            if not cache_dir:
+                shutil.rmtree(shard_dir, ignore_errors=True)
+            per_shard.append((path, rows, n_skip, cached))
+            skipped += n_skip
+            if quality is not None:
+                quality.merge(counts)
+        if quality is not None:
+            writer.meta['quality'] = dict(config, counts=quality.counts)
+        finish_dedup(writer, dedup)
+    finally:
+        if pool:
+            pool.shutdown(cancel_futures=True)
+        writer.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return writer.rows, skipped, per_shard
+
+
+def print_quantization(out):
+    """量子化した出力なら、書き出し時に測った最大誤差を上限と並べて表示する"""
+    q = read_meta(out).get('quantization')
+    if not q:
+        return
+    for part, err in q['max_error'].items():
+        bound = q['bound'].get(part)
+        if bound is not None:
+            limit = f'bound {bound:.2e}'
+        else:
+            limit = (f"bound max({q['bound']['coords_relative']:.2e} * |v|, "
+                     f"{q['bound'].get('coords_absolute', 0.0):.1e})")
+        clipped = f", {q['clipped'][part]} clipped" if q['clipped'][part] else ''
+        print(f"  {q['mode']} {part}: max error {err:.2e} ({limit}{clipped})")
+
+
+def print_quality(quality):
+    if quality is not None:
+        profiling.count('rows_rejected_quality', quality.counts['rejected'])
+        print(f'  quality filter: {quality.summary()}')
+
+
+def print_dedup(dedup):
+    if dedup is not None:
+        profiling.count('rows_dropped_dedup', dedup.counts['dropped'])
+        print(f'  dedup: {dedup.summary()}')
+
+
 def main():
     p = argparse.ArgumentParser()
-    p.add_argument('--in', dest='input', required=True, help='input JSON or JSONL file')
-    p.add_argument('--out', dest='out', required=True, help='output npz file')
+    p.add_argument('--in', dest='input', required=True, nargs='+',
+                   help='input JSON/JSONL file(s), directories or glob patterns')
+    p.add_argument('--out', dest='out', required=True, help='output npz file (or directory with --format npy)')
     p.add_argument('--width', type=int, help='video width if you want to normalize x')
     p.add_argument('--height', type=int, help='video height if you want to normalize y')
+    p.add_argument('--stream', action='store_true', help='stream the input with bounded memory')
+    p.add_argument('--chunk-size', type=int, default=65536, help='rows per buffer in --stream mode')
+    p.add_argument('--format', dest='fmt', choices=FORMATS, default='npz',
+                   help='npz: compressed single file, npy: uncompressed directory that loads with mmap')
+    p.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                   help='worker processes when several input shards are given')
+    p.add_argument('--cache-dir', help='reuse converted shards keyed on input content and options')
+    p.add_argument('--sequence', action='store_true',
+                   help='group frames by session and store each session contiguously (for window datasets)')
+    p.add_argument('--session-key', default='session',
+                   help='item field holding the session/shot id in --sequence mode (default: one session per file)')
+    p.add_argument('--frame-key', help='item field to order frames within a session by (default: input order)')
+    p.add_argument('--quantize', choices=QUANTIZE_MODES,
+                   help='store X/y compactly: float16 (float16 coords/labels) or uint16 (fixed-point coords, '
+                        'uint8 labels); scores are uint8 in both')
+    p.add_argument('--quantize-range', type=float, nargs=2, metavar=('LO', 'HI'),
+                   help='coordinate range for --quantize uint16 (default -2 2 for normalized coordinates)')
+    p.add_argument('--features', choices=FEATURE_SETS, default='raw',
+                   help='raw: x,y,score as exported; hip: hip-centered like preprocessPoseToVector in analysis.js; '
+                        'hip_angles: hip plus knee/elbow/shoulder angles')
+    p.add_argument('--quality-filter', action='store_true',
+                   help='drop low-quality frames like filterHighQualityData (per session in --sequence mode)')
+    p.add_argument('--min-confidence', type=float, default=0.3,
+                   help='minimum average keypoint score for --quality-filter')
+    p.add_argument('--min-keypoint-score', type=float, default=0.3,
+                   help='score each required keypoint must exceed for --quality-filter')
+    p.add_argument('--required-keypoints', type=int, nargs='+', default=list(range(5, 17)), metavar='INDEX',
+                   help='keypoints that must be visible for --quality-filter (default: 5..16, shoulders to ankles)')
+    p.add_argument('--min-frames', type=int, default=20,
+                   help='minimum frames per session for --quality-filter in --sequence mode')
+    p.add_argument('--dedup', choices=DEDUP_MODES,
+                   help='drop near-duplicate frames (drop), or keep one per group with its count as weight w (weight)')
+    p.add_argument('--dedup-tolerance', type=float, default=0.005,
+                   help='grid size for --dedup in the units of X (normalized by --width/--height, else pixels)')
+    p.add_argument('--dedup-capacity', type=int, default=2_000_000,
+                   help='distinct poses remembered per index generation for --dedup (about 64-128 bytes each)')
+    p.add_argument('--decoder', choices=DECODERS, default='json',
+                   help='json: generic json.loads per row; schema: extract keypoints/labels of the export schema '
+                        'straight into arrays (JSONL; other rows fall back to orjson if installed, else json)')
+    p.add_argument('--check-decoder', action='store_true',
+                   help='only check that --decoder gives the same arrays as the generic json decoder, then exit')
+    p.add_argument('--profile', metavar='TRACE_JSON',
+                   help='write stage timings, counters and RSS as a Chrome trace (open in chrome://tracing)')
     args = p.parse_args()
+    profiling.start(args.profile)
 
-    items = load_json_items(args.input)
-    X = []
-    Y = []
-    skipped = 0
-    for it in items:
-        kps = it.get('keypoints')
-        labels = it.get('labels')
-        if not kps or not labels:
-            skipped += 1
-            continue
-        vec = kp_to_vector(kps)
-        if args.width and args.height:
-            vec = normalize_xy(vec, args.width, args.height)
-        # build y in LABEL_KEYS order, expect 0..1 floats (if 1..5 scale, user should convert)
-        y = [float(labels.get(k,0)) for k in LABEL_KEYS]
-        X.append(vec)
-        Y.append(y)
-
-    X = np.array(X, dtype=np.float32)
-    Y = np.array(Y, dtype=np.float32)
-    outpath = Path(args.out)
-    outpath.parent.mkdir(parents=True, exist_ok=True)
-    np.savez_compressed(outpath, X=X, y=Y)
+    if args.check_decoder:
+        failed = 0
+        for path in resolve_inputs(args.input):
+            mismatch = check_decoder(path, args.decoder, args.chunk_size)
+            failed += mismatch is not None
+            print(f'  {path}: ' + (mismatch or f'{args.decoder} decoder matches json'))
+        if failed:
+            raise SystemExit(f'{failed} input(s) decode differently with --decoder {args.decoder}')
+        return
+
+    coord_range = args.quantize_range or default_coord_range(args.features, args.width, args.height)
+    if args.quantize == 'uint16' and coord_range is None:
+        p.error('--quantize uint16 on pixel coordinates needs --width/--height or --quantize-range')
+    quant = {'quantize': args.quantize, 'coord_range': coord_range}
+    quality = None
+    if args.quality_filter:
+        if not all(0 <= i < EXPECTED_KP for i in args.required_keypoints):
+            p.error(f'--required-keypoints must be between 0 and {EXPECTED_KP - 1}')
+        quality = QualityFilter(args.min_confidence, args.min_keypoint_score, args.required_keypoints,
+                                args.min_frames)
+
+    dedup = None
+    if args.dedup:
+        if args.sequence:
+            p.error('--dedup would break frame windows; it is not supported with --sequence')
+        if args.dedup_tolerance <= 0 or args.dedup_capacity < 1:
+            p.error('--dedup-tolerance and --dedup-capacity must be positive')
+        dedup = Deduplicator(args.dedup_tolerance, args.dedup, args.dedup_capacity)
+
+    if args.sequence and args.decoder != 'json':
+        p.error('--sequence reads session/frame fields; use the default --decoder json')
+
+    paths = resolve_inputs(args.input)
+    if args.sequence:
+        n, skipped, sessions = build_sequences(paths, args.out, args.width, args.height, args.chunk_size,
+                                               args.fmt, args.features, args.session_key, args.frame_key,
+                                               quality=quality, **quant)
+        print(f'Wrote {args.out} with {n} samples in {len(sessions)} sessions, skipped {skipped}')
+        print_quality(quality)
+        print_quantization(args.out)
+        return
+
+    if len(paths) > 1 or args.cache_dir:
+        workers = max(1, min(args.workers, len(paths)))
+        n, skipped, per_shard = build_sharded(paths, args.out, args.width, args.height,
+                                              args.chunk_size, workers, args.fmt, args.cache_dir, args.features,
+                                              quality=quality, dedup=dedup, decoder=args.decoder, **quant)
+        for path, rows, n_skip, cached in per_shard:
+            print(f'  {path}: {rows} samples, skipped {n_skip}' + (' (cached)' if cached else ''))
+        hits = sum(1 for *_, cached in per_shard if cached)
+        print(f'Wrote {args.out} with {n} samples from {len(paths)} shards '
+              f'({hits} cached), skipped {skipped}')
+        print_quality(quality)
+        print_dedup(dedup)
+        print_quantization(args.out)
+        return
+
+    if args.stream:
+        n, skipped = build_streaming(paths[0], args.out, args.width, args.height, args.chunk_size, args.fmt,
+                                     args.features, quality=quality, dedup=dedup, decoder=args.decoder, **quant)
+        print(f'Wrote {args.out} with {n} samples, skipped {skipped}')
+        print_quality(quality)
+        print_dedup(dedup)
+        print_quantization(args.out)
+        return
+
+    profiling.count('bytes_read', os.path.getsize(paths[0]))
+    with profiling.stage('load_json'):
+        kps, Y, rows, skipped = load_keypoints(paths[0], args.decoder)
+    with profiling.stage('to_arrays', rows=rows):
+        X, Y = keypoints_to_arrays(kps, Y, args.width, args.height, args.features, quality)
+    profiling.count('rows_parsed', rows)
+    profiling.count('rows_skipped', skipped)
+    meta = dataset_meta(args.width, args.height, args.features)
+    if quality is not None:
+        meta['quality'] = dict(quality.config(), counts=quality.counts)
+    extra = {}
+    if dedup is not None:
+        with profiling.stage('dedup'):
+            keep = dedup.filter(X)
+        X, Y = X[keep], Y[keep]
+        meta['dedup'] = dict(dedup.config(), counts=dedup.counts)
+        if dedup.mode == 'weight':
+            extra['w'] = dedup.weights()
+    with profiling.stage('save'):
+        outpath = save_arrays(args.out, args.fmt, meta=meta,
+                              quantize=args.quantize, coord_range=coord_range or (-2.0, 2.0), X=X, y=Y, **extra)
     print(f'Wrote {outpath} with {len(X)} samples, skipped {skipped}')
+    print_quality(quality)
+    print_dedup(dedup)
+    print_quantization(outpath)
 
 
 if __name__ == '__main__':
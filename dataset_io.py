@@ -0,0 +1,504 @@
+"""
+dataset_io.py
+
+学習用データセット (X, y, ...) の書き出しと読み込みをまとめたモジュール。
+build_dataset.py / academic_data_converter.py / train_model.py から共通で使います。
+
+フォーマット:
+ - npz : np.savez_compressed の 1 ファイル（従来形式）。読み込み時に配列全体を展開する
+         meta があれば JSON 文字列の __meta__ として一緒に入れる
+ - npy : ディレクトリに X.npy, y.npy, ... と meta.json を置く非圧縮形式。
+         np.load(mmap_mode='r') で開くため、起動時間と常駐メモリはデータ全体ではなく
+         実際に触ったバッチの分だけになる
+
+量子化（DatasetWriter(quantize=...)、どちらの形式でも可）:
+ X の座標列を Xq、スコア列を Xq_score、y を yq として小さい型で保存し、open_dataset は
+ ds.X / ds.y を読んだ分だけ float32 に戻す QuantizedArray として返す。1 行あたりのバイト数
+ （X 51 + y 8 列）は float32 の 236 に対し float16 モードで 101、uint16 モードで 93。
+ - float16 : 座標 float16、スコア uint8、ラベル float16
+ - uint16  : 座標は coord_range（既定 [-2, 2]）の uint16 固定小数点、スコア uint8、ラベル uint8
+ 誤差の上限（範囲外でクリップした値を除く。復元後の float32 への丸め 1ulp 分は別に乗る）:
+ - 座標 float16 : max(|v| * 2**-11, 2**-25)（|v| <= 2 なら 9.8e-4、640px のピクセル座標なら 0.31px。
+                  |v| < 2**-14 の非正規化数は間隔が一定なので絶対誤差 2**-25 = 3.0e-8）
+ - 座標 uint16  : (hi - lo) / 65535 / 2（既定の [-2, 2] で 3.1e-5）
+ - スコア / ラベル uint8 : 1 / 510 = 2.0e-3、ラベル float16 : 2**-11 = 4.9e-4
+ NaN は float16 ではそのまま残る。整数の型では表せないので範囲の下端として保存し、クリップ数に数える。
+ 書き出し時に float32 の入力と復元値を比べた実測の最大誤差とクリップ数を meta['quantization'] に残す。
+
+使い方:
+ writer = DatasetWriter('data/train', fmt='npy', arrays={'X': (51,), 'y': (8,)})
+ writer.write(X=X_chunk, y=y_chunk)
+ writer.close()
+
+ ds = open_dataset('data/train')   # npz ファイルでも npy ディレクトリでも可
+ ds.X[1000:1032]                   # memmap なので必要な行だけ読まれる
+
+ # build_dataset.py --sequence で作ったデータセット（セッションごとに連続、per-row の session 番号付き）
+ win = ds.windows(30, stride=5)    # セッションをまたがない 30 フレームの窓（コピーしないビュー）
+ win.X[win.starts[:32]]            # (32, 30, D)。コピーされるのは取り出したバッチ分だけ
+
+"""
+import io
+import json
+import shutil
+import numpy as np
+from pathlib import Path
+
+FORMATS = ('npz', 'npy')
+QUANTIZE_MODES = ('float16', 'uint16')
+META_FILE = 'meta.json'
+META_VERSION = 1
+# npz に meta を入れるときの配列名（open_dataset は配列としては返さない）
+NPZ_META_KEY = '__meta__'
+
+
+class NpyAppender:
+    """
+    行方向に追記できる .npy 書き出し。
+    ヘッダ領域を先に確保しておき、close() で最終的な shape に書き換える。
+    """
+
+    # ヘッダ確保用の最大行数（実際の行数がこれを超えることはない想定）
+    _MAX_ROWS = 10 ** 15
+
+    def __init__(self, path, row_shape, dtype=np.float32):
+        self.path = Path(path)
+        self.row_shape = tuple(row_shape)
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self._f = open(self.path, 'wb')
+        self._header_len = len(self._header(self._MAX_ROWS))
+        self._f.write(b'\0' * self._header_len)
+
+    def _header(self, rows):
+        buf = io.BytesIO()
+        np.lib.format.write_array_header_1_0(buf, {
+            'descr': np.lib.format.dtype_to_descr(self.dtype),
+            'fortran_order': False,
+            'shape': (rows,) + self.row_shape,
+        })
+        return buf.getvalue()
+
+    def append(self, arr):
+        arr = np.ascontiguousarray(arr, dtype=self.dtype)
+        if arr.shape[1:] != self.row_shape:
+            raise ValueError(f'row shape mismatch: {arr.shape[1:]} != {self.row_shape}')
+        self._f.write(arr.tobytes())
+        self.rows += len(arr)
+
+    def close(self):
+        if self._f is None:
+            return
+        header = self._header(self.rows)
+        # numpy のヘッダは 64 バイト境界に詰められるので通常は長さが変わらない
+        if len(header) != self._header_len:
+            raise RuntimeError(f'npy header size changed for {self.path}')
+        self._f.seek(0)
+        self._f.write(header)
+        self._f.close()
+        self._f = None
+
+
+def _array_spec(spec):
+    # {'X': (51,)} と {'X': ((51,), 'float32')} の両方を受け付ける
+    if len(spec) == 2 and isinstance(spec[0], (tuple, list)):
+        return tuple(spec[0]), np.dtype(spec[1])
+    return tuple(spec), np.dtype(np.float32)
+
+
+class Quantizer:
+    """
+    X / y を量子化して保存するための変換（DatasetWriter と open_dataset から使う）。
+    X はスコア列（feature_spec の layout が x, y, score の列）とそれ以外の座標列に分けて持つ。
+    """
+
+    def __init__(self, mode, x_dim, y_dim, score_cols=(), coord_range=(-2.0, 2.0)):
+        if mode not in QUANTIZE_MODES:
+            raise ValueError(f'unknown quantize mode: {mode} (expected one of {QUANTIZE_MODES})')
+        self.mode = mode
+        self.x_dim = x_dim
+        self.y_dim = y_dim
+        self.score_cols = np.array(sorted(score_cols), dtype=np.int64)
+        self.coord_cols = np.setdiff1d(np.arange(x_dim), self.score_cols)
+        self.coord_range = (float(coord_range[0]), float(coord_range[1]))
+        self.coord_dtype = np.dtype(np.float16 if mode == 'float16' else np.uint16)
+        self.label_dtype = np.dtype(np.float16 if mode == 'float16' else np.uint8)
+        self.max_error = {'coords': 0.0, 'scores': 0.0, 'labels': 0.0}
+        self.clipped = {'coords': 0, 'scores': 0, 'labels': 0}
+
+    @classmethod
+    def from_meta(cls, q):
+        self = cls(q['mode'], q['x_dim'], q['y_dim'], q['score_cols'], q['coord_range'])
+        self.max_error = q.get('max_error', self.max_error)
+        self.clipped = q.get('clipped', self.clipped)
+        return self
+
+    def to_meta(self):
+        return {'mode': self.mode, 'x_dim': self.x_dim, 'y_dim': self.y_dim,
+                'score_cols': self.score_cols.tolist(), 'coord_range': list(self.coord_range),
+                'bound': self.bound(), 'max_error': self.max_error, 'clipped': self.clipped}
+
+    def bound(self):
+        """
+        モジュール冒頭に書いた誤差上限に float32 の丸め分を足したもの
+        （座標 float16 は max(|v| * coords_relative, coords_absolute)）
+        """
+        eps = float(np.finfo(np.float32).eps)
+        if self.mode == 'float16':
+            return {'coords_relative': 2.0 ** -11 + eps, 'coords_absolute': 2.0 ** -25,
+                    'scores': 1 / 510 + eps, 'labels': 2.0 ** -11 + eps}
+        lo, hi = self.coord_range
+        return {'coords': (hi - lo) / 65535 / 2 + max(abs(lo), abs(hi)) * eps,
+                'scores': 1 / 510 + eps, 'labels': 1 / 510 + eps}
+
+    def specs(self):
+        """保存する配列の (行の shape, dtype)"""
+        return {'Xq': ((len(self.coord_cols),), self.coord_dtype),
+                'Xq_score': ((len(self.score_cols),), np.uint8),
+                'yq': ((self.y_dim,), self.label_dtype)}
+
+    def _encode(self, part, v, dtype, lo, hi):
+        v = np.asarray(v, dtype=np.float32)
+        if dtype == np.float16:
+            # float16 は範囲を持たないので、表せる最大値 (65504) を超えて inf になった値だけ数える
+            with np.errstate(over='ignore'):
+                q = v.astype(np.float16)
+            ref = v
+            self.clipped[part] += int(np.count_nonzero(np.isinf(q) & np.isfinite(v)))
+        else:
+            levels = np.iinfo(dtype).max
+            # NaN は整数にできない（キャストの結果が決まらない）ので下端にしてクリップとして数える
+            nan = np.isnan(v)
+            ref = np.clip(np.where(nan, lo, v), lo, hi)
+            q = np.rint((ref - lo) * (levels / (hi - lo))).astype(dtype)
+            self.clipped[part] += int(np.count_nonzero((v < lo) | (v > hi) | nan))
+        err = np.abs(self._decode(q, lo, hi) - ref)
+        err = err[np.isfinite(err)]
+        if err.size:
+            self.max_error[part] = max(self.max_error[part], float(err.max()))
+        return q
+
+    @staticmethod
+    def _decode(q, lo, hi):
+        if q.dtype == np.float16:
+            return q.astype(np.float32)
+        return q.astype(np.float32) * np.float32((hi - lo) / np.iinfo(q.dtype).max) + np.float32(lo)
+
+    def encode(self, X=None, y=None):
+        out = {}
+        if X is not None:
+            lo, hi = self.coord_range
+            out['Xq'] = self._encode('coords', X[:, self.coord_cols], self.coord_dtype, lo, hi)
+            out['Xq_score'] = self._encode('scores', X[:, self.score_cols], np.uint8, 0.0, 1.0)
+        if y is not None:
+            out['yq'] = self._encode('labels', y, self.label_dtype, 0.0, 1.0)
+        return out
+
+    def decode_X(self, coords, scores):
+        X = np.empty((len(coords), self.x_dim), dtype=np.float32)
+        X[:, self.coord_cols] = self._decode(np.asarray(coords), *self.coord_range)
+        X[:, self.score_cols] = self._decode(np.asarray(scores), 0.0, 1.0)
+        return X
+
+    def decode_y(self, q):
+        return self._decode(np.asarray(q), 0.0, 1.0)
+
+
+class QuantizedArray:
+    """
+    量子化して保存した配列を float32 の配列のように読む（スライス / 行番号の配列で読んだ分だけ復元する）。
+    memmap の上に置けば、常駐メモリは量子化された分とバッチの float32 だけになる。
+    """
+
+    def __init__(self, parts, decode, width):
+        self.parts = parts
+        self.decode = decode
+        self.shape = (len(parts[0]), width)
+        self.dtype = np.dtype(np.float32)
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        cols = None
+        if isinstance(key, tuple):
+            key, cols = key[0], key[1:]
+        scalar = not isinstance(key, slice) and np.ndim(key) == 0
+        out = self.decode(*(p[np.atleast_1d(key) if scalar else key] for p in self.parts))
+        if scalar:
+            out = out[0]
+        return out if cols is None else out[(Ellipsis,) + cols]
+
+    def __array__(self, dtype=None, copy=None):
+        arr = self[:]
+        return arr if dtype is None else arr.astype(dtype)
+
+
+class DatasetWriter:
+    """
+    名前付き配列をチャンク単位で受け取り、npz または npy ディレクトリとして書き出す。
+    どちらの形式でもデータ全体をメモリに載せない（npz は一時 .npy から memmap でまとめる）。
+    quantize を指定すると X / y を Quantizer で小さい型にして保存する。
+    """
+
+    def __init__(self, out_path, fmt='npz', arrays=None, meta=None, quantize=None, coord_range=(-2.0, 2.0)):
+        if fmt not in FORMATS:
+            raise ValueError(f'unknown dataset format: {fmt} (expected one of {FORMATS})')
+        self.out_path = Path(out_path)
+        self.fmt = fmt
+        self.meta = dict(meta or {})
+        arrays = dict(arrays or {})
+        self.quantizer = None
+        if quantize:
+            (x_dim,), _ = _array_spec(arrays.pop('X'))
+            (y_dim,), _ = _array_spec(arrays.pop('y'))
+            self.quantizer = Quantizer(quantize, x_dim, y_dim, _score_cols(self.meta, x_dim), coord_range)
+            arrays.update(self.quantizer.specs())
+        if fmt == 'npy':
+            self.data_dir = self.out_path
+        else:
+            self.out_path.parent.mkdir(parents=True, exist_ok=True)
+            self.data_dir = self.out_path.with_name(self.out_path.name + '.parts')
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.appenders = {}
+        for name, spec in arrays.items():
+            row_shape, dtype = _array_spec(spec)
+            self.appenders[name] = NpyAppender(self.data_dir / f'{name}.npy', row_shape, dtype)
+
+    @property
+    def rows(self):
+        return next(iter(self.appenders.values())).rows if self.appenders else 0
+
+    def write(self, **chunks):
+        if self.quantizer and 'X' in chunks and 'y' in chunks:
+            chunks.update(self.quantizer.encode(chunks.pop('X'), chunks.pop('y')))
+        if set(chunks) != set(self.appenders):
+            raise ValueError(f'expected arrays {sorted(self.appenders)}, got {sorted(chunks)}')
+        lengths = {len(v) for v in chunks.values()}
+        if len(lengths) != 1:
+            raise ValueError('all arrays must have the same number of rows')
+        if not lengths.pop():
+            return
+        for name, arr in chunks.items():
+            self.appenders[name].append(arr)
+
+    def add_array(self, name, arr, dtype=None):
+        """書き出し済みの行数とそろった配列を後から足す（行ごとの重みなど、全行を見ないと決まらない列用）"""
+        arr = np.asarray(arr, dtype=dtype)
+        if name in self.appenders:
+            raise ValueError(f'array {name} already exists')
+        if len(arr) != self.rows:
+            raise ValueError(f'{name} has {len(arr)} rows, expected {self.rows}')
+        app = NpyAppender(self.data_dir / f'{name}.npy', arr.shape[1:], arr.dtype)
+        app.append(arr)
+        self.appenders[name] = app
+
+    def close(self):
+        for app in self.appenders.values():
+            app.close()
+        if self.quantizer:
+            self.meta['quantization'] = self.quantizer.to_meta()
+        if self.fmt == 'npy':
+            meta = dict(self.meta)
+            meta.update({
+                'format': 'npy',
+                'version': META_VERSION,
+                'rows': self.rows,
+                'arrays': {name: {'shape': [app.rows, *app.row_shape], 'dtype': app.dtype.str}
+                           for name, app in self.appenders.items()},
+            })
+            (self.data_dir / META_FILE).write_text(json.dumps(meta, ensure_ascii=False, indent=2), encoding='utf-8')
+            return self.out_path
+        arrays = {name: _load_part(app) for name, app in self.appenders.items()}
+        np.savez_compressed(self.out_path, **arrays, **_npz_meta(self.meta))
+        del arrays
+        shutil.rmtree(self.data_dir, ignore_errors=True)
+        return self.out_path
+
+
+def _score_cols(meta, x_dim):
+    # feature_spec の layout（x, y, score の繰り返し）からスコア列を求める。spec がなければ全列を座標として扱う
+    spec = meta.get('feature_spec')
+    if not spec or spec.get('layout') != ['x', 'y', 'score']:
+        return ()
+    return range(2, min(spec['keypoints'] * 3, x_dim), 3)
+
+
+def _load_part(app):
+    # 0 行の配列は mmap できないので通常読み込みにする
+    return np.load(app.path, mmap_mode='r' if app.rows else None)
+
+
+def _npz_meta(meta):
+    # 0 次元の文字列配列なので allow_pickle なしで読める
+    return {NPZ_META_KEY: np.array(json.dumps(meta, ensure_ascii=False))} if meta else {}
+
+
+def save_arrays(out_path, fmt='npz', meta=None, quantize=None, coord_range=(-2.0, 2.0), **arrays):
+    """メモリ上の配列をまとめて書き出す（DatasetWriter の一括版）"""
+    if fmt == 'npz' and not quantize:
+        out_path = Path(out_path)
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(out_path, **arrays, **_npz_meta(meta))
+        return out_path
+    specs = {name: (arr.shape[1:], arr.dtype) for name, arr in arrays.items()}
+    writer = DatasetWriter(out_path, fmt, specs, meta, quantize, coord_range)
+    writer.write(**arrays)
+    writer.close()
+    return writer.out_path
+
+
+class Dataset:
+    """open_dataset の戻り値。配列は名前でアクセスする（ds['X'] / ds.X）"""
+
+    def __init__(self, path, arrays, meta):
+        self.path = Path(path)
+        self.arrays = arrays
+        self.meta = meta
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    def __contains__(self, name):
+        return name in self.arrays
+
+    def __len__(self):
+        if 'X' in self.arrays:
+            return len(self.arrays['X'])
+        return len(next(iter(self.arrays.values()), ()))
+
+    @property
+    def X(self):
+        return self.arrays['X']
+
+    @property
+    def y(self):
+        return self.arrays['y']
+
+    @property
+    def mmapped(self):
+        return self.meta.get('format') == 'npy'
+
+    @property
+    def quantized(self):
+        return 'quantization' in self.meta
+
+    def windows(self, window, stride=1):
+        """session 配列を持つデータセットを固定長の窓として見る（WindowView）"""
+        if 'session' not in self.arrays:
+            raise ValueError(f'{self.path}: no session array (build it with build_dataset.py --sequence)')
+        return WindowView(self.X, self.y, session_offsets(self['session']), window, stride)
+
+
+def session_offsets(session):
+    """
+    セッションごとに連続して並んだ per-row の session 番号から、各セッションの境界 (S + 1,) を返す。
+    セッション k の行は [offsets[k], offsets[k + 1])。
+    """
+    session = np.asarray(session)
+    if not len(session):
+        return np.zeros(1, dtype=np.int64)
+    change = np.flatnonzero(session[1:] != session[:-1]) + 1
+    return np.concatenate(([0], change, [len(session)])).astype(np.int64)
+
+
+def window_starts(offsets, window, stride=1):
+    """各セッションの中に収まる長さ window の窓の開始行（stride おき）。window より短いセッションは窓を作らない"""
+    starts = [np.arange(a, b - window + 1, stride, dtype=np.int64) for a, b in zip(offsets[:-1], offsets[1:])]
+    return np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+
+
+class WindowView:
+    """
+    フレーム配列 (N, D) を長さ window の窓として見る。
+    X は sliding_window_view のビュー (N - window + 1, window, D) で、X[s] が行 s から始まる窓。
+    memmap のままでもデータはコピーされず、窓データセットのメモリはフレームデータセットと同じになる。
+    starts は使ってよい窓（セッションをまたがないもの）の開始行、y は窓の最後のフレームのラベル。
+    量子化されたデータセット（QuantizedArray）ではビューを作らず、batch() で窓の行を集めて復元する。
+    """
+
+    def __init__(self, X, y, offsets, window, stride=1):
+        if window < 1 or stride < 1:
+            raise ValueError('window and stride must be positive')
+        self.window = window
+        self.stride = stride
+        self.offsets = offsets
+        self.frames = X
+        self.labels = y
+        self.starts = window_starts(offsets, window, stride)
+        if not isinstance(X, np.ndarray):
+            self.X = None
+        elif len(X) >= window:
+            self.X = np.lib.stride_tricks.sliding_window_view(X, window, axis=0).transpose(0, 2, 1)
+        else:
+            self.X = np.zeros((0, window) + X.shape[1:], dtype=X.dtype)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @property
+    def sessions(self):
+        return len(self.offsets) - 1
+
+    def batch(self, index):
+        """index 番目（starts の位置）の窓を (len(index), window, D) と最後のフレームのラベルで返す"""
+        s = self.starts[index]
+        if self.X is None:
+            rows = (np.atleast_1d(s)[:, None] + np.arange(self.window)).ravel()
+            X = self.frames[rows].reshape(np.shape(s) + (self.window, self.frames.shape[1]))
+        else:
+            X = self.X[s]
+        return X, np.asarray(self.labels[s + self.window - 1])
+
+
+def open_dataset(path, mmap_mode='r'):
+    """
+    npz ファイルまたは npy ディレクトリを開く。
+    npy ディレクトリは mmap_mode で開くので、この時点ではデータを読み込まない。
+    """
+    path = Path(path)
+    if path.is_dir():
+        meta_path = path / META_FILE
+        meta = json.loads(meta_path.read_text(encoding='utf-8')) if meta_path.exists() else {'format': 'npy'}
+        names = list(meta.get('arrays') or (p.stem for p in sorted(path.glob('*.npy'))))
+        arrays = {}
+        for name in names:
+            npy = path / f'{name}.npy'
+            empty = meta.get('arrays', {}).get(name, {}).get('shape', [1])[0] == 0
+            arrays[name] = np.load(npy, mmap_mode=None if empty else mmap_mode)
+        return Dataset(path, _dequantized(arrays, meta), meta)
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files}
+    meta = json.loads(str(arrays.pop(NPZ_META_KEY))) if NPZ_META_KEY in arrays else {}
+    meta['format'] = 'npz'
+    return Dataset(path, _dequantized(arrays, meta), meta)
+
+
+def read_meta(path):
+    """配列を読まずに meta だけを読む（npz も __meta__ だけを取り出す）"""
+    path = Path(path)
+    if path.is_dir():
+        meta_path = path / META_FILE
+        return json.loads(meta_path.read_text(encoding='utf-8')) if meta_path.exists() else {'format': 'npy'}
+    with np.load(path) as data:
+        meta = json.loads(str(data[NPZ_META_KEY])) if NPZ_META_KEY in data.files else {}
+    meta['format'] = 'npz'
+    return meta
+
+
+def _dequantized(arrays, meta):
+    # 量子化データセットは X / y を読んだ分だけ float32 に戻す QuantizedArray として見せる
+    if 'quantization' not in meta:
+        return arrays
+    q = Quantizer.from_meta(meta['quantization'])
+    arrays['X'] = QuantizedArray([arrays['Xq'], arrays['Xq_score']], q.decode_X, q.x_dim)
+    arrays['y'] = QuantizedArray([arrays['yq']], q.decode_y, q.y_dim)
+    return arrays
+
+
+def iter_batches(arr, batch_size, start=0, stop=None):
+    """配列を [start, stop) の範囲で batch_size 行ずつ切り出す（memmap ならその分だけ読まれる）"""
+    stop = len(arr) if stop is None else stop
+    for i in range(start, stop, batch_size):
+        yield arr[i:min(i + batch_size, stop)]
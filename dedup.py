@@ -0,0 +1,211 @@
+"""
+dedup.py
+
+ほぼ同じフレーム（連続する動画フレームや AcademicDataConverter の合成サンプル）を見つけて
+間引くための重複排除インデックス。build_dataset.py --dedup から使います。
+
+キーの作り方:
+ X の先頭 17 x (x, y, score) から x, y を取り出し、腰の中点（keypoints 11/12）を原点にして
+ tolerance 刻みの格子に丸め、格子番号の並び（34 個の整数）を 64bit ハッシュにする。
+ 同じ格子に入った行を重複とみなす（tolerance は X の座標と同じ単位。--width/--height で割っていれば
+ 動画サイズ比、raw のピクセル座標ならピクセル）。score とラベルはキーに入れない。
+ 格子の境界をまたいだ近い行は別キーになるので、tolerance は「この幅以内なら同じ」ではなく
+ 「この幅の格子で同じセルなら同じ」という目安。34 座標のどれか 1 つでもまたげば別キーなので、
+ ずれが tolerance のおよそ 1/34 を超えるフレームはほとんど残る（連続フレームを減らしたいなら tolerance を大きめに）。
+
+インデックス:
+ ハッシュを開番地法（線形探査）の numpy テーブルに入れ、チャンク単位でまとめて引く・足す。
+ インデックスのメモリは capacity（覚えておくキー数）だけで決まり、64〜128 バイト x capacity で固定（既定 200 万キーで 134MB）。
+ weight モードはこれとは別に、残した行ごとの行数（int32）を最後まで持つので、残した行数に比例して
+ 4 バイト x 残した行数 が増える（1000 万行残せば 40MB。配列は倍々に広げるので一時的にその 1.5〜2 倍）。
+ 重みは後から来る重複で増えるため、チャンクごとには確定できず、weights() で最後にまとめて書く。
+ キー数が capacity を超えたら世代を入れ替え、ひとつ前の世代だけを覚えておく（古いキーは忘れる）。
+ 連続フレームの重複は近くに並ぶので、数千万行でも直近の capacity〜2 x capacity 個のキーと比べれば十分。
+
+モード:
+ - drop   : 重複行を捨てる
+ - weight : 重複行を捨て、残した代表行に「代表している行数」を重み w として付ける
+            （train_model.py は w を sample_weight に使うので、損失は重複排除前とほぼ同じになる）
+
+使い方:
+ dedup = Deduplicator(tolerance=0.005, mode='weight')
+ for X, Y in chunks:
+     keep = dedup.filter(X)
+     writer.write(X=X[keep], y=Y[keep])
+ writer.add_array('w', dedup.weights())
+
+"""
+import numpy as np
+
+DEDUP_MODES = ('drop', 'weight')
+
+NUM_KEYPOINTS = 17
+LEFT_HIP, RIGHT_HIP = 11, 12
+
+_EMPTY = np.uint64(0)
+_FNV_PRIME = np.uint64(0x100000001B3)
+
+
+def _mix64(h):
+    # splitmix64 の最終段（線形探査のスロットが偏らないように下位ビットまで混ぜる）
+    h ^= h >> np.uint64(30)
+    h *= np.uint64(0xBF58476D1CE4E5B9)
+    h ^= h >> np.uint64(27)
+    h *= np.uint64(0x94D049BB133111EB)
+    h ^= h >> np.uint64(31)
+    return h
+
+
+def dedup_keys(X, tolerance):
+    """(N, D) の X（先頭 51 列が x, y, score）から (N,) uint64 のキーを作る。0 は空きスロット用なので使わない"""
+    kps = np.asarray(X[:, :NUM_KEYPOINTS * 3], dtype=np.float64).reshape(len(X), NUM_KEYPOINTS, 3)
+    center = (kps[:, LEFT_HIP, :2] + kps[:, RIGHT_HIP, :2]) / 2
+    cells = np.floor((kps[..., :2] - center[:, None, :]) / tolerance).astype(np.int64).reshape(len(X), -1)
+    h = np.full(len(X), 0xCBF29CE484222325, dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for col in cells.view(np.uint64).T:
+            h ^= col
+            h *= _FNV_PRIME
+        h = _mix64(h)
+    h[h == _EMPTY] = 1
+    return h
+
+
+class HashIndex:
+    """
+    uint64 キー -> int64 値 の固定サイズのハッシュテーブル（開番地法・線形探査）。
+    get / insert はキーの配列をまとめて処理し、探査 1 段ごとに numpy の演算 1 回で済ませる。
+    """
+
+    def __init__(self, capacity):
+        # 使用率を 1/2 以下に保つ
+        slots = 1 << max(4, int(2 * capacity - 1).bit_length())
+        self.mask = np.uint64(slots - 1)
+        self.keys = np.zeros(slots, dtype=np.uint64)
+        self.values = np.zeros(slots, dtype=np.int64)
+        self.size = 0
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+    def clear(self):
+        self.keys.fill(_EMPTY)
+        self.size = 0
+
+    def get(self, keys):
+        """keys の値を返す（ないキーは -1）"""
+        out = np.full(len(keys), -1, dtype=np.int64)
+        pending = np.arange(len(keys))
+        slot = keys & self.mask
+        while len(pending):
+            cur = self.keys[slot]
+            hit = cur == keys[pending]
+            out[pending[hit]] = self.values[slot[hit]]
+            go_on = ~hit & (cur != _EMPTY)
+            pending = pending[go_on]
+            slot = (slot[go_on] + np.uint64(1)) & self.mask
+        return out
+
+    def insert(self, keys, values):
+        """
+        テーブルにない（互いに異なる）keys を足す。同じ空きスロットを複数のキーが取り合ったら
+        書き込んだ後に読み直して勝ったキーだけを確定し、負けたキーは次のスロットを探す。
+        """
+        if self.size + len(keys) > len(self.keys) // 2:
+            raise ValueError('hash index is full')
+        pending = np.arange(len(keys))
+        slot = keys & self.mask
+        while len(pending):
+            empty = self.keys[slot] == _EMPTY
+            claim, idx = slot[empty], pending[empty]
+            self.keys[claim] = keys[idx]
+            won = self.keys[claim] == keys[idx]
+            self.values[claim[won]] = values[idx[won]]
+            taken = np.zeros(len(pending), dtype=bool)
+            taken[np.flatnonzero(empty)[won]] = True
+            pending = pending[~taken]
+            slot = (slot[~taken] + np.uint64(1)) & self.mask
+        self.size += len(keys)
+
+
+class Deduplicator:
+    """
+    チャンクごとに filter(X) で残す行のマスクを返す重複排除ステージ。
+    キー -> 代表行の番号（残した行の通し番号）を HashIndex の 2 世代に持ち、
+    weight モードでは代表行ごとの行数を数えて weights() で返す。
+    """
+
+    def __init__(self, tolerance=0.005, mode='drop', capacity=2_000_000):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f'unknown dedup mode: {mode} (expected one of {DEDUP_MODES})')
+        if tolerance <= 0:
+            raise ValueError('dedup tolerance must be positive')
+        self.tolerance = float(tolerance)
+        self.mode = mode
+        self.capacity = int(capacity)
+        self.current = HashIndex(self.capacity)
+        self.previous = HashIndex(self.capacity)
+        self.kept = 0
+        # weight モードの代表行ごとの行数（残した行数に比例して伸びる。インデックスと違って上限はない）
+        self._counts = np.zeros(1024, dtype=np.int32) if mode == 'weight' else None
+        self.counts = {'checked': 0, 'dropped': 0, 'generations': 1}
+
+    def config(self):
+        return {'tolerance': self.tolerance, 'mode': self.mode, 'capacity': self.capacity}
+
+    def _rotate(self):
+        self.current, self.previous = self.previous, self.current
+        self.current.clear()
+        self.counts['generations'] += 1
+
+    def _insert(self, keys, values):
+        # 1 世代に capacity 個まで。あふれる分は世代を入れ替えてから入れる
+        start = 0
+        while start < len(keys):
+            if self.current.size >= self.capacity:
+                self._rotate()
+            stop = start + min(len(keys) - start, self.capacity - self.current.size)
+            self.current.insert(keys[start:stop], values[start:stop])
+            start = stop
+
+    def filter(self, X):
+        """X の各行が新しいキー（代表行）なら True のマスクを返す"""
+        n = len(X)
+        self.counts['checked'] += n
+        if not n:
+            return np.zeros(0, dtype=bool)
+        keys = dedup_keys(X, self.tolerance)
+        # チャンク内の重複をまとめる（first はそのキーが最初に現れた行）
+        uniq, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        rep = self.current.get(uniq)
+        miss = np.flatnonzero(rep < 0)
+        if self.previous.size and len(miss):
+            rep[miss] = self.previous.get(uniq[miss])
+        # 新しいキーは最初に現れた行の順に代表行の番号を振る
+        new = miss[rep[miss] < 0]
+        new = new[np.argsort(first[new], kind='stable')]
+        rep[new] = self.kept + np.arange(len(new))
+        # ひとつ前の世代で見つかったキーも今の世代に入れ直す（よく出るキーを忘れないように）
+        self._insert(uniq[miss], rep[miss])
+        keep = np.zeros(n, dtype=bool)
+        keep[first[new]] = True
+        self.kept += len(new)
+        self.counts['dropped'] += n - len(new)
+        if self._counts is not None:
+            if self.kept > len(self._counts):
+                self._counts = np.concatenate([self._counts, np.zeros(max(self.kept, 2 * len(self._counts))
+                                                                      - len(self._counts), dtype=np.int32)])
+            np.add.at(self._counts, rep[inverse], 1)
+        return keep
+
+    def weights(self, dtype=np.float32):
+        """weight モードで、残した行ごとの重み（代表している行数）"""
+        if self._counts is None:
+            raise ValueError("weights are only tracked in 'weight' mode")
+        return self._counts[:self.kept].astype(dtype)
+
+    def summary(self):
+        c = self.counts
+        return (f"dropped {c['dropped']} of {c['checked']} rows as near-duplicates "
+                f"(tolerance {self.tolerance:g}, {c['generations']} index generation(s))")
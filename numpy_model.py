@@ -0,0 +1,159 @@
+"""
+numpy_model.py
+
+train_model.py のモデル（Dense -> BN -> Dense -> Dense）を NumPy だけで推論するモジュール。
+BN を隣の Dense に畳み込んだ重みを model.npz に書き出し、TensorFlow を import せずに
+バッチ単位で順伝播します。起動は数十ミリ秒、メモリは重みとバッチ分だけで済みます。
+
+model.npz の中身:
+ - layer{i}_W, layer{i}_b  : Dense の重み（float32）
+ - layer{i}_gamma, ...      : 畳み込めなかった BN があればその値
+ - __meta__                 : 層の並び・活性化関数・入出力次元・feature_spec などの JSON
+
+使い方:
+ # 書き出し（train_model.py の学習後と export サブコマンドが呼ぶ）
+ save_numpy_model('export/model.npz', fold_batchnorm(layers), meta={'labels': LABELS})
+
+ model = load_numpy_model('export/model.npz')
+ Y = model.predict(X, batch_size=8192)      # (N, 8) float32
+
+"""
+import json
+import numpy as np
+from pathlib import Path
+
+MODEL_FILE = 'model.npz'
+MODEL_VERSION = 1
+_META_KEY = '__meta__'
+_BN_FIELDS = ('gamma', 'beta', 'mean', 'var')
+
+
+def fold_batchnorm(layers):
+    """
+    推論時の BN（a * h + c）を隣の Dense に畳み込む。
+    直前の Dense が活性化なしならその出力側に、そうでなければ（build_model のように
+    Dense -> ReLU -> BN の順なら）直後の Dense の入力側に畳み込む。どちらも推論結果は変わらない。
+    続けて並んだ BN は 1 つの a * h + c にまとめてから畳み込む。
+    layers は [('dense', {'W', 'b', 'activation'}), ('bn', {'gamma', 'beta', 'mean', 'var', 'epsilon'}), ...]
+    """
+    out = []
+    pending = None
+    for kind, p in layers:
+        if kind == 'bn':
+            a = p['gamma'] / np.sqrt(p['var'] + p['epsilon'])
+            c = p['beta'] - p['mean'] * a
+            prev = out[-1][1] if out and out[-1][0] == 'dense' else None
+            if prev is not None and prev['activation'] == 'linear':
+                prev['W'] = prev['W'] * a
+                prev['b'] = prev['b'] * a + c
+            elif pending is None:
+                pending = (a, c)
+            else:
+                # a2 * (a1 * h + c1) + c2
+                pending = (pending[0] * a, pending[1] * a + c)
+            continue
+        if pending is not None:
+            a, c = pending
+            p = dict(p, W=p['W'] * a[:, None], b=c @ p['W'] + p['b'])
+            pending = None
+        out.append((kind, dict(p)))
+    if pending is not None:
+        # 後ろに Dense がない BN は a * h + c になる BN（mean 0・var 1・epsilon 0）として残す
+        a, c = pending
+        out.append(('bn', {'gamma': a, 'beta': c, 'mean': np.zeros_like(a), 'var': np.ones_like(a), 'epsilon': 0.0}))
+    return out
+
+
+def _sigmoid(h):
+    # in-place で 1 / (1 + exp(-h))。float32 で exp があふれないよう |h| <= 88 に切る
+    # （exp(88) ~ 1.7e38。切った所の sigmoid は float32 では 0 / 1 と区別できないので結果は変わらない）
+    np.clip(h, -88, 88, out=h)
+    np.negative(h, out=h)
+    np.exp(h, out=h)
+    h += 1
+    return np.reciprocal(h, out=h)
+
+
+ACTIVATIONS = {
+    'linear': lambda h: h,
+    'relu': lambda h: np.maximum(h, 0, out=h),
+    'sigmoid': _sigmoid,
+}
+
+
+def forward(layers, X):
+    """layers の順伝播（1 バッチ分）。バイアスと活性化は matmul の結果に in-place でかける"""
+    h = np.asarray(X, dtype=np.float32)
+    for kind, p in layers:
+        if kind == 'dense':
+            h = h @ p['W']
+            h += p['b']
+            h = ACTIVATIONS[p['activation']](h)
+        else:
+            h = (h - p['mean']) / np.sqrt(p['var'] + p['epsilon']) * p['gamma'] + p['beta']
+    return h
+
+
+def save_numpy_model(path, layers, meta=None):
+    """layers を model.npz に書き出す（path がディレクトリなら その下の model.npz）"""
+    path = Path(path)
+    if path.suffix != '.npz':
+        path = path / MODEL_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    arrays = {}
+    spec = []
+    for i, (kind, p) in enumerate(layers):
+        if kind == 'dense':
+            arrays[f'layer{i}_W'] = np.asarray(p['W'], dtype=np.float32)
+            arrays[f'layer{i}_b'] = np.asarray(p['b'], dtype=np.float32)
+            spec.append({'kind': 'dense', 'activation': p['activation']})
+        else:
+            arrays.update({f'layer{i}_{k}': np.asarray(p[k], dtype=np.float32) for k in _BN_FIELDS})
+            spec.append({'kind': 'bn', 'epsilon': p['epsilon']})
+    dense = [p for kind, p in layers if kind == 'dense']
+    meta = dict(meta or {}, version=MODEL_VERSION, layers=spec,
+                input_dim=int(dense[0]['W'].shape[0]), output_dim=int(dense[-1]['W'].shape[1]))
+    np.savez(path, **arrays, **{_META_KEY: np.array(json.dumps(meta, ensure_ascii=False))})
+    return path
+
+
+class NumpyModel:
+    """load_numpy_model の戻り値。predict(X) で (N, output_dim) の float32 を返す"""
+
+    def __init__(self, layers, meta):
+        self.layers = layers
+        self.meta = meta
+        self.input_dim = meta['input_dim']
+        self.output_dim = meta['output_dim']
+
+    def predict(self, X, batch_size=8192):
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.input_dim:
+            raise ValueError(f'expected (N, {self.input_dim}) input, got {X.shape}')
+        out = np.empty((len(X), self.output_dim), dtype=np.float32)
+        for start in range(0, len(X), batch_size):
+            out[start:start + batch_size] = forward(self.layers, X[start:start + batch_size])
+        return out
+
+    __call__ = predict
+
+
+def load_numpy_model(path):
+    """model.npz（またはそれを含むディレクトリ）を読み込む"""
+    path = Path(path)
+    if path.is_dir():
+        path = path / MODEL_FILE
+    with np.load(path) as data:
+        meta = json.loads(str(data[_META_KEY]))
+        if meta.get('version') != MODEL_VERSION:
+            raise ValueError(f'{path}: model version {meta.get("version")} is not supported '
+                             f'(expected {MODEL_VERSION})')
+        layers = []
+        for i, layer in enumerate(meta['layers']):
+            if layer['kind'] == 'dense':
+                layers.append(('dense', {'W': data[f'layer{i}_W'], 'b': data[f'layer{i}_b'],
+                                         'activation': layer['activation']}))
+            else:
+                p = {k: data[f'layer{i}_{k}'] for k in _BN_FIELDS}
+                layers.append(('bn', dict(p, epsilon=layer['epsilon'])))
+    return NumpyModel(layers, meta)
@@ -0,0 +1,132 @@
+"""
+pose_features.py
+
+keypoints 配列 (N, 17, 3) から学習・推論用の特徴ベクトルを作る共通モジュール。
+build_dataset.py / academic_data_converter.py / score_batch.py から使い、ブラウザ側
+（analysis.js の preprocessPoseToVector / calculateAngle）と同じ前処理を配列全体に一括で適用します。
+
+特徴セット:
+ - raw        : x, y, score をそのまま（--width/--height があれば x/width, y/height）。従来の出力
+ - hip        : preprocessPoseToVector と同じ。腰の中点（keypoints 11/12）を原点にして
+                x/width, y/height（未指定は 1）、score はそのまま -> 51 次元
+ - hip_angles : hip に膝・肘・肩の左右の関節角度（calculateAngle と同じ定義、/180 で 0..1）を足す -> 57 次元
+
+どの特徴セットで作ったかは feature_spec() の dict としてデータセットの meta と
+モデルと同じディレクトリの feature_spec.json に残し、JS 側は FEATURE_SPEC_VERSION と features を見て
+自分の前処理と一致するかを確認します。前処理の定義を変えたら FEATURE_SPEC_VERSION を上げること。
+
+使い方:
+ kps = kps_to_array(items)                       # (N, 17, 3) float64
+ X = extract_features(kps, 640, 480, 'hip')      # (N, 51) float32
+ write_feature_spec('out/saved-model', feature_spec('hip', 640, 480))
+
+"""
+import json
+import numpy as np
+from pathlib import Path
+
+FEATURE_SPEC_VERSION = 1
+FEATURE_SPEC_FILE = 'feature_spec.json'
+FEATURE_SETS = ('raw', 'hip', 'hip_angles')
+
+NUM_KEYPOINTS = 17
+LEFT_HIP, RIGHT_HIP = 11, 12
+
+# calculateAngle(point1, point2, point3) の 3 点（point2 が角度を測る関節）
+JOINT_ANGLES = (
+    ('left_knee', (11, 13, 15)),
+    ('right_knee', (12, 14, 16)),
+    ('left_elbow', (5, 7, 9)),
+    ('right_elbow', (6, 8, 10)),
+    ('left_shoulder', (7, 5, 11)),
+    ('right_shoulder', (8, 6, 12)),
+)
+ANGLE_SCALE = 180.0
+
+_ANGLE_IDX = np.array([idx for _, idx in JOINT_ANGLES])
+
+
+def feature_dim(features='hip'):
+    if features not in FEATURE_SETS:
+        raise ValueError(f'unknown feature set: {features} (expected one of {FEATURE_SETS})')
+    return NUM_KEYPOINTS * 3 + (len(JOINT_ANGLES) if features == 'hip_angles' else 0)
+
+
+def hip_center(kps):
+    """(..., 17, 3) の腰の中点 (..., 2)。preprocessPoseToVector と同じく (左 + 右) / 2"""
+    return (kps[..., LEFT_HIP, :2] + kps[..., RIGHT_HIP, :2]) / 2
+
+
+def joint_angles(kps):
+    """
+    (..., 17, 3) から JOINT_ANGLES の角度（度, 0..180）を (..., 6) で返す。
+    calculateAngle と同じく 2 本の atan2 の差の絶対値を取り、180 度を超えたら折り返す。
+    """
+    p1, p2, p3 = (kps[..., _ANGLE_IDX[:, i], :2] for i in range(3))
+    radians = (np.arctan2(p3[..., 1] - p2[..., 1], p3[..., 0] - p2[..., 0])
+               - np.arctan2(p1[..., 1] - p2[..., 1], p1[..., 0] - p2[..., 0]))
+    angle = np.abs(radians * 180.0 / np.pi)
+    return np.where(angle > 180.0, 360.0 - angle, angle)
+
+
+def extract_features(kps, width=None, height=None, features='hip', dtype=np.float32):
+    """
+    (N, 17, 3) の keypoints（ピクセル座標、float64 推奨）を (N, feature_dim) の特徴に変換する。
+    計算は入力の精度で行い、最後に dtype に落とす（raw は normalize_xy と同じ結果になる）。
+    """
+    dim = feature_dim(features)
+    n = len(kps)
+    if features == 'raw':
+        xy = kps[..., :2]
+        if width and height:
+            xy = xy / (width, height)
+    else:
+        # ブラウザは videoWidth || 1 / videoHeight || 1 で割る
+        xy = (kps[..., :2] - hip_center(kps)[..., None, :]) / (width or 1, height or 1)
+    out = np.empty((n, dim), dtype=dtype)
+    flat = out[:, :NUM_KEYPOINTS * 3].reshape(n, NUM_KEYPOINTS, 3)
+    flat[..., :2] = xy
+    flat[..., 2] = kps[..., 2]
+    if features == 'hip_angles':
+        # 角度は正規化前のピクセル座標で測る（ブラウザと同じ）
+        out[:, NUM_KEYPOINTS * 3:] = joint_angles(kps) / ANGLE_SCALE
+    return out
+
+
+def feature_spec(features='hip', width=None, height=None):
+    """データセットの meta / feature_spec.json に書く特徴の定義"""
+    dim = feature_dim(features)
+    if features == 'raw':
+        scale = [width, height] if width and height else [1, 1]
+    else:
+        scale = [width or 1, height or 1]
+    return {
+        'version': FEATURE_SPEC_VERSION,
+        'features': features,
+        'dims': dim,
+        'keypoints': NUM_KEYPOINTS,
+        'layout': ['x', 'y', 'score'],
+        'center': None if features == 'raw' else [LEFT_HIP, RIGHT_HIP],
+        'scale': scale,
+        'angles': [[name, *idx] for name, idx in JOINT_ANGLES] if features == 'hip_angles' else [],
+        'angle_scale': ANGLE_SCALE,
+    }
+
+
+def write_feature_spec(directory, spec):
+    path = Path(directory) / FEATURE_SPEC_FILE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(spec, ensure_ascii=False, indent=2), encoding='utf-8')
+    return path
+
+
+def read_feature_spec(directory):
+    """ディレクトリに feature_spec.json があれば読む（なければ None）"""
+    path = Path(directory) / FEATURE_SPEC_FILE
+    if not path.exists():
+        return None
+    spec = json.loads(path.read_text(encoding='utf-8'))
+    if spec.get('version') != FEATURE_SPEC_VERSION:
+        raise ValueError(f'{path}: feature spec version {spec.get("version")} is not supported '
+                         f'(expected {FEATURE_SPEC_VERSION})')
+    return spec
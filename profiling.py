@@ -0,0 +1,206 @@
+"""
+profiling.py
+
+パイプライン共通の計測モジュール。ステージごとの所要時間・カウンタ（読み込んだ行数・スキップ数・
+読み込みバイト数など）・メモリ（RSS とそのピーク）を記録し、Chrome のトレース形式
+（chrome://tracing や https://ui.perfetto.dev で開ける JSON）で書き出します。
+
+各スクリプトの --profile PATH で有効になり、指定しなければ何も記録しない（呼び出しのコストはほぼない）。
+ - stage(name)       : with で囲んだ区間を 1 つのイベントにする（終わりに RSS も記録）
+ - timed_iter(name, it) : イテレータの next() ごとの時間をイベントにする（JSON 解析のチャンク読み込みなど）
+ - count(name, n)    : カウンタに足す（トレースには累計の推移として出る）
+ - gauge(name, value): その時点の値を記録する（エポックごとの samples/s など）
+ - complete(name, start, end) : 別プロセスで測った区間（time.perf_counter の値）を足す
+
+終了時に summary() をトレースの otherData に入れ、print_summary() でステージごとの合計時間・
+カウンタ・ピーク RSS を表示する。
+
+使い方:
+ profiling.start(args.profile)               # None なら何もしないプロファイラ。終了時に JSON を書いて要約を表示
+ with profiling.stage('parse', path=str(path)):
+     ...
+ profiling.count('rows_parsed', len(items))
+
+"""
+import atexit
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+
+def peak_rss_mb():
+    """プロセス開始からの最大常駐メモリ（MB）"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def current_rss_mb():
+    """今の常駐メモリ（MB）。/proc がなければピークで代用する"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return peak_rss_mb()
+
+
+class Profiler:
+    """イベントをメモリに貯め、finish() で Chrome のトレース形式の JSON に書き出す"""
+
+    enabled = True
+
+    def __init__(self, path, name=None):
+        self.path = Path(path)
+        self.name = name or Path(sys.argv[0]).name
+        self.pid = os.getpid()
+        self.t0 = time.perf_counter()
+        self.events = [{'name': 'process_name', 'ph': 'M', 'pid': self.pid, 'args': {'name': self.name}}]
+        self.counters = {}
+        self.stages = {}
+        self.finished = False
+        self._lock = threading.Lock()
+
+    def _us(self, t):
+        return (t - self.t0) * 1e6
+
+    def _add(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def complete(self, name, start, end, tid=None, **args):
+        """[start, end)（time.perf_counter の値）の区間をイベントとして足す"""
+        self._add({'name': name, 'ph': 'X', 'pid': self.pid, 'tid': tid or threading.get_ident(),
+                   'ts': self._us(start), 'dur': (end - start) * 1e6, 'args': args})
+        with self._lock:
+            total = self.stages.setdefault(name, [0, 0.0])
+            total[0] += 1
+            total[1] += end - start
+
+    @contextmanager
+    def stage(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            self.complete(name, start, end, **args)
+            self.gauge('rss_mb', current_rss_mb(), t=end)
+
+    def timed_iter(self, name, iterable):
+        it = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            self.complete(name, start, time.perf_counter())
+            yield item
+
+    def count(self, name, n=1):
+        with self._lock:
+            value = self.counters[name] = self.counters.get(name, 0) + n
+        self.gauge(name, value)
+
+    def gauge(self, name, value, t=None):
+        self._add({'name': name, 'ph': 'C', 'pid': self.pid,
+                   'ts': self._us(time.perf_counter() if t is None else t), 'args': {name: value}})
+
+    def summary(self):
+        return {
+            'wall_s': time.perf_counter() - self.t0,
+            'peak_rss_mb': peak_rss_mb(),
+            'stages': {name: {'calls': calls, 'total_s': total}
+                       for name, (calls, total) in sorted(self.stages.items(), key=lambda kv: -kv[1][1])},
+            'counters': dict(self.counters),
+        }
+
+    def print_summary(self, summary=None):
+        s = summary or self.summary()
+        print(f"Profile: {s['wall_s']:.2f}s wall, peak RSS {s['peak_rss_mb']:.0f} MB -> {self.path}")
+        for name, st in s['stages'].items():
+            share = st['total_s'] / s['wall_s'] if s['wall_s'] else 0.0
+            print(f"  {name:<24} {st['total_s']:>9.3f}s {share:>6.1%}  ({st['calls']} calls)")
+        for name, value in s['counters'].items():
+            print(f'  {name:<24} {value}')
+
+    def finish(self):
+        """トレースを書き出して要約を表示する（2 回目以降は何もしない）"""
+        if self.finished:
+            return self.path
+        self.finished = True
+        summary = self.summary()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        trace = {'traceEvents': self.events, 'displayTimeUnit': 'ms', 'otherData': summary}
+        self.path.write_text(json.dumps(trace, ensure_ascii=False), encoding='utf-8')
+        self.print_summary(summary)
+        return self.path
+
+
+class NullProfiler:
+    """--profile なしのときのプロファイラ（何も記録しない）"""
+
+    enabled = False
+
+    def complete(self, name, start, end, tid=None, **args):
+        pass
+
+    @contextmanager
+    def stage(self, name, **args):
+        yield
+
+    def timed_iter(self, name, iterable):
+        return iterable
+
+    def count(self, name, n=1):
+        pass
+
+    def gauge(self, name, value, t=None):
+        pass
+
+    def finish(self):
+        return None
+
+
+_active = NullProfiler()
+
+
+def start(path, name=None):
+    """
+    path があればプロファイラを有効にして返す（None なら NullProfiler）。
+    途中で return や例外で抜けても書き出されるよう、終了時の finish() も登録する
+    """
+    global _active
+    _active = Profiler(path, name) if path else NullProfiler()
+    if path:
+        atexit.register(_active.finish)
+    return _active
+
+
+def active():
+    return _active
+
+
+def stage(name, **args):
+    return _active.stage(name, **args)
+
+
+def timed_iter(name, iterable):
+    return _active.timed_iter(name, iterable)
+
+
+def count(name, n=1):
+    _active.count(name, n)
+
+
+def gauge(name, value):
+    _active.gauge(name, value)
+
+
+def complete(name, start, end, tid=None, **args):
+    _active.complete(name, start, end, tid, **args)
@@ -0,0 +1,203 @@
+"""
+score_batch.py
+
+train_model.py で学習した saved-model を使い、エクスポート（JSON/JSONL）をまとめてオフライン採点するスクリプト。
+ブラウザの aiPredictFromKeypoints は 1 フレームずつ [1, 51] で predict しますが、ここでは
+ストリーミングで読み込んだフレームを大きなバッチでまとめて推論し、8 つの LABELS スコアを
+列ごとの配列として書き出します。
+
+入力は build_dataset.py と同じく複数ファイル・ディレクトリ・glob を指定でき、labels は不要です。
+前処理は saved-model に feature_spec.json があればその特徴セットと width/height を使います。
+ない場合（古いモデル）は --features/--width/--height を学習データを作ったときと同じ指定にしてください。
+
+出力:
+ - npy : ディレクトリに shard.npy, frame.npy, balance.npy, ..., stability.npy（各 N 行）と meta.json
+ - csv : shard,frame,balance,...,stability の CSV
+ shard は入力ファイルの番号（meta.json / 標準出力に一覧）、frame はファイル内の行番号
+
+--engine numpy では saved-model（または export）の model.npz を numpy_model.py で推論し、
+TensorFlow を import しないので起動が速くメモリも少なく済みます。
+
+使い方:
+ python score_batch.py --model out/saved-model --in "exports/*.jsonl" --out scores/ --batch-size 8192
+ python score_batch.py --model out/saved-model --engine numpy --in "exports/*.jsonl" --out scores/
+
+ # JSON 解析（先読みスレッド）・推論・書き出しの時間を Chrome のトレース形式で書き出す（profiling.py）。
+ # wait_chunk が長ければ JSON 解析が、predict が長ければ推論が律速
+ python score_batch.py --model out/saved-model --engine numpy --in "exports/*.jsonl" --out scores/ --profile trace.json
+
+"""
+import argparse
+import csv
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import profiling
+from build_dataset import LABEL_KEYS, items_to_features, iter_chunks, iter_json_items, resolve_inputs
+from dataset_io import DatasetWriter
+from pose_features import FEATURE_SETS, feature_spec, read_feature_spec
+
+LABELS = LABEL_KEYS
+
+
+def load_scoring_model(path):
+    """saved-model を読み込み、(N, 特徴次元) float32 -> (N, 8) を返す関数にする"""
+    import tensorflow as tf
+    try:
+        model = tf.keras.models.load_model(path, compile=False)
+        return lambda X: np.asarray(model(X, training=False))
+    except Exception:
+        # Keras として読めない SavedModel はシグネチャ経由で呼ぶ
+        loaded = tf.saved_model.load(path)
+        fn = loaded.signatures['serving_default']
+
+        def predict(X):
+            out = fn(tf.constant(X))
+            return np.asarray(next(iter(out.values())))
+        return predict
+
+
+def load_numpy_engine(path):
+    """model.npz（numpy_model.py）を読み込み、load_scoring_model と同じ形の関数にする"""
+    from numpy_model import load_numpy_model
+    model = load_numpy_model(path)
+    return model.predict
+
+
+def iter_feature_chunks(paths, width=None, height=None, chunk_size=65536, features='raw'):
+    """入力を順に読み、(shard 番号, frame 番号, X) のチャンクを返す"""
+    for shard, path in enumerate(paths):
+        offset = 0
+        for items in profiling.timed_iter('parse_json', iter_chunks(iter_json_items(path), chunk_size)):
+            with profiling.stage('features', rows=len(items)):
+                X, index = items_to_features(items, width, height, features)
+            profiling.count('rows_parsed', len(items))
+            profiling.count('rows_skipped', len(items) - len(index))
+            yield shard, index + offset, X
+            offset += len(items)
+
+
+def prefetch(iterable, depth=2):
+    """別スレッドで次のチャンクを先読みする（JSON 解析と推論を重ねるため）"""
+    it = iter(iterable)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = [pool.submit(next, it, None) for _ in range(depth)]
+        while True:
+            item = pending.pop(0).result()
+            if item is None:
+                return
+            pending.append(pool.submit(next, it, None))
+            yield item
+
+
+class CsvScoreWriter:
+    """DatasetWriter と同じ write/close で CSV を書く"""
+
+    def __init__(self, out_path):
+        self.out_path = Path(out_path)
+        self.out_path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = open(self.out_path, 'w', newline='', encoding='utf-8')
+        self._w = csv.writer(self._f)
+        self._w.writerow(['shard', 'frame'] + LABELS)
+        self.rows = 0
+
+    def write(self, shard, frame, **scores):
+        cols = [shard, frame] + [scores[k].astype(np.float64).round(6) for k in LABELS]
+        self._w.writerows(zip(*(c.tolist() for c in cols)))
+        self.rows += len(frame)
+
+    def close(self):
+        self._f.close()
+        return self.out_path
+
+
+def open_score_writer(out, fmt, paths, spec=None):
+    if fmt == 'csv':
+        return CsvScoreWriter(out)
+    arrays = {'shard': ((), np.int32), 'frame': ((), np.int64)}
+    arrays.update({k: ((), np.float32) for k in LABELS})
+    return DatasetWriter(out, 'npy', arrays=arrays, meta={'labels': LABELS, 'inputs': [str(p) for p in paths],
+                                                          'feature_spec': spec})
+
+
+def resolve_features(model_path, features=None, width=None, height=None):
+    """
+    モデルの feature_spec.json とコマンドライン指定から (features, width, height) を決める。
+    コマンドライン指定が優先。どちらもなければ従来どおり raw。
+    --window で学習したモデル（入力が window フレーム分）は 1 フレームずつ採点できないので ValueError。
+    """
+    model_dir = Path(model_path)
+    spec = read_feature_spec(model_dir if model_dir.is_dir() else model_dir.parent)
+    if spec is None:
+        return features or 'raw', width, height
+    if spec.get('window'):
+        raise ValueError(f"{model_path}: window models ({spec['window']} frames per input) cannot be scored "
+                         'frame by frame')
+    if features and features != spec['features']:
+        print(f"warning: model was trained on '{spec['features']}' features, scoring with '{features}'")
+    spec_w, spec_h = spec['scale']
+    return features or spec['features'], width or spec_w, height or spec_h
+
+
+def score(predict, paths, writer, width=None, height=None, batch_size=8192, chunk_size=65536, features='raw'):
+    """全入力を採点して writer に書き出す。戻り値は採点したフレーム数"""
+    total = 0
+    chunks = prefetch(iter_feature_chunks(paths, width, height, chunk_size, features))
+    for shard, frame, X in profiling.timed_iter('wait_chunk', chunks):
+        for start in range(0, len(X), batch_size):
+            with profiling.stage('predict'):
+                Y = predict(X[start:start + batch_size])
+            stop = start + len(Y)
+            with profiling.stage('write'):
+                writer.write(shard=np.full(len(Y), shard, dtype=np.int32), frame=frame[start:stop],
+                             **{k: Y[:, i].astype(np.float32) for i, k in enumerate(LABELS)})
+            total += len(Y)
+            profiling.count('rows_scored', len(Y))
+    return total
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument('--model', required=True,
+                   help='saved-model directory written by train_model.py (or an export folder / model.npz)')
+    p.add_argument('--engine', choices=('tf', 'numpy'), default='tf',
+                   help='tf: load with TensorFlow, numpy: run model.npz without importing TensorFlow')
+    p.add_argument('--in', dest='input', required=True, nargs='+',
+                   help='input JSON/JSONL file(s), directories or glob patterns')
+    p.add_argument('--out', required=True, help='output directory (npy) or csv file')
+    p.add_argument('--format', dest='fmt', choices=('npy', 'csv'), default='npy')
+    p.add_argument('--features', choices=FEATURE_SETS,
+                   help='feature set used when building the training data (default: from the model feature_spec.json)')
+    p.add_argument('--width', type=int, help='video width used when building the training data')
+    p.add_argument('--height', type=int, help='video height used when building the training data')
+    p.add_argument('--batch-size', type=int, default=8192, help='frames per predict call')
+    p.add_argument('--chunk-size', type=int, default=65536, help='frames parsed per chunk')
+    p.add_argument('--profile', metavar='TRACE_JSON',
+                   help='write stage timings, counters and RSS as a Chrome trace (open in chrome://tracing)')
+    args = p.parse_args()
+    profiling.start(args.profile)
+
+    paths = resolve_inputs(args.input)
+    try:
+        features, width, height = resolve_features(args.model, args.features, args.width, args.height)
+    except ValueError as e:
+        p.error(str(e))
+    with profiling.stage('load_model', engine=args.engine):
+        predict = load_numpy_engine(args.model) if args.engine == 'numpy' else load_scoring_model(args.model)
+    writer = open_score_writer(args.out, args.fmt, paths, feature_spec(features, width, height))
+    t0 = time.perf_counter()
+    try:
+        n = score(predict, paths, writer, width, height, args.batch_size, args.chunk_size, features)
+    finally:
+        writer.close()
+    elapsed = time.perf_counter() - t0
+    for i, path in enumerate(paths):
+        print(f'  shard {i}: {path}')
+    print(f'Scored {n} frames from {len(paths)} inputs in {elapsed:.1f}s '
+          f'({n / elapsed if elapsed else 0:.0f} frames/s), wrote {args.out}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,698 @@
+"""
+scoring_server.py
+
+train_model.py で学習したモデルを localhost で動かす採点サーバ。
+analysis.js の aiPredictFromKeypoints はフレームごとに [1, 51] の predict を 1 回呼びますが、
+複数カメラのレビューでは各カメラのフレームをこのサーバに送り、同時に届いたリクエストを
+まとめて 1 回の順伝播（マイクロバッチ）で採点します。
+
+ - 最初のリクエストが届いてから --max-delay-ms（遅延の予算）だけ待つか、--max-batch-size 件たまったら
+   まとめて推論する。前のバッチの推論中に届いたリクエストは次のバッチにそのまま入る
+ - 推論は 1 本のスレッドで行い、その間もイベントループは次のリクエストを受け付ける
+ - 前処理は score_batch.py と同じく、モデルの feature_spec.json の特徴セットと width/height を使う
+   （リクエストに width / height があればそちらを使う。ブラウザの videoWidth / videoHeight）
+ - --engine numpy（既定）は model.npz（numpy_model.py）を TensorFlow なしで、--engine tf は saved-model を使う
+ - 127.0.0.1 などのループバックアドレスでしか待ち受けない（外部には公開しない）
+ - ブラウザからのリクエスト（Origin ヘッダ付き）は --allow-origin で指定したオリジンだけを受け付ける。
+   指定がなければブラウザからは使えず、Origin を送らないクライアント（負荷クライアントや curl）だけが使える。
+   WebSocket には CORS が効かないので、接続時の Origin も同じように確かめる
+
+エンドポイント:
+ - POST /predict : {"keypoints": [{"x":..., "y":..., "score":...}, ...], "width": 640, "height": 480}
+                   -> {"scores": {"balance": ..., ..., "stability": ...}}
+                   {"frames": [{"keypoints": [...]}, ...]} なら {"scores": [{...}, ...]}
+ - GET /ws       : WebSocket。{"id": 1, "keypoints": [...]} を送ると {"id": 1, "scores": {...}} が返る
+                   （1 本の接続で返事を待たずに続けて送ってよい。返事の順番は届いた順とは限らない）
+ - GET /metrics  : 直近のリクエストのレイテンシ p50 / p99（受信から返信まで）、バッチサイズの分布など
+ - GET /healthz  : モデルと設定
+
+使い方:
+ python scoring_server.py --model out/saved-model --port 8765 --max-delay-ms 5 --max-batch-size 256
+
+ # アプリのページ（http://localhost:8000）から fetch / WebSocket で使う
+ python scoring_server.py --model out/saved-model --allow-origin http://localhost:8000
+
+ # 付属の負荷クライアント（合成 keypoints を 64 並列で 20000 件。/metrics も表示する）
+ python scoring_server.py load --port 8765 --concurrency 64 --requests 20000 --protocol ws
+
+ # サーバを同じプロセスで立ち上げて負荷をかける（1 コマンドで確認）
+ python scoring_server.py load --model out/saved-model --concurrency 64 --requests 20000
+
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import ipaddress
+import json
+import os
+import socket
+import struct
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+import numpy as np
+
+from build_dataset import EXPECTED_KP, kps_to_array
+from pose_features import extract_features, feature_dim
+from score_batch import LABELS, load_numpy_engine, load_scoring_model, resolve_features
+
+DEFAULT_PORT = 8765
+MAX_BODY = 1 << 20
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_TEXT, WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x1, 0x2, 0x8, 0x9, 0xA
+WS_PROTOCOL_ERROR, WS_MESSAGE_TOO_BIG = 1002, 1009
+
+
+def check_loopback(host):
+    """host がループバックアドレス（localhost / 127.0.0.1 / ::1）だけに解決されることを確かめる"""
+    try:
+        addrs = {info[4][0] for info in socket.getaddrinfo(host, None)}
+    except socket.gaierror as e:
+        raise ValueError(f'cannot resolve {host}: {e}')
+    if not all(ipaddress.ip_address(a.split('%')[0]).is_loopback for a in addrs):
+        raise ValueError(f'{host} is not a loopback address; the scoring server only listens on localhost')
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class WebSocketClose(Exception):
+    """アップグレード後のエラー。HTTP のレスポンスではなく code 付きの close フレームで閉じる"""
+
+    def __init__(self, code, reason):
+        super().__init__(reason)
+        self.code = code
+
+
+# ---- 指標 ----
+
+class Metrics:
+    """直近 window 件のレイテンシとバッチサイズを持ち、snapshot() で p50 / p99 などを返す"""
+
+    def __init__(self, window=10000):
+        self.latencies = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.started = time.monotonic()
+
+    def record_request(self, seconds):
+        self.requests += 1
+        self.latencies.append(seconds)
+
+    def record_batch(self, size):
+        self.batches += 1
+        self.batch_sizes.append(size)
+
+    def snapshot(self, queued=0):
+        lat = np.array(self.latencies) * 1e3
+        sizes = np.array(self.batch_sizes)
+        uptime = time.monotonic() - self.started
+        out = {
+            'requests': self.requests,
+            'batches': self.batches,
+            'errors': self.errors,
+            'queued': queued,
+            'uptime_s': uptime,
+            'requests_per_sec': self.requests / uptime if uptime else 0.0,
+            'window': len(lat),
+        }
+        if len(lat):
+            out['latency_ms'] = {'p50': float(np.percentile(lat, 50)), 'p99': float(np.percentile(lat, 99)),
+                                 'mean': float(lat.mean()), 'max': float(lat.max())}
+        if len(sizes):
+            # 2 のべき乗ごとの件数（1, 2-3, 4-7, ...）
+            buckets = np.bincount(np.log2(sizes).astype(int))
+            out['batch_size'] = {'p50': float(np.percentile(sizes, 50)), 'p99': float(np.percentile(sizes, 99)),
+                                 'mean': float(sizes.mean()), 'max': int(sizes.max()),
+                                 'histogram': {f'{1 << i}-{(2 << i) - 1}': int(c)
+                                               for i, c in enumerate(buckets) if c}}
+        return out
+
+
+def format_metrics(m):
+    line = f"{m['requests']} requests ({m['requests_per_sec']:.0f}/s), {m['batches']} batches"
+    if 'latency_ms' in m:
+        line += f", latency p50 {m['latency_ms']['p50']:.2f} ms p99 {m['latency_ms']['p99']:.2f} ms"
+    if 'batch_size' in m:
+        line += f", batch mean {m['batch_size']['mean']:.1f} p99 {m['batch_size']['p99']:.0f}"
+    return line + (f", {m['errors']} errors" if m['errors'] else '')
+
+
+# ---- マイクロバッチ ----
+
+class MicroBatcher:
+    """
+    submit(x) で 1 行分の特徴を受け取り、予測 (8,) を返す。run() がキューから行を集め、
+    最初の行が届いてから max_delay 秒か max_batch_size 行で predict をまとめて 1 回呼ぶ。
+    predict は専用のスレッドで呼ぶので、推論中もイベントループは止まらない。
+    """
+
+    def __init__(self, predict, max_batch_size=256, max_delay=0.005, metrics=None):
+        self.predict = predict
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.metrics = metrics or Metrics()
+        self.queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='predict')
+
+    async def submit(self, x):
+        fut = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((time.monotonic(), x, fut))
+        return await fut
+
+    async def _collect(self):
+        # 最初の行の到着時刻から max_delay 以内に届いた行（とすでに待っている行）をまとめる
+        loop = asyncio.get_running_loop()
+        first = await self.queue.get()
+        batch = [first]
+        deadline = first[0] + self.max_delay
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            X = np.stack([x for _, x, _ in batch])
+            try:
+                Y = await loop.run_in_executor(self._executor, self.predict, X)
+            except Exception as e:
+                self.metrics.errors += len(batch)
+                for _, _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            self.metrics.record_batch(len(batch))
+            for (_, _, fut), y in zip(batch, np.asarray(Y)):
+                if not fut.done():
+                    fut.set_result(y)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+# ---- HTTP / WebSocket ----
+
+async def read_http_message(reader):
+    """
+    HTTP/1.1 のリクエストまたはレスポンスを 1 つ読む。
+    戻り値は (リクエスト行 / ステータス行の 3 要素, ヘッダの dict（小文字）, 本文)。接続が閉じていれば None
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode('latin-1').strip().split(None, 2)
+    if len(parts) < 2:
+        raise HttpError(400, 'malformed start line')
+    headers = {}
+    while True:
+        h = await reader.readline()
+        if h in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = h.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        n = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HttpError(400, 'bad Content-Length')
+    if n > MAX_BODY:
+        raise HttpError(413, f'body larger than {MAX_BODY} bytes')
+    body = await reader.readexactly(n) if n else b''
+    return parts + [''] * (3 - len(parts)), headers, body
+
+
+def http_response(status, payload=None, keep_alive=True, origin=None):
+    """origin（許可したオリジン）を渡したときだけ CORS のヘッダを付ける"""
+    body = json.dumps(payload).encode() if payload is not None else b''
+    head = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}',
+            'Content-Type: application/json',
+            f'Content-Length: {len(body)}']
+    if origin:
+        head += [f'Access-Control-Allow-Origin: {origin}',
+                 'Access-Control-Allow-Methods: GET, POST, OPTIONS',
+                 'Access-Control-Allow-Headers: Content-Type',
+                 'Vary: Origin']
+    head.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+    return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body
+
+
+def ws_accept_key(key):
+    return base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+
+
+def ws_frame(opcode, payload, mask=False):
+    """WebSocket のフレームを 1 つ作る（クライアントからのフレームは mask=True）"""
+    n = len(payload)
+    head = bytes([0x80 | opcode])
+    bit = 0x80 if mask else 0
+    if n < 126:
+        head += bytes([bit | n])
+    elif n < 1 << 16:
+        head += bytes([bit | 126]) + struct.pack('!H', n)
+    else:
+        head += bytes([bit | 127]) + struct.pack('!Q', n)
+    if mask:
+        key = os.urandom(4)
+        return head + key + _xor_mask(payload, key)
+    return head + payload
+
+
+def _xor_mask(payload, key):
+    # 4 バイトの鍵を繰り返して XOR（1 バイトずつのループを避けて整数でまとめて計算する）
+    n = len(payload)
+    if not n:
+        return payload
+    keystream = (key * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(keystream, 'big')).to_bytes(n, 'big')
+
+
+class WebSocketReader:
+    """
+    read() で制御フレーム 1 つ、またはデータフレームを継続フレームまでつないだメッセージを (opcode, payload) で返す。
+    分割されたメッセージの途中に届いた制御フレーム（ping / pong / close）もそのまま返し、
+    読みかけのメッセージは次の read() で続きから組み立てる（RFC 6455 5.4）
+    """
+
+    def __init__(self, reader):
+        self.reader = reader
+        self.opcode, self.chunks, self.size = None, [], 0
+
+    async def read(self):
+        while True:
+            b0, b1 = await self.reader.readexactly(2)
+            fin, op, n = b0 & 0x80, b0 & 0x0F, b1 & 0x7F
+            if n == 126:
+                n = struct.unpack('!H', await self.reader.readexactly(2))[0]
+            elif n == 127:
+                n = struct.unpack('!Q', await self.reader.readexactly(8))[0]
+            if op >= 0x8:
+                if not fin or n > 125:
+                    raise WebSocketClose(WS_PROTOCOL_ERROR, 'control frames must be unfragmented and <= 125 bytes')
+            elif not op and self.opcode is None:
+                raise WebSocketClose(WS_PROTOCOL_ERROR, 'continuation frame without a message in progress')
+            elif op and self.opcode is not None:
+                raise WebSocketClose(WS_PROTOCOL_ERROR, 'new data frame before the fragmented message ended')
+            else:
+                # 大きさはデータフレームの分だけ数える（間に挟まった制御フレームは含めない）
+                self.size += n
+                if self.size > MAX_BODY:
+                    raise WebSocketClose(WS_MESSAGE_TOO_BIG, f'message larger than {MAX_BODY} bytes')
+            key = await self.reader.readexactly(4) if b1 & 0x80 else None
+            payload = await self.reader.readexactly(n)
+            if key:
+                payload = _xor_mask(payload, key)
+            if op >= 0x8:
+                return op, payload
+            if op:
+                self.opcode = op
+            self.chunks.append(payload)
+            if fin:
+                message = self.opcode, b''.join(self.chunks)
+                self.opcode, self.chunks, self.size = None, [], 0
+                return message
+
+
+class ScoringServer:
+    """HTTP / WebSocket のリクエストを特徴に変換して MicroBatcher に渡す"""
+
+    def __init__(self, predict, features='raw', width=None, height=None, max_batch_size=256, max_delay_ms=5.0,
+                 window=10000, info=None, allow_origins=()):
+        self.features = features
+        self.allow_origins = set(allow_origins)
+        self.width = width
+        self.height = height
+        self.metrics = Metrics(window)
+        self.batcher = MicroBatcher(predict, max_batch_size, max_delay_ms / 1000, self.metrics)
+        self.info = dict(info or {}, features=features, scale=[width, height], input_dim=feature_dim(features),
+                         max_batch_size=max_batch_size, max_delay_ms=max_delay_ms, labels=LABELS,
+                         allow_origins=sorted(self.allow_origins))
+        self._tasks = set()
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        check_loopback(host)
+        self._runner = asyncio.create_task(self.batcher.run())
+        return await asyncio.start_server(self.handle, host, port)
+
+    def close(self):
+        self._runner.cancel()
+        self.batcher.close()
+
+    def frame_features(self, frame):
+        """1 フレーム（{"keypoints": [...], "width", "height"}）を (feature_dim,) の特徴にする"""
+        if not isinstance(frame, dict):
+            raise ValueError('each frame must be an object with keypoints')
+        kps = frame.get('keypoints')
+        if not isinstance(kps, list) or not kps:
+            raise ValueError('keypoints must be a non-empty list of {x, y, score}')
+        arr = kps_to_array([kps[:EXPECTED_KP]], dtype=np.float64)
+        width = frame.get('width') or self.width
+        height = frame.get('height') or self.height
+        return extract_features(arr, width, height, self.features)[0]
+
+    async def score(self, frame):
+        t0 = time.monotonic()
+        try:
+            x = self.frame_features(frame)
+        except (ValueError, TypeError, KeyError, AttributeError) as e:
+            self.metrics.errors += 1
+            raise HttpError(400, f'bad frame: {e}')
+        y = await self.batcher.submit(x)
+        self.metrics.record_request(time.monotonic() - t0)
+        return {k: float(v) for k, v in zip(LABELS, y)}
+
+    def check_origin(self, headers):
+        """
+        ブラウザが付ける Origin が許可したものか確かめ、CORS で返すオリジンを返す（Origin がなければ None）。
+        ほかのサイトのページが localhost の採点サーバにリクエストを送れないようにする
+        """
+        origin = headers.get('origin')
+        if origin is not None and origin not in self.allow_origins:
+            raise HttpError(403, f'origin {origin} is not allowed (see --allow-origin)')
+        return origin
+
+    async def route(self, method, path, body):
+        if method == 'OPTIONS':
+            return 204, None
+        if path == '/predict' and method == 'POST':
+            try:
+                req = json.loads(body)
+            except ValueError as e:
+                raise HttpError(400, f'invalid JSON: {e}')
+            if isinstance(req, dict) and isinstance(req.get('frames'), list):
+                return 200, {'scores': list(await asyncio.gather(*(self.score(f) for f in req['frames'])))}
+            return 200, {'scores': await self.score(req)}
+        if path == '/metrics' and method == 'GET':
+            return 200, self.metrics.snapshot(self.batcher.queue.qsize())
+        if path == '/healthz' and method == 'GET':
+            return 200, dict(self.info, ok=True)
+        raise HttpError(404, f'no route for {method} {path}')
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                origin = None
+                try:
+                    msg = await read_http_message(reader)
+                    if msg is None:
+                        break
+                    (method, target, version), headers, body = msg
+                    path = target.split('?', 1)[0]
+                    origin = self.check_origin(headers)
+                    if path == '/ws' and headers.get('upgrade', '').lower() == 'websocket':
+                        await self.websocket(reader, writer, headers)
+                        break
+                    connection = headers.get('connection', '').lower()
+                    keep_alive = connection != 'close' and (version != 'HTTP/1.0' or connection == 'keep-alive')
+                    status, payload = await self.route(method.upper(), path, body)
+                except HttpError as e:
+                    status, payload, keep_alive = e.status, {'error': str(e)}, e.status != 413
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    raise
+                except Exception as e:
+                    # 推論の失敗などはクライアントに返して接続を閉じる
+                    status, payload, keep_alive = 500, {'error': f'{type(e).__name__}: {e}'}, False
+                writer.write(http_response(status, payload, keep_alive, origin))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def websocket(self, reader, writer, headers):
+        key = headers.get('sec-websocket-key')
+        if not key:
+            raise HttpError(400, 'missing Sec-WebSocket-Key')
+        writer.write(('HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                      f'Sec-WebSocket-Accept: {ws_accept_key(key)}\r\n\r\n').encode('latin-1'))
+        await writer.drain()
+        ws = WebSocketReader(reader)
+        try:
+            while True:
+                opcode, payload = await ws.read()
+                if opcode == WS_CLOSE:
+                    writer.write(ws_frame(WS_CLOSE, payload[:2]))
+                    await writer.drain()
+                    return
+                if opcode == WS_PING:
+                    writer.write(ws_frame(WS_PONG, payload))
+                elif opcode in (WS_TEXT, WS_BINARY):
+                    # 返事を待たずに次のメッセージを読む（同じ接続のフレームも同じバッチに入る）
+                    task = asyncio.create_task(self.ws_reply(writer, payload))
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+        except WebSocketClose as e:
+            # 理由は close フレームに入る 123 バイトまで
+            writer.write(ws_frame(WS_CLOSE, struct.pack('!H', e.code) + str(e).encode()[:123]))
+            await writer.drain()
+
+    async def ws_reply(self, writer, payload):
+        msg_id = None
+        try:
+            req = json.loads(payload)
+            msg_id = req.get('id') if isinstance(req, dict) else None
+            reply = {'id': msg_id, 'scores': await self.score(req)}
+        except (ValueError, HttpError) as e:
+            reply = {'id': msg_id, 'error': str(e)}
+        except Exception as e:
+            reply = {'id': msg_id, 'error': f'{type(e).__name__}: {e}'}
+        if not writer.is_closing():
+            writer.write(ws_frame(WS_TEXT, json.dumps(reply).encode()))
+            try:
+                await writer.drain()
+            except ConnectionError:
+                pass
+
+
+async def report_metrics(server, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(format_metrics(server.metrics.snapshot(server.batcher.queue.qsize())), flush=True)
+
+
+def build_server(args):
+    features, width, height = resolve_features(args.model, args.features, args.width, args.height)
+    predict = load_numpy_engine(args.model) if args.engine == 'numpy' else load_scoring_model(args.model)
+    return ScoringServer(predict, features, width, height, args.max_batch_size, args.max_delay_ms,
+                         info={'model': str(args.model), 'engine': args.engine}, allow_origins=args.allow_origin or ())
+
+
+def add_server_args(p, required=True):
+    p.add_argument('--model', required=required,
+                   help='saved-model directory written by train_model.py (or an export folder / model.npz)')
+    p.add_argument('--engine', choices=('numpy', 'tf'), default='numpy',
+                   help='numpy: run model.npz without TensorFlow, tf: load the saved-model with TensorFlow')
+    p.add_argument('--features', choices=('raw', 'hip', 'hip_angles'),
+                   help='feature set used when building the training data (default: from the model feature_spec.json)')
+    p.add_argument('--width', type=int, help='default video width when a request has none')
+    p.add_argument('--height', type=int, help='default video height when a request has none')
+    p.add_argument('--max-batch-size', type=int, default=256, help='frames per forward pass at most')
+    p.add_argument('--max-delay-ms', type=float, default=5.0,
+                   help='latency budget: how long the first frame of a batch waits for others')
+    p.add_argument('--allow-origin', action='append', metavar='ORIGIN',
+                   help='browser origin allowed to call the server, e.g. http://localhost:8000 (repeatable; '
+                        'default: none, so only clients that send no Origin header)')
+
+
+def main():
+    p = argparse.ArgumentParser(description='micro-batching scoring server on localhost')
+    add_server_args(p)
+    p.add_argument('--host', default='127.0.0.1', help='loopback address to listen on')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    p.add_argument('--report-every', type=float, default=10.0, help='seconds between metric lines (0: off)')
+    args = p.parse_args()
+    if args.max_batch_size < 1 or args.max_delay_ms < 0:
+        p.error('--max-batch-size must be positive and --max-delay-ms non-negative')
+    try:
+        check_loopback(args.host)
+        server = build_server(args)
+    except ValueError as e:
+        p.error(str(e))
+
+    async def serve():
+        listener = await server.start(args.host, args.port)
+        print(f"Scoring on http://{args.host}:{args.port} (/predict, /ws, /metrics) with {server.info['engine']} "
+              f"engine, {server.features} features, batches up to {args.max_batch_size} within "
+              f"{args.max_delay_ms:g} ms", flush=True)
+        reporter = asyncio.create_task(report_metrics(server, args.report_every)) if args.report_every > 0 else None
+        try:
+            async with listener:
+                await listener.serve_forever()
+        finally:
+            if reporter:
+                reporter.cancel()
+            server.close()
+            print('Final:', format_metrics(server.metrics.snapshot()))
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+# ---- 負荷クライアント ----
+
+def synthetic_frames(n, seed=0, width=640, height=480):
+    """bench_pipeline.py の合成エクスポートと同じ分布の keypoints を JSON 文字列で n 個作る"""
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 1, (n, EXPECTED_KP, 2)) * (width, height)
+    score = rng.uniform(0, 1, (n, EXPECTED_KP))
+    return [json.dumps([{'x': round(float(x), 2), 'y': round(float(y), 2), 'score': round(float(s), 4)}
+                        for (x, y), s in zip(xy[i], score[i])]) for i in range(n)]
+
+
+async def http_load_worker(host, port, frames, jobs, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for i in jobs:
+            body = b'{"keypoints": %s}' % frames[i % len(frames)].encode()
+            t0 = time.perf_counter()
+            writer.write(b'POST /predict HTTP/1.1\r\nHost: %s\r\nContent-Type: application/json\r\n'
+                         b'Content-Length: %d\r\n\r\n%s' % (host.encode(), len(body), body))
+            await writer.drain()
+            (_, status, _), _, _ = await read_http_message(reader)
+            latencies.append(time.perf_counter() - t0)
+            if status != '200':
+                errors.append(status)
+    finally:
+        writer.close()
+
+
+async def ws_load_worker(host, port, frames, jobs, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write((f'GET /ws HTTP/1.1\r\nHost: {host}:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                  f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n').encode('latin-1'))
+    await writer.drain()
+    (_, status, _), headers, _ = await read_http_message(reader)
+    if status != '101' or headers.get('sec-websocket-accept') != ws_accept_key(key):
+        raise ConnectionError(f'WebSocket handshake failed ({status})')
+    ws = WebSocketReader(reader)
+    try:
+        for i in jobs:
+            msg = b'{"id": %d, "keypoints": %s}' % (i, frames[i % len(frames)].encode())
+            t0 = time.perf_counter()
+            writer.write(ws_frame(WS_TEXT, msg, mask=True))
+            await writer.drain()
+            opcode, payload = await ws.read()
+            while opcode != WS_TEXT:
+                opcode, payload = await ws.read()
+            latencies.append(time.perf_counter() - t0)
+            if 'error' in json.loads(payload):
+                errors.append(payload)
+        writer.write(ws_frame(WS_CLOSE, struct.pack('!H', 1000), mask=True))
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def fetch_metrics(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(f'GET /metrics HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
+        _, _, body = await read_http_message(reader)
+        return json.loads(body)
+    finally:
+        writer.close()
+
+
+async def run_load(host, port, protocol='http', concurrency=64, requests=10000, seed=0):
+    """concurrency 本の接続からそれぞれ 1 件ずつ（返事を待ってから次を）送り、クライアント側の結果と /metrics を返す"""
+    frames = synthetic_frames(min(requests, 1024), seed)
+    jobs = iter(range(requests))  # 全ワーカーで共有する（next() の間に await しないので取り合わない）
+    latencies, errors = [], []
+    worker = ws_load_worker if protocol == 'ws' else http_load_worker
+    t0 = time.perf_counter()
+    await asyncio.gather(*(worker(host, port, frames, jobs, latencies, errors) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+    lat = np.array(latencies) * 1e3
+    client = {'protocol': protocol, 'concurrency': concurrency, 'requests': len(lat), 'errors': len(errors),
+              'elapsed_s': elapsed, 'requests_per_sec': len(lat) / elapsed if elapsed else 0.0,
+              'latency_ms': {'p50': float(np.percentile(lat, 50)), 'p99': float(np.percentile(lat, 99)),
+                             'mean': float(lat.mean()), 'max': float(lat.max())} if len(lat) else {}}
+    return client, await fetch_metrics(host, port)
+
+
+def print_load_report(client, server):
+    lat = client['latency_ms']
+    print(f"Client: {client['requests']} {client['protocol']} requests from {client['concurrency']} connections "
+          f"in {client['elapsed_s']:.2f}s ({client['requests_per_sec']:.0f}/s), "
+          f"latency p50 {lat.get('p50', 0):.2f} ms p99 {lat.get('p99', 0):.2f} ms"
+          + (f", {client['errors']} errors" if client['errors'] else ''))
+    print('Server:', format_metrics(server))
+    for bucket, count in server.get('batch_size', {}).get('histogram', {}).items():
+        print(f'  batch {bucket:>9}: {count}')
+
+
+def load_main(argv):
+    p = argparse.ArgumentParser(prog='scoring_server.py load',
+                                description='synthetic load test against a scoring server on localhost')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=DEFAULT_PORT)
+    p.add_argument('--protocol', choices=('http', 'ws'), default='http')
+    p.add_argument('--concurrency', type=int, default=64, help='parallel connections (one frame in flight each)')
+    p.add_argument('--requests', type=int, default=10000, help='total frames to score')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out', help='write the client results and server metrics as JSON')
+    add_server_args(p, required=False)
+    p.set_defaults(model=None)
+    args = p.parse_args(argv)
+    if args.concurrency < 1 or args.requests < 1:
+        p.error('--concurrency and --requests must be positive')
+    try:
+        check_loopback(args.host)
+        # --model があれば同じプロセスで空いているポートにサーバを立てる
+        server = build_server(args) if args.model else None
+    except ValueError as e:
+        p.error(str(e))
+
+    async def run():
+        listener = None
+        port = args.port
+        if server:
+            listener = await server.start(args.host, 0)
+            port = listener.sockets[0].getsockname()[1]
+            print(f'Started scoring server on port {port} ({server.features} features, '
+                  f'batches up to {args.max_batch_size} within {args.max_delay_ms:g} ms)')
+        try:
+            return await run_load(args.host, port, args.protocol, args.concurrency, args.requests, args.seed)
+        finally:
+            if listener:
+                listener.close()
+                server.close()
+
+    client, metrics = asyncio.run(run())
+    print_load_report(client, metrics)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({'client': client, 'server': metrics}, f, indent=2)
+        print('Wrote', args.out)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'load':
+        load_main(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,293 @@
+"""
+sweep.py
+
+train_model.build_model の構成（隠れ層のサイズ）・バッチサイズ・学習率のグリッドを
+k-fold 交差検証でまとめて評価し、平均の検証損失で順位を付けた表を出すスクリプト。
+
+ - 構成 x fold の各ジョブをプロセスプールで並列に実行する。各ワーカーは同じ npy ディレクトリを
+   mmap で読み取り専用に開くので、データセットはワーカー数に関係なく 1 つ分のページキャッシュで共有される
+   （npz を渡した場合は最初に一時 npy ディレクトリへ 1 回だけ展開する）
+ - ワーカーごとに TensorFlow のスレッド数を --threads に制限する（既定は CPU 数 / --workers）。
+   ワーカー同士がコアを取り合わないようにするため
+ - fold は行の並び順に連続した k 個のブロック（エクスポートは時系列なので、ほぼ同じ連続フレームが
+   学習と検証の両方に入らないように、シャッフルした行ではなくブロックで分ける）
+ - 重み w のあるデータセット（build_dataset.py --dedup weight）は sample_weight として使う
+
+結果は構成ごとに検証 loss / mae の平均と標準偏差、fold の合計の所要時間（wall）、
+学習のスループット（samples/s）を並べ、--out に JSON（.csv なら CSV）で書き出す。
+
+使い方:
+ python sweep.py --train data/train --hidden 128,64 256,128 64 --batch-size 32 128 \\
+     --learning-rate 0.001 0.003 --folds 5 --epochs 10 --workers 4 --out sweep.json
+
+ # ワーカーごとの build / fit / evaluate の区間を Chrome のトレース形式で書き出す（profiling.py。
+ # ワーカーの pid ごとに 1 行になるので、ワーカーの空き時間や fold ごとのばらつきが見える）
+ python sweep.py --train data/train --hidden 128,64 256,128 --folds 5 --workers 4 --profile trace.json
+
+ # 1 位の構成で学習
+ python train_model.py --train data/train --out saved-model --hidden 256 128 --batch-size 128 --learning-rate 0.003
+
+"""
+import argparse
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import profiling
+from dataset_io import DatasetWriter, iter_batches, open_dataset
+
+
+def parse_hidden(text):
+    """'256,128' -> (256, 128)"""
+    try:
+        hidden = tuple(int(u) for u in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected comma-separated layer sizes, got {text!r}')
+    if not hidden or min(hidden) < 1:
+        raise argparse.ArgumentTypeError(f'layer sizes must be positive: {text!r}')
+    return hidden
+
+
+def fold_ranges(rows, folds):
+    """行 [0, rows) を連続した folds 個のブロックに分けた (start, stop) のリスト"""
+    bounds = np.linspace(0, rows, folds + 1).astype(np.int64)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def as_mmap_dataset(path, tmp_root, chunk_size=65536):
+    """
+    npy ディレクトリならそのまま、npz なら一時ディレクトリの npy に書き直してそのパスを返す
+    （ワーカーが mmap で共有できるように）
+    """
+    ds = open_dataset(path)
+    if ds.mmapped:
+        return Path(path)
+    out = Path(tempfile.mkdtemp(prefix='.sweep-', dir=tmp_root))
+    arrays = {name: np.asarray(ds[name]) for name in ('X', 'y', 'w') if name in ds}
+    writer = DatasetWriter(out, 'npy', arrays={k: (v.shape[1:], v.dtype) for k, v in arrays.items()},
+                           meta={k: v for k, v in ds.meta.items() if k not in ('format', 'quantization')})
+    for start in range(0, len(ds), chunk_size):
+        writer.write(**{k: v[start:start + chunk_size] for k, v in arrays.items()})
+    writer.close()
+    return out
+
+
+def init_worker(threads):
+    # TensorFlow を import する前にスレッド数を決める（ワーカーごとに threads 本）
+    os.environ['OMP_NUM_THREADS'] = str(threads)
+    os.environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def index_batches(index, batch_size, rng=None):
+    """行番号の配列を batch_size 個ずつに分ける（rng があれば毎回シャッフル、バッチ内は mmap を順に読むよう昇順）"""
+    if rng is not None:
+        index = rng.permutation(index)
+    return [np.sort(b) for b in iter_batches(index, batch_size)]
+
+
+def run_fold(task):
+    """
+    1 つの (構成, fold) を学習・評価する（ワーカー関数）。
+    戻り値は構成・fold・検証 loss/mae・所要時間・学習スループットの dict。
+    spans はワーカーで測った各段階の開始時刻（time.perf_counter。親プロセスがトレースに足す）
+    """
+    import train_model
+    from tensorflow import keras
+
+    config, fold, (val_start, val_stop), data_path, epochs, seed = task
+    ds = open_dataset(data_path)
+    X, y = ds.X, ds.y
+    w = ds['w'] if 'w' in ds else None
+    train_index = np.concatenate([np.arange(0, val_start), np.arange(val_stop, len(ds))])
+
+    class IndexSequence(keras.utils.Sequence):
+        def __init__(self, index, batch_size, shuffle):
+            super().__init__()
+            self.index = index
+            self.batch_size = batch_size
+            self.rng = np.random.default_rng(seed) if shuffle else None
+            self.batches = index_batches(index, batch_size, self.rng)
+
+        def __len__(self):
+            return len(self.batches)
+
+        def __getitem__(self, i):
+            rows = self.batches[i]
+            batch = (np.asarray(X[rows], dtype=np.float32), np.asarray(y[rows], dtype=np.float32))
+            return batch + (np.asarray(w[rows], dtype=np.float32),) if w is not None else batch
+
+        def on_epoch_end(self):
+            if self.rng is not None:
+                self.batches = index_batches(self.index, self.batch_size, self.rng)
+
+    keras.utils.set_random_seed(seed + fold)
+    t0 = time.perf_counter()
+    model = train_model.build_model(X.shape[1], y.shape[1], config['hidden'], config['learning_rate'])
+    train_seq = IndexSequence(train_index, config['batch_size'], shuffle=True)
+    t_fit = time.perf_counter()
+    model.fit(train_seq, epochs=epochs, verbose=0)
+    t_eval = time.perf_counter()
+    fit_time = t_eval - t_fit
+    val_loss, val_mae = model.evaluate(IndexSequence(np.arange(val_start, val_stop), 8192, shuffle=False),
+                                       verbose=0)
+    t_end = time.perf_counter()
+    return {
+        'config': config,
+        'fold': fold,
+        'val_loss': float(val_loss),
+        'val_mae': float(val_mae),
+        'wall': t_end - t0,
+        'samples_per_sec': epochs * len(train_index) / fit_time if fit_time else 0.0,
+        'pid': os.getpid(),
+        'spans': {'build': t0, 'fit': t_fit, 'evaluate': t_eval, 'end': t_end},
+    }
+
+
+def trace_fold(r):
+    """ワーカーの結果の spans を、ワーカーの pid を tid にしたイベントとしてトレースに足す"""
+    spans = r['spans']
+    args = {'hidden': r['config']['hidden'], 'batch_size': r['config']['batch_size'], 'fold': r['fold']}
+    profiling.complete('fold', spans['build'], spans['end'], tid=r['pid'], val_loss=r['val_loss'], **args)
+    for name, stop in (('build', 'fit'), ('fit', 'evaluate'), ('evaluate', 'end')):
+        profiling.complete(name, spans[name], spans[stop], tid=r['pid'], **args)
+    profiling.gauge('samples_per_sec', r['samples_per_sec'])
+
+
+def summarize(results):
+    """fold ごとの結果を構成ごとにまとめ、平均の検証 loss の小さい順に並べる"""
+    by_config = {}
+    for r in results:
+        by_config.setdefault(json.dumps(r['config'], sort_keys=True), []).append(r)
+    rows = []
+    for key, runs in by_config.items():
+        loss = np.array([r['val_loss'] for r in runs])
+        mae = np.array([r['val_mae'] for r in runs])
+        rows.append({
+            **json.loads(key),
+            'folds': len(runs),
+            'val_loss': float(loss.mean()), 'val_loss_std': float(loss.std()),
+            'val_mae': float(mae.mean()), 'val_mae_std': float(mae.std()),
+            'wall': float(sum(r['wall'] for r in runs)),
+            'samples_per_sec': float(np.mean([r['samples_per_sec'] for r in runs])),
+        })
+    rows.sort(key=lambda r: r['val_loss'])
+    for rank, row in enumerate(rows, 1):
+        row['rank'] = rank
+    return rows
+
+
+def print_table(rows):
+    print(f"{'rank':>4}  {'hidden':<14} {'batch':>6} {'lr':>8}  {'val_loss':>18}  {'val_mae':>18}  "
+          f"{'wall s':>8} {'samples/s':>10}")
+    for r in rows:
+        hidden = ','.join(str(u) for u in r['hidden'])
+        lr = 'default' if r['learning_rate'] is None else f"{r['learning_rate']:g}"
+        print(f"{r['rank']:>4}  {hidden:<14} {r['batch_size']:>6} {lr:>8}  "
+              f"{r['val_loss']:.5f} ± {r['val_loss_std']:.5f}  {r['val_mae']:.5f} ± {r['val_mae_std']:.5f}  "
+              f"{r['wall']:>8.1f} {r['samples_per_sec']:>10.0f}")
+
+
+def write_results(out, rows, results, meta):
+    out = Path(out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    if out.suffix == '.csv':
+        with open(out, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            cols = ['rank', 'hidden', 'batch_size', 'learning_rate', 'folds', 'val_loss', 'val_loss_std',
+                    'val_mae', 'val_mae_std', 'wall', 'samples_per_sec']
+            w.writerow(cols)
+            for r in rows:
+                w.writerow([' '.join(map(str, r[c])) if c == 'hidden' else r[c] for c in cols])
+        return out
+    out.write_text(json.dumps({**meta, 'ranking': rows, 'folds': results}, ensure_ascii=False, indent=2),
+                   encoding='utf-8')
+    return out
+
+
+def main():
+    cpus = os.cpu_count() or 1
+    p = argparse.ArgumentParser()
+    p.add_argument('--train', required=True, help='dataset built by build_dataset.py (npy directory shares best)')
+    p.add_argument('--hidden', type=parse_hidden, nargs='+', default=[(128, 64)], metavar='UNITS[,UNITS...]',
+                   help='hidden layer sizes to try, e.g. 128,64 256,128 64')
+    p.add_argument('--batch-size', type=int, nargs='+', default=[32])
+    p.add_argument('--learning-rate', type=float, nargs='+', default=[None],
+                   help='Adam learning rates to try (default: Adam default 0.001)')
+    p.add_argument('--folds', type=int, default=5, help='k for k-fold cross-validation over contiguous blocks')
+    p.add_argument('--epochs', type=int, default=10)
+    p.add_argument('--workers', type=int, default=max(1, cpus // 2), help='parallel training processes')
+    p.add_argument('--threads', type=int, help='TensorFlow threads per worker (default: CPUs / workers)')
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--out', help='write the ranking and per-fold results (JSON, or CSV for a .csv path)')
+    p.add_argument('--profile', metavar='TRACE_JSON',
+                   help='write per-worker fold timings and RSS as a Chrome trace (open in chrome://tracing)')
+    args = p.parse_args()
+    profiling.start(args.profile)
+
+    if args.folds < 2:
+        p.error('--folds must be at least 2')
+    threads = args.threads or max(1, cpus // args.workers)
+    configs = [{'hidden': list(h), 'batch_size': b, 'learning_rate': lr}
+               for h, b, lr in itertools.product(args.hidden, args.batch_size, args.learning_rate)]
+
+    tmp_root = Path(args.out).parent if args.out else Path(args.train).parent
+    with profiling.stage('prepare_data'):
+        data_path = as_mmap_dataset(args.train, tmp_root)
+    try:
+        ds = open_dataset(data_path)
+        if 'session' in ds:
+            print('warning: sequence dataset; sweeping over single frames')
+        rows = len(ds)
+        if rows < args.folds:
+            p.error(f'{args.train} has {rows} rows, fewer than --folds {args.folds}')
+        del ds
+        folds = fold_ranges(rows, args.folds)
+        tasks = [(config, k, folds[k], str(data_path), args.epochs, args.seed)
+                 for config in configs for k in range(args.folds)]
+        print(f'Sweeping {len(configs)} configurations x {args.folds} folds = {len(tasks)} runs on {rows} rows, '
+              f'{args.workers} workers x {threads} threads')
+
+        t0 = time.perf_counter()
+        results = []
+        # spawn: 親プロセスは TensorFlow を import しないが、ワーカーを確実にまっさらな状態で始める
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(args.workers, mp_context=ctx, initializer=init_worker,
+                                 initargs=(threads,)) as pool:
+            futures = [pool.submit(run_fold, t) for t in tasks]
+            for i, fut in enumerate(as_completed(futures), 1):
+                r = fut.result()
+                results.append(r)
+                trace_fold(r)
+                profiling.count('runs_done')
+                print(f"  [{i}/{len(tasks)}] hidden {r['config']['hidden']} batch {r['config']['batch_size']} "
+                      f"lr {r['config']['learning_rate']} fold {r['fold']}: val_loss {r['val_loss']:.5f} "
+                      f"({r['wall']:.1f}s, {r['samples_per_sec']:.0f} samples/s)")
+        elapsed = time.perf_counter() - t0
+    finally:
+        if data_path != Path(args.train):
+            shutil.rmtree(data_path, ignore_errors=True)
+
+    ranking = summarize(results)
+    print()
+    print_table(ranking)
+    print(f'Total {elapsed:.1f}s wall for {len(tasks)} runs '
+          f'({sum(r["wall"] for r in results) / elapsed if elapsed else 0:.1f}x parallel speedup)')
+    if args.out:
+        meta = {'train': str(args.train), 'rows': rows, 'epochs': args.epochs, 'folds_k': args.folds,
+                'workers': args.workers, 'threads': threads, 'seed': args.seed, 'elapsed': elapsed}
+        print('Wrote', write_results(args.out, ranking, results, meta))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# リポジトリ直下のスクリプト（build_dataset.py など）をモジュールとして import する
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,92 @@
+"""
+build_dataset.py のバッチ変換（kps_to_array / items_to_arrays）が、1 サンプルずつの参照実装
+kp_to_vector / normalize_xy と同じ値を返すことを確かめる。
+"""
+import numpy as np
+import pytest
+
+from build_dataset import (EXPECTED_KP, LABEL_KEYS, items_to_arrays, kp_to_vector, kps_to_array,
+                           normalize_xy)
+
+
+def kp(i, **fields):
+    base = {'x': 10.5 + i, 'y': 200.25 - i, 'score': 0.5 + i / 100}
+    base.update(fields)
+    return base
+
+
+def full(n=EXPECTED_KP):
+    return [kp(i) for i in range(n)]
+
+
+LABELS = {k: round(0.1 * i, 2) for i, k in enumerate(LABEL_KEYS)}
+
+# kp_to_vector が受け付ける keypoints の形
+KEYPOINT_CASES = {
+    'full': full(),
+    'short': full(5),
+    'long': full(20),
+    'missing_score': [kp(i) if i != 3 else {'x': 1.0, 'y': 2.0} for i in range(EXPECTED_KP)],
+    'missing_xy': [kp(i) if i % 4 else {'score': 0.9} for i in range(EXPECTED_KP)],
+    'string_coords': [kp(i, x=str(10.5 + i), y=f'{i}', score='0.75') for i in range(EXPECTED_KP)],
+    'int_coords': [kp(i, x=i, y=2 * i, score=1) for i in range(EXPECTED_KP)],
+    'extra_fields': [kp(i, name=f'kp{i}', z=-1.0) for i in range(EXPECTED_KP)],
+}
+
+
+def reference(items, width=None, height=None):
+    """build_dataset.py の従来の 1 サンプルずつの変換"""
+    X, Y, skipped = [], [], 0
+    for it in items:
+        kps, labels = it.get('keypoints'), it.get('labels')
+        if not kps or not labels:
+            skipped += 1
+            continue
+        X.append(normalize_xy(kp_to_vector(kps), width, height))
+        Y.append([labels.get(k, 0) for k in LABEL_KEYS])
+    return (np.array(X, dtype=np.float32).reshape(len(X), EXPECTED_KP * 3),
+            np.array(Y, dtype=np.float32).reshape(len(Y), len(LABEL_KEYS)), skipped)
+
+
+@pytest.mark.parametrize('case', KEYPOINT_CASES)
+def test_kps_to_array_matches_kp_to_vector(case):
+    kps = KEYPOINT_CASES[case]
+    expected = np.array(kp_to_vector(kps), dtype=np.float32).reshape(EXPECTED_KP, 3)
+    assert np.array_equal(kps_to_array([kps])[0], expected)
+    # ほかのサンプルと混ぜても（一括の速い経路から外れても）同じ
+    arr = kps_to_array([full(), kps, full()])
+    assert np.array_equal(arr[1], expected)
+    assert np.array_equal(arr[0], kps_to_array([full()])[0])
+
+
+@pytest.mark.parametrize('scale', [(None, None), (640, 480), (1920, 1080)])
+@pytest.mark.parametrize('case', KEYPOINT_CASES)
+def test_items_to_arrays_matches_reference(case, scale):
+    items = [{'keypoints': KEYPOINT_CASES[case], 'labels': LABELS}]
+    X, Y, skipped = items_to_arrays(items, *scale)
+    Xr, Yr, skipped_r = reference(items, *scale)
+    assert X.dtype == np.float32 and Y.dtype == np.float32
+    assert np.array_equal(X, Xr) and np.array_equal(Y, Yr) and skipped == skipped_r
+
+
+@pytest.mark.parametrize('scale', [(None, None), (640, 480)])
+def test_items_to_arrays_mixed_batch(scale):
+    rng = np.random.default_rng(0)
+    items = []
+    for i in range(200):
+        kps = [{'x': float(x), 'y': float(y), 'score': float(s)}
+               for x, y, s in rng.uniform(0, 640, (EXPECTED_KP, 3))]
+        items.append({'keypoints': kps, 'labels': {k: float(v) for k, v in zip(LABEL_KEYS, rng.uniform(0, 1, 8))}})
+    items += [{'keypoints': kps, 'labels': LABELS} for kps in KEYPOINT_CASES.values()]
+    # スキップされる行と、ラベルが欠けている行
+    items += [{'keypoints': [], 'labels': LABELS}, {'keypoints': full()}, {'labels': LABELS},
+              {'keypoints': full(), 'labels': {}}, {'keypoints': full(), 'labels': {'knee': 0.3}}]
+    X, Y, skipped = items_to_arrays(items, *scale)
+    Xr, Yr, skipped_r = reference(items, *scale)
+    assert skipped == skipped_r == 4
+    assert np.array_equal(X, Xr) and np.array_equal(Y, Yr)
+
+
+def test_items_to_arrays_empty():
+    X, Y, skipped = items_to_arrays([{'labels': LABELS}], 640, 480)
+    assert X.shape == (0, EXPECTED_KP * 3) and Y.shape == (0, len(LABEL_KEYS)) and skipped == 1
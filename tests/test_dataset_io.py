@@ -0,0 +1,121 @@
+"""
+dataset_io.py の量子化（--quantize float16 / uint16）の往復テスト。
+量子化なし（float32）で書いて読んだ値と比べ、誤差がモジュール冒頭に書いた上限（Quantizer.bound）に
+収まること、NaN・範囲外の値の扱い、open_dataset が float32 を返すことを確かめる。
+"""
+import numpy as np
+import pytest
+
+from dataset_io import FORMATS, QUANTIZE_MODES, open_dataset, save_arrays
+from pose_features import feature_spec
+
+LO, HI = -2.0, 2.0
+SCORE_COLS = np.arange(2, 51, 3)
+COORD_COLS = np.setdiff1d(np.arange(51), SCORE_COLS)
+META = {'feature_spec': feature_spec('hip')}
+
+
+def make_data(rows=300, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.empty((rows, 51), dtype=np.float32)
+    X[:, COORD_COLS] = rng.uniform(LO, HI, (rows, len(COORD_COLS)))
+    X[:, SCORE_COLS] = rng.uniform(0, 1, (rows, len(SCORE_COLS)))
+    y = rng.uniform(0, 1, (rows, 8)).astype(np.float32)
+    # 定数の列
+    X[:, 0] = 0.3
+    X[:, 5] = 0.25
+    y[:, 3] = 0.7
+    # 範囲の両端、0、float16 の非正規化数になる小さい値
+    X[0, COORD_COLS], X[1, COORD_COLS], X[2, COORD_COLS] = LO, HI, 0.0
+    X[3, COORD_COLS], X[4, COORD_COLS] = 1e-7, -3e-6
+    X[0, SCORE_COLS], X[1, SCORE_COLS] = 0.0, 1.0
+    y[0], y[1] = 0.0, 1.0
+    return X, y
+
+
+def round_trip(tmp_path, X, y, fmt, quantize):
+    out = tmp_path / ('ds.npz' if fmt == 'npz' else 'ds')
+    save_arrays(out, fmt, meta=META, quantize=quantize, X=X, y=y)
+    return open_dataset(out)
+
+
+def coord_limit(bound, v):
+    if 'coords' in bound:
+        return bound['coords']
+    return np.maximum(np.abs(v) * bound['coords_relative'], bound['coords_absolute'])
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('mode', QUANTIZE_MODES)
+def test_round_trip_within_documented_bound(tmp_path, fmt, mode):
+    X, y = make_data()
+    ref = round_trip(tmp_path / 'f32', X, y, fmt, None)
+    ds = round_trip(tmp_path / mode, X, y, fmt, mode)
+    assert ds.quantized and not ref.quantized
+
+    Xd, yd = ds.X[:], ds.y[:]
+    assert Xd.dtype == np.float32 and yd.dtype == np.float32
+    assert ds.X.dtype == np.float32 and ds.X.shape == X.shape and ds.y.shape == y.shape
+    X32, y32 = np.asarray(ref.X), np.asarray(ref.y)
+    assert np.array_equal(X32, X) and np.array_equal(y32, y)
+
+    q = ds.meta['quantization']
+    bound = q['bound']
+    err = np.abs(Xd - X32)
+    assert np.all(err[:, COORD_COLS] <= coord_limit(bound, X32[:, COORD_COLS]))
+    assert err[:, SCORE_COLS].max() <= bound['scores']
+    assert np.abs(yd - y32).max() <= bound['labels']
+    # 書き出し時の実測値も上限以内
+    for part in ('scores', 'labels'):
+        assert q['max_error'][part] <= bound[part]
+    if mode == 'uint16':
+        assert q['max_error']['coords'] <= bound['coords']
+    assert q['clipped'] == {'coords': 0, 'scores': 0, 'labels': 0}
+
+    # 範囲の両端はそのまま戻る
+    assert np.all(Xd[0, COORD_COLS] == LO) and np.all(Xd[1, COORD_COLS] == HI)
+    assert np.all(Xd[0, SCORE_COLS] == 0) and np.all(Xd[1, SCORE_COLS] == 1)
+    assert np.all(yd[0] == 0) and np.all(yd[1] == 1)
+    # 行番号の配列・1 行・列の指定でも同じ値
+    idx = np.array([5, 0, 299, 5])
+    assert np.array_equal(ds.X[idx], Xd[idx])
+    assert np.array_equal(ds.X[7], Xd[7])
+    assert np.array_equal(ds.X[10:20, 3], Xd[10:20, 3])
+
+
+@pytest.mark.parametrize('mode', QUANTIZE_MODES)
+def test_nan_and_out_of_range(tmp_path, mode):
+    X, y = make_data(rows=8)
+    X[0, COORD_COLS[0]] = np.nan
+    X[1, SCORE_COLS[0]] = np.nan
+    y[2, 0] = np.nan
+    X[3, COORD_COLS[1]] = 1e5
+    X[3, SCORE_COLS[1]] = 1.5
+    y[3, 1] = -0.5
+    ds = round_trip(tmp_path, X, y, 'npy', mode)
+    Xd, yd = ds.X[:], ds.y[:]
+    clipped = ds.meta['quantization']['clipped']
+
+    # スコアは両モードとも uint8（NaN は 0、範囲外は端に寄せる）
+    assert Xd[1, SCORE_COLS[0]] == 0 and Xd[3, SCORE_COLS[1]] == 1
+    assert clipped['scores'] == 2
+    if mode == 'float16':
+        assert np.isnan(Xd[0, COORD_COLS[0]]) and np.isnan(yd[2, 0])
+        # float16 の最大値 65504 を超えた値だけが inf になる
+        assert np.isposinf(Xd[3, COORD_COLS[1]])
+        assert clipped['coords'] == 1
+        assert abs(yd[3, 1] + 0.5) <= 2.0 ** -11 * 0.5
+        assert clipped['labels'] == 0
+    else:
+        assert Xd[0, COORD_COLS[0]] == LO and Xd[3, COORD_COLS[1]] == HI
+        assert yd[2, 0] == 0 and yd[3, 1] == 0
+        assert clipped == {'coords': 2, 'scores': 2, 'labels': 2}
+    # NaN・範囲外以外の値は上限以内のまま
+    bound = ds.meta['quantization']['bound']
+    err = np.abs(Xd - X)
+    scores = X[:, SCORE_COLS]
+    scores_ok = (scores >= 0) & (scores <= 1)
+    assert np.all(err[:, SCORE_COLS][scores_ok] <= bound['scores'])
+    coords_ok = np.isfinite(X[:, COORD_COLS]) & (np.abs(X[:, COORD_COLS]) <= HI)
+    assert np.all(err[:, COORD_COLS][coords_ok] <= np.broadcast_to(
+        coord_limit(bound, X[:, COORD_COLS]), coords_ok.shape)[coords_ok])
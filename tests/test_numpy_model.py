@@ -0,0 +1,69 @@
+"""
+numpy_model.py の fold_batchnorm が推論結果を変えないことを、畳み込む前の層を NumPy でそのまま
+計算した参照と比べて確かめる（Dense の後ろの BN・ReLU の後ろの BN・続けて並んだ BN・末尾の BN）。
+"""
+import numpy as np
+import pytest
+
+from numpy_model import fold_batchnorm, forward, load_numpy_model, save_numpy_model
+
+IN, HIDDEN, OUT = 6, 5, 3
+
+
+def dense(rng, n_in, n_out, activation):
+    return 'dense', {'W': rng.normal(0, 0.5, (n_in, n_out)).astype(np.float32),
+                     'b': rng.normal(0, 0.1, n_out).astype(np.float32), 'activation': activation}
+
+
+def bn(rng, n):
+    return 'bn', {'gamma': rng.uniform(0.5, 2, n).astype(np.float32), 'beta': rng.normal(0, 0.5, n).astype(np.float32),
+                  'mean': rng.normal(0, 1, n).astype(np.float32), 'var': rng.uniform(0.2, 3, n).astype(np.float32),
+                  'epsilon': 1e-3}
+
+
+def reference(layers, X):
+    """畳み込む前の層を float64 で 1 層ずつ計算する"""
+    h = np.asarray(X, dtype=np.float64)
+    for kind, p in layers:
+        if kind == 'dense':
+            h = h @ p['W'].astype(np.float64) + p['b']
+            h = {'linear': h, 'relu': np.maximum(h, 0), 'sigmoid': 1 / (1 + np.exp(-h))}[p['activation']]
+        else:
+            h = (h - p['mean']) / np.sqrt(p['var'].astype(np.float64) + p['epsilon']) * p['gamma'] + p['beta']
+    return h
+
+
+CASES = {
+    'linear_dense_bn': lambda r: [dense(r, IN, HIDDEN, 'linear'), bn(r, HIDDEN), dense(r, HIDDEN, OUT, 'sigmoid')],
+    'relu_bn_dense': lambda r: [dense(r, IN, HIDDEN, 'relu'), bn(r, HIDDEN), dense(r, HIDDEN, OUT, 'sigmoid')],
+    'consecutive_bn': lambda r: [dense(r, IN, HIDDEN, 'relu'), bn(r, HIDDEN), bn(r, HIDDEN), bn(r, HIDDEN),
+                                 dense(r, HIDDEN, OUT, 'linear')],
+    'linear_dense_consecutive_bn': lambda r: [dense(r, IN, HIDDEN, 'linear'), bn(r, HIDDEN), bn(r, HIDDEN),
+                                              dense(r, HIDDEN, OUT, 'relu')],
+    'leading_bn': lambda r: [bn(r, IN), bn(r, IN), dense(r, IN, OUT, 'linear')],
+    'trailing_bn': lambda r: [dense(r, IN, HIDDEN, 'relu'), bn(r, HIDDEN), dense(r, HIDDEN, OUT, 'relu'), bn(r, OUT)],
+    'trailing_consecutive_bn': lambda r: [dense(r, IN, OUT, 'sigmoid'), bn(r, OUT), bn(r, OUT)],
+    # train_model.build_model の並び
+    'build_model': lambda r: [dense(r, IN, HIDDEN, 'relu'), bn(r, HIDDEN), dense(r, HIDDEN, HIDDEN, 'relu'),
+                              dense(r, HIDDEN, OUT, 'sigmoid')],
+}
+
+
+@pytest.mark.parametrize('case', CASES)
+def test_fold_batchnorm_matches_unfolded_reference(case, tmp_path):
+    rng = np.random.default_rng(0)
+    layers = CASES[case](rng)
+    X = rng.normal(0, 2, (200, IN)).astype(np.float32)
+    expected = reference(layers, X)
+    folded = fold_batchnorm(layers)
+    np.testing.assert_allclose(forward(folded, X), expected, rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(forward(layers, X), expected, rtol=1e-4, atol=1e-5)
+    # 後ろに Dense がある BN はすべて畳み込まれ、末尾の BN は 1 つにまとまる
+    kinds = [kind for kind, _ in folded]
+    assert kinds.count('bn') == (1 if layers[-1][0] == 'bn' else 0)
+    assert kinds.count('dense') == sum(kind == 'dense' for kind, _ in layers)
+    # 元の層は書き換えない
+    np.testing.assert_array_equal(forward(layers, X), forward(CASES[case](np.random.default_rng(0)), X))
+    # model.npz に書いて読んでも同じ
+    model = load_numpy_model(save_numpy_model(tmp_path, folded))
+    np.testing.assert_allclose(model.predict(X), expected, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,150 @@
+"""
+build_dataset.py --decoder schema（SchemaDecoder）が、標準の json で読む経路
+（load_json_items + items_to_arrays）と完全に同じ配列を返すことを確かめる。
+速い経路に乗らない行（キーの順番・余分なフィールド・17 点以外・ラベルの過不足・null など）が
+1 行ずつの json に回っても、チャンクの区切り方によらず結果が変わらないことも見る。
+"""
+import json
+
+import numpy as np
+import pytest
+
+from build_dataset import (EXPECTED_KP, LABEL_KEYS, SchemaDecoder, items_to_arrays, items_to_keypoints,
+                           iter_json_lines, keypoints_to_arrays, load_json_items, load_keypoints)
+
+
+def keypoints(n=EXPECTED_KP, seed=0):
+    rng = np.random.default_rng(seed)
+    return [{'x': round(float(x), 2), 'y': round(float(y), 2), 'score': round(float(s), 4)}
+            for x, y, s in zip(rng.uniform(0, 640, n), rng.uniform(0, 480, n), rng.uniform(0, 1, n))]
+
+
+def labels(seed=0):
+    rng = np.random.default_rng(seed + 1000)
+    return {k: round(float(v), 4) for k, v in zip(LABEL_KEYS, rng.uniform(0, 1, len(LABEL_KEYS)))}
+
+
+def edge_lines():
+    """速い経路に乗る行と乗らない行を混ぜた JSONL の行（str）"""
+    lines = [json.dumps({'keypoints': keypoints(seed=i), 'labels': labels(i)}) for i in range(10)]
+    kps, lb = keypoints(seed=99), labels(99)
+    lines += [
+        # 最上位のキーの順番が逆・区切りの空白なし
+        json.dumps({'labels': lb, 'keypoints': kps}, separators=(',', ':')),
+        # keypoint の中のキーの順番が違う
+        json.dumps({'keypoints': [{'score': k['score'], 'y': k['y'], 'x': k['x']} for k in kps], 'labels': lb}),
+        # 余分なフィールド（最上位と keypoint の中）
+        json.dumps({'id': 7, 'timestamp': 1712345678.5, 'keypoints': kps, 'labels': lb, 'meta': {'cam': 2}}),
+        json.dumps({'keypoints': [dict(k, name=f'kp{i}') for i, k in enumerate(kps)], 'labels': lb}),
+        # 17 点以外
+        json.dumps({'keypoints': keypoints(5, seed=3), 'labels': lb}),
+        json.dumps({'keypoints': keypoints(1, seed=4), 'labels': lb}),
+        json.dumps({'keypoints': keypoints(20, seed=5), 'labels': lb}),
+        # ラベルの欠け・余分・順番違い・null
+        json.dumps({'keypoints': kps, 'labels': {'knee': 0.4, 'balance': 0.9}}),
+        json.dumps({'keypoints': kps, 'labels': dict(lb, speed=0.5)}),
+        json.dumps({'keypoints': kps, 'labels': dict(reversed(list(lb.items())))}),
+        json.dumps({'keypoints': kps, 'labels': dict(lb, knee=None)}),
+        # null・NaN・欠けた score、x / y の欠け
+        json.dumps({'keypoints': [dict(k, score=None) if i == 2 else k for i, k in enumerate(kps)], 'labels': lb}),
+        json.dumps({'keypoints': [dict(k, score=float('nan')) if i == 4 else k for i, k in enumerate(kps)],
+                    'labels': lb}),
+        json.dumps({'keypoints': [{'x': k['x'], 'y': k['y']} if i == 6 else k for i, k in enumerate(kps)],
+                    'labels': lb}),
+        json.dumps({'keypoints': [{'score': k['score']} if i == 8 else k for i, k in enumerate(kps)], 'labels': lb}),
+        # 空の配列・オブジェクト、キーそのものがない
+        json.dumps({'keypoints': [], 'labels': lb}),
+        json.dumps({'keypoints': kps, 'labels': {}}),
+        json.dumps({'keypoints': [], 'labels': {}}),
+        json.dumps({'labels': lb}),
+        json.dumps({'keypoints': kps}),
+        # 文字列の中に "keypoints" / "labels" がある
+        json.dumps({'note': 'keypoints: [1, 2, 3]', 'keypoints': kps, 'labels': lb}),
+        json.dumps({'note': '"keypoints": [{"x": 1}]', 'keypoints': kps, 'labels': lb}),
+        json.dumps({'keypoints': kps, 'labels': lb, 'comment': '"labels": {"knee": 1}'}),
+        # 指数表記・負の数・整数・-0
+        json.dumps({'keypoints': [{'x': -1.5e-3, 'y': 2E+2, 'score': 1}] + kps[1:], 'labels': dict(lb, knee=0)}),
+        json.dumps({'keypoints': [{'x': -0.0, 'y': 12, 'score': 0}] + kps[1:], 'labels': lb}),
+        # 空白の多い書き方
+        json.dumps({'keypoints': kps, 'labels': lb}, indent=None, separators=(' ,  ', ' :  ')),
+    ]
+    lines += nested_lines(kps, lb)
+    lines += [json.dumps({'keypoints': keypoints(seed=i), 'labels': labels(i)}) for i in range(10, 20)]
+    return lines
+
+
+def nested_lines(kps, lb):
+    """入れ子のオブジェクトの中に keypoints / labels がある行（最上位のキーだけがサンプルになる）"""
+    return [
+        # 入れ子の中にしかない（json ではスキップ）
+        json.dumps({'meta': {'keypoints': kps, 'labels': lb}}),
+        json.dumps({'extra': {'keypoints': kps}, 'labels': lb}),
+        json.dumps({'keypoints': kps, 'meta': {'labels': lb}}),
+        json.dumps({'rows': [{'keypoints': kps, 'labels': lb}]}),
+        # 最上位のキーの前に入れ子のオブジェクト・配列・括弧を含む文字列がある（読める）
+        json.dumps({'meta': {'cam': {'id': 2}, 'tags': [1, [2]]}, 'keypoints': kps, 'labels': lb}),
+        json.dumps({'note': '{[ "x', 'keypoints': kps, 'more': '}}', 'labels': lb}),
+    ]
+
+
+@pytest.fixture
+def export(tmp_path):
+    path = tmp_path / 'export.jsonl'
+    # 空行と前後の空白も混ぜる
+    path.write_text('\n'.join(edge_lines()[:5]) + '\n\n  ' + '\n'.join(edge_lines()[5:]) + '  \n', encoding='utf-8')
+    return path
+
+
+def reference(path, width=None, height=None):
+    return items_to_arrays(load_json_items(path), width, height)
+
+
+def assert_same(got, expected):
+    for a, b in zip(got, expected):
+        assert a.dtype == b.dtype and a.shape == b.shape
+        assert np.array_equal(a, b, equal_nan=True)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 7, 65536])
+def test_decode_matches_json(export, chunk_size):
+    ref_kps, ref_Y, ref_skipped = items_to_keypoints(load_json_items(export))
+    lines = list(iter_json_lines(export))
+    decoder = SchemaDecoder()
+    parts = [decoder.decode(lines[i:i + chunk_size]) for i in range(0, len(lines), chunk_size)]
+    kps = np.concatenate([p[0] for p in parts])
+    Y = np.concatenate([p[1] for p in parts])
+    assert sum(p[2] for p in parts) == ref_skipped == 9
+    assert_same((kps, Y), (ref_kps, ref_Y))
+    # 速い経路と 1 行ずつの経路の両方を通っている
+    assert decoder.counts['fast'] >= 20 and decoder.counts['fallback'] >= 15
+
+
+@pytest.mark.parametrize('scale', [(None, None), (640, 480)])
+def test_load_keypoints_matches_items_to_arrays(export, scale):
+    X_ref, Y_ref, skipped_ref = reference(export, *scale)
+    kps, Y, rows, skipped = load_keypoints(export, 'schema')
+    X, Y = keypoints_to_arrays(kps, Y, *scale)
+    assert rows == len(load_json_items(export)) and skipped == skipped_ref
+    assert_same((X, Y), (X_ref, Y_ref))
+
+
+def test_all_fast_path_rows(tmp_path):
+    path = tmp_path / 'fast.jsonl'
+    path.write_text('\n'.join(json.dumps({'keypoints': keypoints(seed=i), 'labels': labels(i)})
+                              for i in range(50)), encoding='utf-8')
+    decoder = SchemaDecoder()
+    kps, Y, skipped = decoder.decode(list(iter_json_lines(path)))
+    assert decoder.counts == {'fast': 50, 'fallback': 0} and skipped == 0
+    assert_same((kps, Y), items_to_keypoints(load_json_items(path))[:2])
+
+
+def test_nested_keys_use_fallback(tmp_path):
+    kps, lb = keypoints(seed=7), labels(7)
+    path = tmp_path / 'nested.jsonl'
+    path.write_text('\n'.join(nested_lines(kps, lb)), encoding='utf-8')
+    decoder = SchemaDecoder()
+    got_kps, got_Y, skipped = decoder.decode(list(iter_json_lines(path)))
+    ref_kps, ref_Y, ref_skipped = items_to_keypoints(load_json_items(path))
+    assert skipped == ref_skipped == 4 and len(got_kps) == 2
+    assert_same((got_kps, got_Y), (ref_kps, ref_Y))
+    assert decoder.counts == {'fast': 2, 'fallback': 4}
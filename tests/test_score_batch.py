@@ -0,0 +1,23 @@
+"""
+score_batch.py の resolve_features（モデルの feature_spec.json とコマンドライン指定の組み合わせ）を確かめる。
+"""
+import pytest
+
+from pose_features import feature_spec, write_feature_spec
+from score_batch import resolve_features
+
+
+def test_defaults_come_from_feature_spec(tmp_path):
+    write_feature_spec(tmp_path, feature_spec('hip', 640, 480))
+    assert resolve_features(tmp_path) == ('hip', 640, 480)
+    assert resolve_features(tmp_path / 'model.npz', width=1920) == ('hip', 1920, 480)
+
+
+def test_without_feature_spec_is_raw(tmp_path):
+    assert resolve_features(tmp_path) == ('raw', None, None)
+
+
+def test_window_model_is_rejected(tmp_path):
+    write_feature_spec(tmp_path, {**feature_spec('raw'), 'window': 30})
+    with pytest.raises(ValueError, match='window models'):
+        resolve_features(tmp_path / 'model.npz')
@@ -0,0 +1,208 @@
+"""
+scoring_server.py の WebSocket のフレーム処理（分割されたメッセージ・間に挟まった ping・
+途中で始まる継続フレーム・大きすぎるメッセージ）、Origin の確認、MicroBatcher の締め切りを確かめる。
+サーバは同じプロセスの空いているポートで立て、predict はゼロを返すだけの関数を使う。
+"""
+import asyncio
+import base64
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from scoring_server import (LABELS, MAX_BODY, WS_BINARY, WS_CLOSE, WS_PING, WS_PONG, WS_TEXT, MicroBatcher,
+                            ScoringServer, WebSocketReader, read_http_message, ws_accept_key, ws_frame)
+
+ALLOWED, EVIL = 'http://localhost:8000', 'http://evil.example'
+FRAME = json.dumps({'id': 7, 'keypoints': [{'x': 10.0 + i, 'y': 20.0, 'score': 0.9} for i in range(17)]}).encode()
+CONTINUATION = 0x0
+
+
+def zeros(X):
+    return np.zeros((len(X), 8), dtype=np.float32)
+
+
+def run_server(client, predict=zeros):
+    """サーバを立てて client(port) を実行し、その戻り値を返す"""
+    async def main():
+        server = ScoringServer(predict, width=640, height=480, allow_origins=[ALLOWED])
+        listener = await server.start('127.0.0.1', 0)
+        try:
+            return await asyncio.wait_for(client(listener.sockets[0].getsockname()[1]), 10)
+        finally:
+            listener.close()
+            server.close()
+    return asyncio.run(main())
+
+
+def client_frame(opcode, payload, fin=True):
+    # クライアントのフレームは mask 付き。fin=False なら FIN ビットを落として分割の途中にする
+    frame = ws_frame(opcode, payload, mask=True)
+    return frame if fin else bytes([frame[0] & 0x7F]) + frame[1:]
+
+
+async def ws_connect(port, origin=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    head = (f'GET /ws HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+            f'Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n')
+    if origin:
+        head += f'Origin: {origin}\r\n'
+    writer.write((head + '\r\n').encode('latin-1'))
+    await writer.drain()
+    (_, status, _), headers, _ = await read_http_message(reader)
+    if status == '101':
+        assert headers['sec-websocket-accept'] == ws_accept_key(key)
+    return reader, writer, status
+
+
+async def send(writer, *frames):
+    writer.write(b''.join(frames))
+    await writer.drain()
+
+
+def close_code(opcode, payload):
+    assert opcode == WS_CLOSE
+    return struct.unpack('!H', payload[:2])[0]
+
+
+def test_fragmented_message_with_interleaved_ping():
+    async def client(port):
+        reader, writer, status = await ws_connect(port)
+        assert status == '101'
+        ws = WebSocketReader(reader)
+        # テキストメッセージを 3 つに分け、間に ping を 2 つ挟む
+        a, b = len(FRAME) // 3, 2 * len(FRAME) // 3
+        await send(writer, client_frame(WS_TEXT, FRAME[:a], fin=False), client_frame(WS_PING, b'one'),
+                   client_frame(CONTINUATION, FRAME[a:b], fin=False), client_frame(WS_PING, b'two'),
+                   client_frame(CONTINUATION, FRAME[b:]))
+        replies = [await ws.read() for _ in range(3)]
+        # 分割なしのバイナリメッセージも続けて読める（分割の状態が残っていない）
+        await send(writer, client_frame(WS_BINARY, FRAME))
+        replies.append(await ws.read())
+        await send(writer, client_frame(WS_CLOSE, struct.pack('!H', 1000)))
+        replies.append(await ws.read())
+        writer.close()
+        return replies
+
+    replies = run_server(client)
+    assert replies[:2] == [(WS_PONG, b'one'), (WS_PONG, b'two')]
+    for opcode, payload in replies[2:4]:
+        assert opcode == WS_TEXT and json.loads(payload) == {'id': 7, 'scores': dict.fromkeys(LABELS, 0.0)}
+    assert close_code(*replies[4]) == 1000
+
+
+def test_continuation_without_message_closes_1002():
+    async def client(port):
+        reader, writer, _ = await ws_connect(port)
+        await send(writer, client_frame(CONTINUATION, b'{"id": 1}'))
+        return await WebSocketReader(reader).read()
+
+    assert close_code(*run_server(client)) == 1002
+
+
+def test_new_data_frame_inside_fragmented_message_closes_1002():
+    async def client(port):
+        reader, writer, _ = await ws_connect(port)
+        await send(writer, client_frame(WS_TEXT, FRAME[:10], fin=False), client_frame(WS_TEXT, FRAME))
+        return await WebSocketReader(reader).read()
+
+    assert close_code(*run_server(client)) == 1002
+
+
+def test_oversized_message_closes_1009():
+    async def client(port):
+        reader, writer, _ = await ws_connect(port)
+        # 2 つの断片の合計が MAX_BODY を超える（2 つ目は頭だけ送れば閉じられる）
+        half = MAX_BODY // 2 + 1
+        await send(writer, client_frame(WS_TEXT, b' ' * half, fin=False),
+                   bytes([0x80 | CONTINUATION, 0x80 | 127]) + struct.pack('!Q', half) + os.urandom(4))
+        return await WebSocketReader(reader).read()
+
+    assert close_code(*run_server(client)) == 1009
+
+
+def test_control_frames_do_not_count_towards_size():
+    async def client(port):
+        reader, writer, _ = await ws_connect(port)
+        ws = WebSocketReader(reader)
+        body = b' ' * (MAX_BODY - len(FRAME)) + FRAME
+        half = MAX_BODY // 2
+        await send(writer, client_frame(WS_TEXT, body[:half], fin=False), client_frame(WS_PING, b'x' * 125),
+                   client_frame(CONTINUATION, body[half:]))
+        return [await ws.read() for _ in range(2)]
+
+    (pong, ping_payload), (opcode, payload) = run_server(client)
+    assert pong == WS_PONG and ping_payload == b'x' * 125
+    assert opcode == WS_TEXT and json.loads(payload)['id'] == 7
+
+
+async def http_request(port, method, path, body=b'', origin=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    head = f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {len(body)}\r\nConnection: close\r\n'
+    if origin:
+        head += f'Origin: {origin}\r\n'
+    writer.write((head + '\r\n').encode('latin-1') + body)
+    await writer.drain()
+    (_, status, _), headers, payload = await read_http_message(reader)
+    writer.close()
+    return status, headers, json.loads(payload) if payload else None
+
+
+def test_origin_checks():
+    async def client(port):
+        out = [await http_request(port, 'POST', '/predict', FRAME, origin) for origin in (None, ALLOWED, EVIL)]
+        out.append(await http_request(port, 'OPTIONS', '/predict', origin=ALLOWED))
+        return out + [(await ws_connect(port, origin))[2] for origin in (ALLOWED, EVIL)]
+
+    plain, allowed, rejected, preflight, ws_allowed, ws_rejected = run_server(client)
+    assert plain[0] == '200' and 'access-control-allow-origin' not in plain[1]
+    assert allowed[0] == '200' and allowed[1]['access-control-allow-origin'] == ALLOWED
+    assert rejected[0] == '403' and 'access-control-allow-origin' not in rejected[1]
+    assert preflight[0] == '204' and preflight[1]['access-control-allow-origin'] == ALLOWED
+    assert (ws_allowed, ws_rejected) == ('101', '403')
+
+
+def test_oversized_http_body_is_rejected():
+    async def client(port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(f'POST /predict HTTP/1.1\r\nHost: 127.0.0.1\r\nContent-Length: {MAX_BODY + 1}\r\n\r\n'.encode())
+        await writer.drain()
+        (_, status, _), headers, _ = await read_http_message(reader)
+        writer.close()
+        return status, headers
+
+    status, headers = run_server(client)
+    assert status == '413' and headers['connection'] == 'close'
+
+
+def test_batcher_deadline_and_max_batch_size():
+    sizes = []
+
+    def predict(X):
+        sizes.append(len(X))
+        return zeros(X)
+
+    async def main():
+        batcher = MicroBatcher(predict, max_batch_size=4, max_delay=0.2)
+        runner = asyncio.create_task(batcher.run())
+        try:
+            # 2 行だけなら締め切り（max_delay）まで待ってから 1 回の predict
+            t0 = time.monotonic()
+            await asyncio.gather(*(batcher.submit(np.zeros(51)) for _ in range(2)))
+            partial = time.monotonic() - t0
+            # max_batch_size 行そろえば締め切りを待たない。あふれた 1 行は次のバッチ
+            t0 = time.monotonic()
+            await asyncio.gather(*(batcher.submit(np.zeros(51)) for _ in range(4)))
+            full = time.monotonic() - t0
+            await batcher.submit(np.zeros(51))
+        finally:
+            runner.cancel()
+            batcher.close()
+        return partial, full, batcher.metrics.batches
+
+    partial, full, batches = asyncio.run(main())
+    assert sizes == [2, 4, 1] and batches == 3
+    assert partial >= 0.19 and full < 0.15
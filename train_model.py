@@ -3,66 +3,931 @@ train_model.py
 
 シンプルな Keras モデルを学習して TF SavedModel と TFJS 変換を行うスクリプト。
 出力:
- - saved-model/ (SavedModel)
+ - saved-model/ (model.export の SavedModel。TFJS 変換と score_batch.py --engine tf が読む)
+ - saved-model/model.keras (Keras 3 形式。export サブコマンドが読む)
  - tfjs_model/ (tfjs converted model.json + weights)
+ - どちらにも学習データの meta にある特徴の定義を feature_spec.json として置く（pose_features.py、analysis.js が確認する）
+ - saved-model/model.npz (BN を畳み込んだ重み。numpy_model.py / score_batch.py --engine numpy 用)
+ - checkpoint/ と manifest.json（重みと optimizer の状態、学習に使ったデータセットの内容ハッシュ。--resume 用）
 
 使い方例:
  python train_model.py --train data/train.npz --out saved-model --epochs 50
 
+ # build_dataset.py --format npy で作ったディレクトリは memmap のままバッチ単位で読み込む
+ # （--quantize で作ったデータセットもバッチごとに float32 に戻して読む）
+ python train_model.py --train data/train --out saved-model
+
+ # build_dataset.py --sequence で作ったデータセットを 30 フレームの窓（stride 5）で学習
+ python train_model.py --train data/seq --window 30 --stride 5 --out saved-model
+
+ # build_dataset.py --dedup weight で作ったデータセットは重み w を sample_weight として使う
+ # （--pipeline では w のないデータセットの行は重み 1）
+
+ # tf.data パイプライン（複数シャードをブロック単位で並列読み込み、検証は別シャード）
+ python train_model.py --pipeline --train data/day1 data/day2 --val data/holdout --out saved-model
+
+ # 新しく届いたシャードだけで追加学習（--out の checkpoint から重みと optimizer の状態を戻し、
+ # 学習済みデータセットから新データの 25% 分を replay サンプルとして混ぜる）。
+ # manifest.json にあるデータセットは学習済みとして飛ばすので、同じコマンドを再実行しても何もしない
+ python train_model.py --resume --train data/day1 data/day2 data/day3 --out out --epochs 5
+
+ # CPU の学習ノード向けの性能モード（スレッド数の設定、精度を落とさない最大のバッチサイズを短い試し学習で選ぶ、
+ # 前後の samples/s を表示）。--jit-compile で XLA も使う
+ python train_model.py --train data/train --out saved-model --perf --jit-compile
+
+ # 読み込み・試し学習・学習（エポックごとの samples/s）・保存・TFJS 変換の時間とメモリを
+ # Chrome のトレース形式で書き出す（profiling.py。export サブコマンドでも使える）
+ python train_model.py --train data/train --out saved-model --profile trace.json
+
+ # sweep.py で選んだ構成で学習
+ python train_model.py --train data/train --out saved-model --hidden 256 128 --learning-rate 0.003 --batch-size 128
+
+ # ブラウザ配布用の軽量 TFJS モデルを書き出す（BN の畳み込み・枝刈り・重み量子化、サイズと精度のレポート付き）
+ # ネットワークは使わない（tensorflowjs_converter はローカルのものを呼ぶ）。
+ # 同じ重み（float32）を TensorFlow なしで推論できる model.npz（numpy_model.py）も書き出す
+ python train_model.py export --model saved-model/saved-model/model.keras --out export --quantize uint8 --prune 0.5 --val data/holdout
+
 """
 import argparse
+import gzip
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
 import numpy as np
+from datetime import datetime, timezone
 from pathlib import Path
 import tensorflow as tf
 from tensorflow import keras
 
+import profiling
+from build_cache import dataset_digest
+from dataset_io import open_dataset, read_meta
+from numpy_model import ACTIVATIONS, fold_batchnorm, forward, load_numpy_model, save_numpy_model
+from pose_features import read_feature_spec, write_feature_spec
+
 LABELS = ["balance","knee","spine","stance","shootForm","defense","dribble","stability"]
 
-def build_model(input_dim, output_dim):
-    model = keras.Sequential([
-        keras.layers.Input(shape=(input_dim,)),
-        keras.layers.Dense(128, activation='relu'),
-        keras.layers.BatchNormalization(),
-        keras.layers.Dense(64, activation='relu'),
-        keras.layers.Dense(output_dim, activation='sigmoid')
-    ])
-    model.compile(optimizer='adam', loss='mse', metrics=['mae'])
+DEFAULT_HIDDEN = (128, 64)
+# saved-model/ の中の Keras 3 形式のモデル（export サブコマンドが読む）
+KERAS_MODEL = 'model.keras'
+
+
+def build_model(input_dim, output_dim, hidden=DEFAULT_HIDDEN, learning_rate=None, jit_compile=None):
+    """
+    Dense(hidden[0]) -> BN -> Dense(hidden[1]) -> ... -> Dense(output_dim, sigmoid)。
+    既定値は従来の 128/64 のモデル。learning_rate を省くと Adam の既定値（0.001）、
+    jit_compile を省くと Keras の既定のまま
+    """
+    layers = [keras.layers.Input(shape=(input_dim,)),
+              keras.layers.Dense(hidden[0], activation='relu'),
+              keras.layers.BatchNormalization()]
+    layers += [keras.layers.Dense(units, activation='relu') for units in hidden[1:]]
+    layers.append(keras.layers.Dense(output_dim, activation='sigmoid'))
+    model = keras.Sequential(layers)
+    optimizer = 'adam' if learning_rate is None else keras.optimizers.Adam(learning_rate)
+    compile_options = {} if jit_compile is None else {'jit_compile': jit_compile}
+    model.compile(optimizer=optimizer, loss='mse', metrics=['mae'], **compile_options)
+    return model
+
+
+class MemmapSequence(keras.utils.Sequence):
+    """
+    memmap 配列の [start, stop) から batch_size 行ずつ読み出す Sequence。
+    触ったバッチ分だけがページインされるので、常駐メモリはデータセットの大きさに依存しない。
+    w（行ごとの重み）を渡すと (X, y, w) を返す。
+    """
+
+    def __init__(self, X, y, batch_size, start=0, stop=None, shuffle=False, seed=None, w=None):
+        super().__init__()
+        self.X = X
+        self.y = y
+        self.w = w
+        self.batch_size = batch_size
+        self.start = start
+        self.stop = len(X) if stop is None else stop
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.order = np.arange(len(self))
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil((self.stop - self.start) / self.batch_size)
+
+    def __getitem__(self, i):
+        s = self.start + int(self.order[i]) * self.batch_size
+        e = min(s + self.batch_size, self.stop)
+        if self.w is not None:
+            return np.asarray(self.X[s:e]), np.asarray(self.y[s:e]), np.asarray(self.w[s:e])
+        return np.asarray(self.X[s:e]), np.asarray(self.y[s:e])
+
+    def on_epoch_end(self):
+        # バッチ内は連続読み出しのまま、バッチの順番だけをシャッフルする
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+
+class WindowSequence(keras.utils.Sequence):
+    """
+    WindowView の窓を batch_size 個ずつ (batch, window * D) に平坦化して返す Sequence。
+    窓はビューなので、コピーされるのは取り出したバッチ分だけ。
+    """
+
+    def __init__(self, view, batch_size, start=0, stop=None, shuffle=False, seed=None):
+        super().__init__()
+        self.view = view
+        self.batch_size = batch_size
+        self.index = np.arange(start, len(view) if stop is None else stop)
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return math.ceil(len(self.index) / self.batch_size)
+
+    def __getitem__(self, i):
+        # バッチ内の窓は開始行順に読む（memmap のページを順に触るように）
+        idx = np.sort(self.index[i * self.batch_size:(i + 1) * self.batch_size])
+        X, y = self.view.batch(idx)
+        return X.reshape(len(idx), -1).astype(np.float32), y.astype(np.float32)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.index)
+
+
+def make_pipeline(paths, batch_size=32, shuffle=True, shuffle_buffer=10000, block_size=4096, seed=None,
+                  rows=None):
+    """
+    データセット（npy ディレクトリ / npz）の一覧から tf.data.Dataset を作る。
+    ブロック（block_size 行）単位で memmap から並列に読み出し、行単位でシャッフルしてバッチ化する。
+    rows を渡すと、None でないデータセットはその行番号（昇順）だけを読む（--resume の replay サンプル）。
+    どれかのデータセットに重み w があれば (X, y, w) の要素にする（w のないデータセットは 1）。
+    戻り値は (dataset, 行数)
+    """
+    sources = [open_dataset(p) for p in paths]
+    picks = list(rows) if rows is not None else [None] * len(sources)
+    sizes = [len(ds) if idx is None else len(idx) for ds, idx in zip(sources, picks)]
+    x_dim = sources[0].X.shape[1]
+    y_dim = sources[0].y.shape[1]
+    for ds in sources:
+        if ds.X.shape[1] != x_dim or ds.y.shape[1] != y_dim:
+            raise ValueError(f'{ds.path}: shape mismatch with {sources[0].path}')
+    blocks = [(i, start) for i, n in enumerate(sizes) for start in range(0, n, block_size)]
+    total = sum(sizes)
+    weighted = any('w' in ds for ds in sources)
+    if not blocks:
+        raise ValueError('no rows in ' + ', '.join(str(p) for p in paths))
+
+    def read_block(i, start):
+        ds = sources[int(i)]
+        stop = min(int(start) + block_size, sizes[int(i)])
+        sel = slice(start, stop) if picks[int(i)] is None else picks[int(i)][start:stop]
+        block = (np.asarray(ds.X[sel], dtype=np.float32),
+                 np.asarray(ds.y[sel], dtype=np.float32))
+        if weighted:
+            w = ds['w'][sel] if 'w' in ds else np.ones(stop - int(start))
+            block += (np.asarray(w, dtype=np.float32),)
+        return block
+
+    def load(i, start):
+        out = tf.numpy_function(read_block, [i, start], (tf.float32,) * (3 if weighted else 2))
+        out[0].set_shape([None, x_dim])
+        out[1].set_shape([None, y_dim])
+        if weighted:
+            out[2].set_shape([None])
+        return tuple(out)
+
+    index = np.array(blocks, dtype=np.int64)
+    d = tf.data.Dataset.from_tensor_slices((index[:, 0], index[:, 1]))
+    if shuffle:
+        d = d.shuffle(len(blocks), seed=seed, reshuffle_each_iteration=True)
+    d = d.map(load, num_parallel_calls=tf.data.AUTOTUNE, deterministic=not shuffle)
+    d = d.unbatch()
+    if shuffle:
+        d = d.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    d = d.batch(batch_size)
+    # unbatch で失われた件数を戻しておく（エポックの終わりを Keras が判定できるように）
+    d = d.apply(tf.data.experimental.assert_cardinality(math.ceil(total / batch_size)))
+    d = d.prefetch(tf.data.AUTOTUNE)
+    return d, total
+
+
+def dataset_feature_spec(paths):
+    """データセットの meta から特徴の定義を取り出す（データセット間で食い違えばエラー）"""
+    specs = {}
+    for path in paths:
+        spec = read_meta(path).get('feature_spec')
+        if spec is not None:
+            specs.setdefault(json.dumps(spec, sort_keys=True), []).append(str(path))
+    if len(specs) > 1:
+        detail = '; '.join(f"{json.loads(k)['features']} {json.loads(k)['scale']}: {', '.join(v)}"
+                           for k, v in specs.items())
+        raise ValueError(f'datasets were built with different feature specs: {detail}')
+    return json.loads(next(iter(specs))) if specs else None
+
+
+# ---- 性能モード: スレッド数・XLA・バッチサイズ ----
+
+def configure_threads(intra_op=None, inter_op=None):
+    """TensorFlow のスレッドプールの大きさを決める（最初の演算より前に呼ぶこと）"""
+    if intra_op:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    if inter_op:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+    return (tf.config.threading.get_intra_op_parallelism_threads(),
+            tf.config.threading.get_inter_op_parallelism_threads())
+
+
+class ThroughputCallback(keras.callbacks.Callback):
+    """
+    エポックごとの samples/s を測る。1 エポック目はトレース（と XLA のコンパイル）を含むので平均から外す。
+    --profile のときは各エポックを name のイベントとして、samples/s をゲージとしてトレースにも書く
+    """
+
+    def __init__(self, rows, name='epoch'):
+        super().__init__()
+        self.rows = rows
+        self.name = name
+        self.epoch_rates = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._t0 = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        end = time.perf_counter()
+        self.epoch_rates.append(self.rows / (end - self._t0))
+        profiling.complete(self.name, self._t0, end, epoch=epoch, rows=self.rows)
+        profiling.gauge('samples_per_sec', self.epoch_rates[-1])
+
+    @property
+    def samples_per_sec(self):
+        rates = self.epoch_rates[1:] or self.epoch_rates
+        return float(np.mean(rates)) if rates else 0.0
+
+
+def measure_fit(X, y, X_val, y_val, batch_size, epochs, hidden, learning_rate, jit_compile, seed=0):
+    """同じ初期値から batch_size で epochs エポック学習し、(samples/s, 検証 loss) を返す（1 エポック目は慣らし）"""
+    keras.utils.set_random_seed(seed)
+    model = build_model(X.shape[1], y.shape[1], hidden, learning_rate, jit_compile)
+    meter = ThroughputCallback(len(X), name=f'calibration_epoch_bs{batch_size}')
+    model.fit(X, y, batch_size=batch_size, epochs=epochs + 1, verbose=0, callbacks=[meter])
+    val_loss = model.evaluate(X_val, y_val, batch_size=8192, verbose=0)[0]
+    return meter.samples_per_sec, float(val_loss)
+
+
+def tune_batch_size(X, y, X_val, y_val, batch_size, max_batch_size, tolerance, epochs, hidden=DEFAULT_HIDDEN,
+                    learning_rate=None, jit_compile=None):
+    """
+    batch_size, 2 x batch_size, 4 x ... (max_batch_size まで) を同じデータ・同じエポック数で試し、
+    検証 loss が基準（jit なしの batch_size）の (1 + tolerance) 倍以内に収まる最大のバッチサイズを選ぶ。
+    戻り値は (選んだバッチサイズ, 基準の結果, 候補ごとの結果のリスト)
+    """
+    before = {'batch_size': batch_size, 'jit_compile': None}
+    before['samples_per_sec'], before['val_loss'] = measure_fit(X, y, X_val, y_val, batch_size, epochs,
+                                                                hidden, learning_rate, None)
+    trials = []
+    candidate = batch_size
+    while candidate <= max(max_batch_size, batch_size) and candidate <= len(X):
+        if candidate == batch_size and not jit_compile:
+            trial = dict(before)
+        else:
+            trial = {'batch_size': candidate, 'jit_compile': jit_compile}
+            trial['samples_per_sec'], trial['val_loss'] = measure_fit(X, y, X_val, y_val, candidate, epochs,
+                                                                      hidden, learning_rate, jit_compile)
+        trial['ok'] = trial['val_loss'] <= before['val_loss'] * (1 + tolerance)
+        trials.append(trial)
+        candidate *= 2
+    chosen = max((t['batch_size'] for t in trials if t['ok']), default=batch_size)
+    return chosen, before, trials
+
+
+def calibration_rows(X, y, X_val, y_val, rows):
+    """試し学習用に学習 rows 行と検証 rows / 4 行を先頭から取り出して float32 の配列にする"""
+    n_val = max(1, rows // 4)
+    return (np.asarray(X[:rows], dtype=np.float32), np.asarray(y[:rows], dtype=np.float32),
+            np.asarray(X_val[:n_val], dtype=np.float32), np.asarray(y_val[:n_val], dtype=np.float32))
+
+
+def print_tuning(chosen, before, trials, tolerance):
+    print(f'Batch size calibration (val loss within {tolerance:.0%} of batch {before["batch_size"]}):')
+    for t in trials:
+        mark = '*' if t['batch_size'] == chosen else ' '
+        print(f" {mark} batch {t['batch_size']:>6}{' xla' if t['jit_compile'] else '    '}: "
+              f"{t['samples_per_sec']:>10.0f} samples/s, val_loss {t['val_loss']:.5f}"
+              + ('' if t['ok'] else ' (over tolerance)'))
+    after = next(t for t in trials if t['batch_size'] == chosen)
+    speedup = after['samples_per_sec'] / before['samples_per_sec'] if before['samples_per_sec'] else 0.0
+    print(f'  before: batch {before["batch_size"]} {before["samples_per_sec"]:.0f} samples/s -> '
+          f'after: batch {chosen} {after["samples_per_sec"]:.0f} samples/s ({speedup:.2f}x)')
+
+
+# ---- resume: 新しいデータだけで追加学習 ----
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_VERSION = 1
+CHECKPOINT_DIR = 'checkpoint'
+
+
+def dataset_stat(path):
+    # 内容ハッシュを取り直すかどうかの目安（ファイルごとのサイズと更新時刻）
+    path = Path(path)
+    files = sorted(path.iterdir()) if path.is_dir() else [path]
+    return [[f.name, f.stat().st_size, f.stat().st_mtime_ns] for f in files if f.is_file()]
+
+
+def dataset_entry(path, known=None):
+    """manifest に残すデータセットの記録。known（前回の記録）と stat が同じなら内容ハッシュを使い回す"""
+    stat = dataset_stat(path)
+    digest = known['digest'] if known and known.get('stat') == stat else dataset_digest(path)
+    return {'path': str(path), 'digest': digest, 'stat': stat}
+
+
+def load_manifest(outdir):
+    """--out の manifest.json を読む（なければ None）"""
+    path = Path(outdir) / MANIFEST_FILE
+    if not path.exists():
+        return None
+    manifest = json.loads(path.read_text(encoding='utf-8'))
+    if manifest.get('version') != MANIFEST_VERSION:
+        raise ValueError(f'{path}: manifest version {manifest.get("version")} is not supported '
+                         f'(expected {MANIFEST_VERSION})')
+    return manifest
+
+
+def training_checkpoint(model):
+    """重みと optimizer の状態（Adam のモーメントと iterations）をまとめた tf.train.Checkpoint"""
+    model.optimizer.build(model.trainable_variables)
+    return tf.train.Checkpoint(model=model, optimizer=model.optimizer)
+
+
+def save_training_state(outdir, model, entries, spec, run, manifest=None):
+    """
+    checkpoint を書いてから manifest.json を置き換える（一時ファイルから os.replace）。
+    途中で落ちても manifest は前回のままなので、次の --resume は同じデータをもう一度学習するだけで済む。
+    """
+    outdir = Path(outdir)
+    training_checkpoint(model).write(str(outdir / CHECKPOINT_DIR / 'ckpt'))
+    manifest = manifest or {'version': MANIFEST_VERSION, 'consumed': [], 'runs': []}
+    consumed = {e['digest'] for e in manifest['consumed']}
+    for e in entries:
+        if e['digest'] not in consumed:
+            consumed.add(e['digest'])
+            manifest['consumed'].append(e)
+    manifest['runs'].append(dict(run, time=datetime.now(timezone.utc).isoformat(timespec='seconds')))
+    hidden = [layer.units for layer in model.layers if isinstance(layer, keras.layers.Dense)][:-1]
+    manifest.update(input_dim=int(model.inputs[0].shape[-1]), output_dim=int(model.outputs[0].shape[-1]),
+                    hidden=hidden, feature_spec=spec)
+    tmp = outdir / (MANIFEST_FILE + '.tmp')
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+    os.replace(tmp, outdir / MANIFEST_FILE)
+    return manifest
+
+
+def replay_rows(paths, n, rng):
+    """paths の全行から n 行を一様に非復元抽出し、データセットごとの行番号（昇順）で返す"""
+    sizes = np.array([len(open_dataset(p)) for p in paths], dtype=np.int64)
+    n = int(min(n, sizes.sum()))
+    picked = np.sort(rng.choice(int(sizes.sum()), size=n, replace=False)) if n else np.zeros(0, np.int64)
+    offsets = np.concatenate(([0], np.cumsum(sizes)))
+    cuts = np.searchsorted(picked, offsets)
+    return [picked[a:b] - off for a, b, off in zip(cuts[:-1], cuts[1:], offsets[:-1])]
+
+
+def resume_training(args, callbacks=None):
+    """
+    --resume: --out の checkpoint から重みと optimizer の状態を戻し、manifest にない（新しい）データセットと
+    学習済みデータセットからの replay サンプルで追加学習する。
+    replay の元は manifest に記録された学習済みデータセット（同じ場所に同じ内容で残っているもの）と、
+    --train のうち学習済みのもの。新しいデータがなければ学習せずに None を返す。
+    戻り値は (model, spec, entries, run, manifest)
+    """
+    outdir = Path(args.out)
+    manifest = load_manifest(outdir)
+    if manifest is None or not (outdir / CHECKPOINT_DIR).exists():
+        raise ValueError(f'{outdir}: nothing to resume from (no {MANIFEST_FILE} / {CHECKPOINT_DIR}); '
+                         'train once without --resume')
+    if (manifest.get('feature_spec') or {}).get('window'):
+        raise ValueError('window models cannot be resumed')
+    known = {e['path']: e for e in manifest['consumed']}
+    consumed = {e['digest'] for e in manifest['consumed']}
+    entries = [dataset_entry(p, known.get(str(p))) for p in args.train]
+    new, old, seen = [], [], set()
+    for e in entries:
+        if e['digest'] not in seen:
+            seen.add(e['digest'])
+            (old if e['digest'] in consumed else new).append(e)
+    if not new:
+        return None
+    for e in manifest['consumed']:
+        if e['digest'] not in seen and Path(e['path']).exists() and dataset_stat(e['path']) == e['stat']:
+            seen.add(e['digest'])
+            old.append(e)
+
+    new_paths = [e['path'] for e in new]
+    old_paths = [e['path'] for e in old]
+    spec = dataset_feature_spec(new_paths + old_paths + list(args.val or []))
+    if spec != manifest.get('feature_spec'):
+        raise ValueError('new datasets were built with a different feature spec than the checkpoint')
+    n_new = sum(len(open_dataset(p)) for p in new_paths)
+    # 同じ manifest からの再実行では同じ replay サンプルになるように、シードは学習回数から決める
+    rng = np.random.default_rng(len(manifest['runs']))
+    picks = replay_rows(old_paths, round(n_new * args.replay_ratio), rng) if old_paths else []
+    n_replay = sum(len(idx) for idx in picks)
+    train_ds, n_train = make_pipeline(new_paths + old_paths, args.batch_size, shuffle=True,
+                                      shuffle_buffer=args.shuffle_buffer, block_size=args.block_size,
+                                      rows=[None] * len(new_paths) + picks)
+    val_ds = None
+    if args.val:
+        val_ds, _ = make_pipeline(args.val, args.batch_size, shuffle=False, block_size=args.block_size)
+    x_dim = int(train_ds.element_spec[0].shape[1])
+    if x_dim != manifest['input_dim']:
+        raise ValueError(f'checkpoint expects {manifest["input_dim"]} features, new data has {x_dim}')
+
+    model = build_model(manifest['input_dim'], manifest['output_dim'], manifest.get('hidden', DEFAULT_HIDDEN),
+                        args.learning_rate, args.jit_compile)
+    training_checkpoint(model).read(str(outdir / CHECKPOINT_DIR / 'ckpt')).assert_existing_objects_matched()
+    print(f'Resuming from {outdir / CHECKPOINT_DIR} (optimizer step {int(model.optimizer.iterations)}): '
+          f'{n_new} new rows from {len(new)} datasets, {n_replay} replay rows from {len(old)} consumed datasets')
+    for e in new:
+        print('  new:', e['path'])
+    with profiling.stage('fit', epochs=args.epochs):
+        model.fit(train_ds, epochs=args.epochs, validation_data=val_ds,
+                  callbacks=callbacks(n_new + n_replay) if callbacks else None)
+    run = {'mode': 'resume', 'epochs': args.epochs, 'new': [e['digest'] for e in new],
+           'rows': n_new, 'replay_rows': n_replay}
+    return model, spec, new, run, manifest
+
+
+# ---- export: ブラウザ配布用の TFJS モデル ----
+
+EXPORT_QUANTIZE = ('none', 'float16', 'uint8')
+
+
+def model_layers(model):
+    """
+    Dense / BatchNormalization だけからなるモデルを
+    [('dense', {'W', 'b', 'activation'}), ('bn', {'gamma', 'beta', 'mean', 'var', 'epsilon'}), ...] にする
+    """
+    layers = []
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.InputLayer):
+            continue
+        if isinstance(layer, keras.layers.Dense):
+            W, b = (np.asarray(w, dtype=np.float32) for w in layer.get_weights())
+            activation = keras.activations.serialize(layer.activation)
+            if activation not in ACTIVATIONS:
+                raise ValueError(f'cannot export activation {activation} of {layer.name}')
+            layers.append(('dense', {'W': W, 'b': b, 'activation': activation}))
+        elif isinstance(layer, keras.layers.BatchNormalization):
+            mean = np.asarray(layer.moving_mean, dtype=np.float32)
+            ones = np.ones_like(mean)
+            layers.append(('bn', {
+                'gamma': np.asarray(layer.gamma, dtype=np.float32) if layer.gamma is not None else ones,
+                'beta': np.asarray(layer.beta, dtype=np.float32) if layer.beta is not None else ones * 0,
+                'mean': mean,
+                'var': np.asarray(layer.moving_variance, dtype=np.float32),
+                'epsilon': float(layer.epsilon),
+            }))
+        else:
+            raise ValueError(f'cannot export layer {layer.name} ({type(layer).__name__})')
+    return layers
+
+
+def prune_layers(layers, sparsity):
+    """出力層以外の Dense の重みを絶対値の小さい順に sparsity の割合だけ 0 にする（バイアスはそのまま）"""
+    dense = [i for i, (kind, _) in enumerate(layers) if kind == 'dense']
+    out = [(kind, dict(p)) for kind, p in layers]
+    for i in dense[:-1]:
+        W = out[i][1]['W'].copy()
+        k = int(W.size * sparsity)
+        if k:
+            W.ravel()[np.argpartition(np.abs(W).ravel(), k - 1)[:k]] = 0
+        out[i][1]['W'] = W
+    return out
+
+
+def quantize_weight(w, mode):
+    """
+    tensorflowjs_converter の重み量子化を再現して、(保存されるバイト列, 復元後の float32) を返す。
+    uint8 はテンソルごとの min / scale によるアフィン量子化。
+    """
+    if mode == 'float16':
+        q = w.astype(np.float16)
+        return q.tobytes(), q.astype(np.float32)
+    if mode == 'uint8':
+        lo, hi = float(w.min()), float(w.max())
+        scale = (hi - lo) / 255 or 1.0
+        q = np.rint((w - lo) / scale).astype(np.uint8)
+        return q.tobytes(), (q.astype(np.float32) * scale + lo).astype(np.float32)
+    return w.astype(np.float32).tobytes(), w.astype(np.float32)
+
+
+def quantize_layers(layers, mode):
+    """全ての重みを量子化したときの (復元後の layers, 重みのバイト数, gzip 後のバイト数)"""
+    blobs = []
+    out = []
+    for kind, p in layers:
+        q = {}
+        for name, v in p.items():
+            if isinstance(v, np.ndarray):
+                blob, q[name] = quantize_weight(v, mode)
+                blobs.append(blob)
+            else:
+                q[name] = v
+        out.append((kind, q))
+    data = b''.join(blobs)
+    return out, len(data), len(gzip.compress(data, 9))
+
+
+def build_from_layers(layers, input_dim):
+    """layers から同じ計算をする Keras モデルを組み立てる（tensorflowjs_converter に渡す用）"""
+    model = keras.Sequential([keras.layers.Input(shape=(input_dim,))])
+    for kind, p in layers:
+        if kind == 'dense':
+            layer = keras.layers.Dense(p['W'].shape[1], activation=p['activation'])
+            model.add(layer)
+            layer.set_weights([p['W'], p['b']])
+        else:
+            layer = keras.layers.BatchNormalization(epsilon=p['epsilon'])
+            model.add(layer)
+            layer.set_weights([p['gamma'], p['beta'], p['mean'], p['var']])
     return model
 
 
+def load_eval_rows(paths, input_dim, max_rows):
+    """--val のデータセットから先頭 max_rows 行までの (X, y) を集める"""
+    Xs, ys = [], []
+    left = max_rows
+    for path in paths:
+        ds = open_dataset(path)
+        if ds.X.shape[1] != input_dim:
+            raise ValueError(f'{path}: X has {ds.X.shape[1]} columns, model expects {input_dim}')
+        n = min(left, len(ds))
+        Xs.append(np.asarray(ds.X[:n], dtype=np.float32))
+        ys.append(np.asarray(ds.y[:n], dtype=np.float32))
+        left -= n
+        if not left:
+            break
+    return np.concatenate(Xs), np.concatenate(ys)
+
+
+def export_report(model, exported, quantize, X=None, y=None, batch_size=8192):
+    """元のモデルと書き出すモデルのサイズ・精度を比べる"""
+    original_params = sum(int(np.prod(w.shape)) for w in model.weights)
+    weights = [v for _, p in exported for v in p.values() if isinstance(v, np.ndarray)]
+    quantized, nbytes, nbytes_gz = quantize_layers(exported, quantize)
+    original_blob = b''.join(np.asarray(w, dtype=np.float32).tobytes() for w in model.weights)
+    report = {
+        'quantize': quantize,
+        'params': {
+            'original': original_params,
+            'exported': sum(w.size for w in weights),
+            'nonzero': int(sum(np.count_nonzero(w) for w in weights)),
+        },
+        'bytes': {
+            'original_weights': len(original_blob),
+            'original_weights_gzip': len(gzip.compress(original_blob, 9)),
+            'exported_weights': nbytes,
+            'exported_weights_gzip': nbytes_gz,
+        },
+    }
+    if X is not None:
+        ref = np.concatenate([np.asarray(model(X[i:i + batch_size], training=False))
+                              for i in range(0, len(X), batch_size)])
+        out = np.concatenate([forward(quantized, X[i:i + batch_size]) for i in range(0, len(X), batch_size)])
+        report['accuracy'] = {
+            'rows': len(X),
+            'original_mae': float(np.abs(ref - y).mean()),
+            'exported_mae': float(np.abs(out - y).mean()),
+            'max_abs_diff': float(np.abs(out - ref).max()),
+            'per_label_mae': {k: [float(np.abs(ref[:, i] - y[:, i]).mean()), float(np.abs(out[:, i] - y[:, i]).mean())]
+                              for i, k in enumerate(LABELS[:y.shape[1]])},
+        }
+    return report, quantized
+
+
+def write_numpy_model(layers, out, spec=None):
+    """numpy_model.py 用の model.npz を書き出す"""
+    path = save_numpy_model(out, fold_batchnorm(layers), meta={'labels': LABELS, 'feature_spec': spec})
+    print('NumPy model written to', path)
+    return path
+
+
+def print_report(report):
+    b = report['bytes']
+    print(f"  weights  {b['original_weights']:>10d} B -> {b['exported_weights']:>10d} B "
+          f"({b['exported_weights'] / b['original_weights']:.1%})")
+    print(f"  gzip     {b['original_weights_gzip']:>10d} B -> {b['exported_weights_gzip']:>10d} B "
+          f"({b['exported_weights_gzip'] / b['original_weights_gzip']:.1%})")
+    if 'numpy_max_abs_diff' in report:
+        print(f"  model.npz vs Keras max |diff| {report['numpy_max_abs_diff']:.2e}")
+    pr = report['params']
+    print(f"  params   {pr['original']:>10d}   -> {pr['exported']:>10d}   ({pr['nonzero']} nonzero)")
+    if 'accuracy' in report:
+        a = report['accuracy']
+        print(f"  MAE on {a['rows']} rows: {a['original_mae']:.5f} -> {a['exported_mae']:.5f} "
+              f"(max |diff| {a['max_abs_diff']:.5f})")
+        for k, (before, after) in a['per_label_mae'].items():
+            print(f'    {k:10s} {before:.5f} -> {after:.5f}')
+
+
+def export_main(argv):
+    p = argparse.ArgumentParser(prog='train_model.py export',
+                                description='write a size-optimized TFJS model for the browser')
+    p.add_argument('--model', required=True,
+                   help='model.keras written by train_model.py (or the saved-model folder that contains it)')
+    p.add_argument('--out', required=True, help='output folder (tfjs_model/ and report.json)')
+    p.add_argument('--quantize', choices=EXPORT_QUANTIZE, default='float16', help='weight quantization')
+    p.add_argument('--prune', type=float, default=0.0,
+                   help='fraction of the smallest hidden Dense weights to zero (e.g. 0.5)')
+    p.add_argument('--fold-bn', action=argparse.BooleanOptionalAction, default=True,
+                   help='fold BatchNormalization into the neighbouring Dense layer')
+    p.add_argument('--val', nargs='+', help='dataset(s) to compare accuracy on')
+    p.add_argument('--eval-rows', type=int, default=100000, help='max validation rows for the report')
+    p.add_argument('--profile', metavar='TRACE_JSON',
+                   help='write stage timings and RSS as a Chrome trace (open in chrome://tracing)')
+    args = p.parse_args(argv)
+    if not 0 <= args.prune < 1:
+        p.error('--prune must be in [0, 1)')
+
+    profiling.start(args.profile)
+    model_path = Path(args.model)
+    if model_path.is_dir():
+        model_path = model_path / KERAS_MODEL
+    if not model_path.is_file():
+        p.error(f'{model_path} not found (train_model.py writes saved-model/{KERAS_MODEL})')
+    with profiling.stage('load_model'):
+        model = keras.models.load_model(model_path, compile=False)
+    input_dim = int(model.inputs[0].shape[-1])
+    layers = model_layers(model)
+    exported = fold_batchnorm(layers) if args.fold_bn else layers
+    if args.prune:
+        exported = prune_layers(exported, args.prune)
+
+    X = y = None
+    if args.val:
+        try:
+            with profiling.stage('load_data'):
+                X, y = load_eval_rows(args.val, input_dim, args.eval_rows)
+        except ValueError as e:
+            p.error(str(e))
+    with profiling.stage('export_report'):
+        report, quantized = export_report(model, exported, args.quantize, X, y)
+    report.update({'model': str(args.model), 'prune': args.prune, 'fold_bn': args.fold_bn,
+                   'layers': [k if k == 'bn' else f"dense({p['W'].shape[1]}, {p['activation']})"
+                              for k, p in exported]})
+
+    outdir = Path(args.out)
+    outdir.mkdir(parents=True, exist_ok=True)
+    spec = read_feature_spec(model_path.parent)
+    if spec:
+        write_feature_spec(outdir, spec)
+    # model.npz は量子化しない（枝刈りはそのまま反映）
+    with profiling.stage('save_numpy_model'):
+        npz = write_numpy_model(exported, outdir, spec)
+    if X is not None:
+        ref = np.asarray(model(X[:8192], training=False))
+        report['numpy_max_abs_diff'] = float(np.abs(load_numpy_model(npz).predict(X[:8192]) - ref).max())
+    tfjs_out = outdir / 'tfjs_model'
+    with tempfile.TemporaryDirectory() as tmp:
+        # 畳み込み・枝刈りした float32 のモデルを h5 にして、量子化は converter に任せる
+        h5 = str(Path(tmp) / 'export.h5')
+        build_from_layers(exported, input_dim).save(h5)
+        cmd = ['tensorflowjs_converter', '--input_format=keras', '--output_format=tfjs_layers_model']
+        if args.quantize != 'none':
+            cmd.append(f'--quantize_{args.quantize}')
+        cmd += [h5, str(tfjs_out)]
+        print('Running tfjs converter:', ' '.join(cmd))
+        try:
+            with profiling.stage('tfjs_convert'):
+                subprocess.check_call(cmd)
+        except Exception as e:
+            print('tfjs conversion skipped or failed:', e)
+        else:
+            report['tfjs_files'] = {f.name: f.stat().st_size for f in sorted(tfjs_out.iterdir())}
+            if spec:
+                write_feature_spec(tfjs_out, spec)
+            print('TFJS model written to', tfjs_out)
+
+    (outdir / 'report.json').write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f"Export report ({args.quantize}, prune {args.prune:g}, fold_bn {args.fold_bn}):")
+    print_report(report)
+    print('Wrote', outdir / 'report.json')
+
+
 def main():
     p = argparse.ArgumentParser()
-    p.add_argument('--train', required=True, help='train npz produced by build_dataset.py')
+    p.add_argument('--train', required=True, nargs='+',
+                   help='train npz (or npy directory) produced by build_dataset.py; several with --pipeline')
     p.add_argument('--out', required=True, help='output folder for saved-model')
     p.add_argument('--epochs', type=int, default=50)
+    p.add_argument('--batch-size', type=int, default=32)
+    p.add_argument('--hidden', type=int, nargs='+', default=list(DEFAULT_HIDDEN), metavar='UNITS',
+                   help='hidden layer sizes (default: 128 64; sweep.py ranks alternatives)')
+    p.add_argument('--learning-rate', type=float, help='Adam learning rate (default: 0.001)')
+    p.add_argument('--pipeline', action='store_true', help='stream the datasets through tf.data')
+    p.add_argument('--val', nargs='+', help='held-out validation dataset(s) for --pipeline')
+    p.add_argument('--shuffle-buffer', type=int, default=10000, help='row shuffle buffer for --pipeline')
+    p.add_argument('--block-size', type=int, default=4096, help='rows read per parallel map call for --pipeline')
+    p.add_argument('--window', type=int, help='train on fixed-length frame windows of a --sequence dataset')
+    p.add_argument('--stride', type=int, default=1, help='frames between window starts with --window')
+    p.add_argument('--resume', action='store_true',
+                   help='continue from the checkpoint in --out, training only on --train datasets not yet '
+                        'consumed plus a replay sample of consumed ones')
+    p.add_argument('--replay-ratio', type=float, default=0.25,
+                   help='replay rows from consumed datasets per new row with --resume')
+    p.add_argument('--perf', action='store_true',
+                   help='performance mode: use all cores, calibrate the batch size and report samples/s')
+    p.add_argument('--intra-op-threads', type=int, help='threads per op (default: all cores with --perf)')
+    p.add_argument('--inter-op-threads', type=int, help='ops run in parallel (default: 2 with --perf)')
+    p.add_argument('--jit-compile', action='store_true', help='compile the train step with XLA')
+    p.add_argument('--autotune-batch-size', action='store_true',
+                   help='pick the largest batch size whose validation loss stays within --autotune-tolerance '
+                        '(on by default with --perf)')
+    p.add_argument('--autotune-tolerance', type=float, default=0.02,
+                   help='allowed relative increase of validation loss over --batch-size')
+    p.add_argument('--autotune-max-batch-size', type=int, default=4096)
+    p.add_argument('--autotune-rows', type=int, default=50000, help='training rows used for each calibration run')
+    p.add_argument('--autotune-epochs', type=int, default=2, help='epochs per calibration run (after one warm-up)')
+    p.add_argument('--profile', metavar='TRACE_JSON',
+                   help='write stage timings, per-epoch samples/s and RSS as a Chrome trace (open in chrome://tracing)')
     args = p.parse_args()
+    profiling.start(args.profile)
+
+    if args.window and args.pipeline:
+        p.error('--window is not supported with --pipeline')
+    if args.window and args.resume:
+        p.error('--window is not supported with --resume')
+    args.jit_compile = args.jit_compile or None
+    autotune = args.autotune_batch_size or args.perf
+    if autotune and (args.window or args.resume):
+        p.error('batch size autotuning is not supported with --window or --resume')
+    if args.perf or args.intra_op_threads or args.inter_op_threads:
+        cores = os.cpu_count() or 1
+        intra, inter = configure_threads(args.intra_op_threads or (cores if args.perf else None),
+                                         args.inter_op_threads or (2 if args.perf else None))
+        print(f'Threads: intra-op {intra}, inter-op {inter}' + (', XLA on' if args.jit_compile else ''))
+    meters = []
+    calibration = {}
+
+    def callbacks(rows):
+        # --perf / --profile のときだけ本番の学習のスループットを測る
+        if not (args.perf or args.profile):
+            return None
+        meters.append(ThroughputCallback(rows))
+        return meters[-1:]
+
+    def autotuned_batch_size(X, y, X_val, y_val):
+        if not autotune:
+            return args.batch_size
+        with profiling.stage('autotune'):
+            chosen, before, trials = tune_batch_size(*calibration_rows(X, y, X_val, y_val, args.autotune_rows),
+                                                     args.batch_size, args.autotune_max_batch_size,
+                                                     args.autotune_tolerance, args.autotune_epochs, args.hidden,
+                                                     args.learning_rate, args.jit_compile)
+        print_tuning(chosen, before, trials, args.autotune_tolerance)
+        calibration.update(before=before, trials=trials, batch_size=chosen)
+        return chosen
+
+    manifest = None
+    if args.resume:
+        try:
+            with profiling.stage('resume'):
+                resumed = resume_training(args, callbacks)
+        except ValueError as e:
+            p.error(str(e))
+        if resumed is None:
+            print(f'No new data in --train (all {len(args.train)} datasets already consumed); nothing to do')
+            return
+        model, spec, entries, run, manifest = resumed
+    elif args.pipeline:
+        train_paths = list(args.train)
+        val_paths = args.val
+        if not val_paths:
+            # 検証シャードの指定がなければ最後の学習シャードを検証用に取り分ける
+            if len(train_paths) < 2:
+                p.error('--pipeline needs --val or at least two --train shards')
+            val_paths = [train_paths.pop()]
+        try:
+            spec = dataset_feature_spec(train_paths + list(val_paths))
+        except ValueError as e:
+            p.error(str(e))
+        if autotune:
+            # 試し学習は先頭のシャードから
+            first, first_val = open_dataset(train_paths[0]), open_dataset(val_paths[0])
+            args.batch_size = autotuned_batch_size(first.X, first.y, first_val.X, first_val.y)
+        train_ds, n_train = make_pipeline(train_paths, args.batch_size, shuffle=True,
+                                          shuffle_buffer=args.shuffle_buffer, block_size=args.block_size)
+        val_ds, n_val = make_pipeline(val_paths, args.batch_size, shuffle=False, block_size=args.block_size)
+        x_dim, y_dim = (int(d) for d in (train_ds.element_spec[0].shape[1], train_ds.element_spec[1].shape[1]))
+        print('Pipeline', n_train, 'train rows from', len(train_paths), 'shards,', n_val, 'validation rows')
+
+        model = build_model(x_dim, y_dim, args.hidden, args.learning_rate, args.jit_compile)
+        model.summary()
+        with profiling.stage('fit', epochs=args.epochs):
+            model.fit(train_ds, epochs=args.epochs, validation_data=val_ds, callbacks=callbacks(n_train))
+        entries = [dataset_entry(p) for p in train_paths]
+        run = {'mode': 'fresh', 'epochs': args.epochs, 'new': [e['digest'] for e in entries], 'rows': n_train}
+    else:
+        if len(args.train) > 1:
+            p.error('several --train datasets require --pipeline')
+        with profiling.stage('load_data'):
+            data = open_dataset(args.train[0])
+            spec = data.meta.get('feature_spec')
+            X = data.X
+            y = data.y
+            w = data['w'] if 'w' in data else None
+        profiling.count('rows_loaded', len(X))
+        print('Loaded', X.shape, y.shape, '(mmap)' if data.mmapped else '',
+              f"(quantized {data.meta['quantization']['mode']})" if data.quantized else '',
+              '(weighted)' if w is not None else '')
 
-    data = np.load(args.train)
-    X = data['X']
-    y = data['y']
-    print('Loaded', X.shape, y.shape)
+        view = None
+        input_dim = X.shape[1]
+        if args.window:
+            try:
+                view = data.windows(args.window, args.stride)
+            except ValueError as e:
+                p.error(str(e))
+            print('Windows', len(view), 'of', args.window, 'frames from', view.sessions, 'sessions')
+            input_dim = args.window * X.shape[1]
+            if spec:
+                spec = {**spec, 'window': args.window}
 
-    model = build_model(X.shape[1], y.shape[1])
-    model.summary()
+        if autotune:
+            split = int(len(X) * 0.9)
+            args.batch_size = autotuned_batch_size(X[:split], y[:split], X[split:], y[split:])
+        model = build_model(input_dim, y.shape[1], args.hidden, args.learning_rate, args.jit_compile)
+        model.summary()
 
-    model.fit(X, y, epochs=args.epochs, batch_size=32, validation_split=0.1)
+        if view is not None:
+            # 窓はセッション順に並んでいるので、末尾 10% の窓（おおむね最後のセッション群）を検証に使う
+            split = int(len(view) * 0.9)
+            train_seq = WindowSequence(view, args.batch_size, 0, split, shuffle=True)
+            val_seq = WindowSequence(view, args.batch_size, split) if split < len(view) else None
+            with profiling.stage('fit', epochs=args.epochs):
+                model.fit(train_seq, epochs=args.epochs, validation_data=val_seq, callbacks=callbacks(split))
+        elif data.mmapped or data.quantized:
+            # validation_split=0.1 と同じく末尾 10% を検証に使う
+            # 量子化データセットもバッチごとに float32 へ戻すので、全体を展開しない
+            split = int(len(X) * 0.9)
+            train_seq = MemmapSequence(X, y, args.batch_size, 0, split, shuffle=True, w=w)
+            val_seq = MemmapSequence(X, y, args.batch_size, split, len(X), w=w) if split < len(X) else None
+            with profiling.stage('fit', epochs=args.epochs):
+                model.fit(train_seq, epochs=args.epochs, validation_data=val_seq, callbacks=callbacks(split))
+        else:
+            with profiling.stage('fit', epochs=args.epochs):
+                model.fit(X, y, sample_weight=w, epochs=args.epochs, batch_size=args.batch_size,
+                          validation_split=0.1, callbacks=callbacks(int(len(X) * 0.9)))
+        entries = [dataset_entry(args.train[0])]
+        run = {'mode': 'fresh', 'epochs': args.epochs, 'new': [entries[0]['digest']], 'rows': len(X)}
 
     outdir = Path(args.out)
     outdir.mkdir(parents=True, exist_ok=True)
-    saved_path = str(outdir / 'saved-model')
-    model.save(saved_path)
-    print('Saved model to', saved_path)
+    # saved-model より先に書く（--resume が読むのは checkpoint と manifest）
+    if meters:
+        run['samples_per_sec'] = meters[-1].samples_per_sec
+        print(f'Training throughput: {run["samples_per_sec"]:.0f} samples/s at batch {args.batch_size}'
+              + (f' (calibration before: {calibration["before"]["samples_per_sec"]:.0f} samples/s '
+                 f'at batch {calibration["before"]["batch_size"]})' if calibration else ''))
+    if calibration:
+        run['calibration'] = calibration
+    with profiling.stage('save_checkpoint'):
+        save_training_state(outdir, model, entries, spec, run, manifest)
+    saved_path = outdir / 'saved-model'
+    saved_path.mkdir(parents=True, exist_ok=True)
+    # TensorFlow なしで読む model.npz と feature_spec.json を Keras の保存より先に書く
+    if spec:
+        write_feature_spec(saved_path, spec)
+        print('Feature spec:', spec['features'], 'dims', spec['dims'])
+    with profiling.stage('save_numpy_model'):
+        write_numpy_model(model_layers(model), saved_path, spec)
+    # Keras 3 の model.save は .keras / .h5 しか受け付けないので、SavedModel は model.export で書く
+    with profiling.stage('save_model'):
+        model.export(str(saved_path), verbose=False)
+        model.save(saved_path / KERAS_MODEL)
+    print('Saved model to', saved_path, f'(SavedModel and {KERAS_MODEL})')
+    saved_path = str(saved_path)
 
     # tfjs conversion if tfjs-converter installed
     try:
-        import subprocess
         tfjs_out = str(outdir / 'tfjs_model')
         cmd = ["tensorflowjs_converter", "--input_format=tf_saved_model", "--output_format=tfjs_graph_model", saved_path, tfjs_out]
         print('Running tfjs converter:', ' '.join(cmd))
-        subprocess.check_call(cmd)
+        with profiling.stage('tfjs_convert'):
+            subprocess.check_call(cmd)
+        if spec:
+            write_feature_spec(tfjs_out, spec)
         print('TFJS model written to', tfjs_out)
     except Exception as e:
         print('tfjs conversion skipped or failed:', e)
 
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        export_main(sys.argv[2:])
+    else:
+        main()